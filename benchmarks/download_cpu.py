@@ -0,0 +1,96 @@
+"""
+CPU cost of the direct-link download path
+
+Serves a file from a local origin in a separate process and downloads it with
+the original 1 KiB read/write loop and with helpers.downloader, reporting wall
+time, throughput and client CPU seconds per GiB.
+
+    python -m benchmarks.download_cpu --size-mb 1024 --runs 3
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import http_client  # noqa: E402
+from helpers.downloader import download_file  # noqa: E402
+from benchmarks.origin import serve  # noqa: E402
+
+GIB = 1024 ** 3
+
+
+async def legacy_download(url, file_path):
+    """The download loop as it was before the segmented downloader"""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            total_size = int(response.headers.get('content-length', 0))
+            downloaded_size = 0
+            with open(file_path, "wb") as file:
+                async for chunk in response.content.iter_chunked(1024):
+                    file.write(chunk)
+                    downloaded_size += len(chunk)
+    return total_size
+
+
+async def current_download(url, file_path):
+    await download_file(url, file_path)
+    await http_client.close_session()
+
+
+async def measure(name, func, url, size, runs, directory):
+    results = []
+    for run in range(runs):
+        file_path = os.path.join(directory, f"{name}-{run}.bin")
+        cpu, wall = time.process_time(), time.perf_counter()
+        await func(url, file_path)
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        assert os.path.getsize(file_path) == size, f"{name}: incomplete download"
+        os.remove(file_path)
+        http_client.probe_cache.clear()
+        results.append({'wall_s': wall, 'cpu_s': cpu})
+    wall = min(r['wall_s'] for r in results)
+    cpu = min(r['cpu_s'] for r in results)
+    return {
+        'name': name,
+        'wall_s': round(wall, 3),
+        'throughput_mib_s': round(size / wall / 1024 ** 2, 1),
+        'cpu_s_per_gib': round(cpu / (size / GIB), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=512)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8799)
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    ready = multiprocessing.Event()
+    origin = multiprocessing.Process(target=serve, args=(args.port, size, ready), daemon=True)
+    origin.start()
+    ready.wait(10)
+
+    url = f'http://127.0.0.1:{args.port}/file'
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            report = [
+                asyncio.run(measure('legacy_1k_loop', legacy_download, url, size, args.runs, directory)),
+                asyncio.run(measure('download_file', current_download, url, size, args.runs, directory)),
+            ]
+    finally:
+        origin.terminate()
+
+    print(json.dumps({'size_bytes': size, 'results': report}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Stand-in for the Telegram side of the benchmarks
+
+FakeClient implements the slice of pyrogram.Client the upload paths use
+(save_file, send_document/send_video, invoke, resolve_peer, ...) and
+pre-registers FakeSession media sessions with the upload engine, so
+upload_parts() runs its real worker/queue code without a network. Every
+part is read like Pyrogram reads it, and `rate` (bytes per second per
+session, 0 for unlimited) simulates the upload link.
+"""
+import os
+import asyncio
+import itertools
+
+from pyrogram import raw, types
+from pyrogram.parser import Parser
+
+from helpers import upload_engine
+
+PART_SIZE = 512 * 1024
+
+
+class FakeSession:
+    def __init__(self, client, rate=0):
+        self.client = client
+        self.rate = rate
+
+    async def invoke(self, query):
+        if isinstance(query, (raw.functions.upload.SaveBigFilePart, raw.functions.upload.SaveFilePart)):
+            self.client.uploaded_bytes += len(query.bytes)
+            self.client.parts += 1
+            if self.rate:
+                await asyncio.sleep(len(query.bytes) / self.rate)
+            return True
+        return await self.client.invoke(query)
+
+    async def stop(self):
+        pass
+
+
+class FakeClient:
+    parse_mode = None
+
+    def __init__(self, rate=0, sessions=upload_engine.UPLOAD_SESSIONS):
+        self.parser = Parser(None)
+        self.uploaded_bytes = 0
+        self.parts = 0
+        self.sent = []
+        self._session = FakeSession(self, rate)
+        self._ids = itertools.count(1)
+        upload_engine._sessions[id(self)] = [FakeSession(self, rate) for _ in range(sessions)]
+
+    def rnd_id(self):
+        return int.from_bytes(os.urandom(8), 'big', signed=True)
+
+    def guess_mime_type(self, filename):
+        return "application/octet-stream"
+
+    async def resolve_peer(self, peer_id):
+        return raw.types.InputPeerUser(user_id=int(peer_id), access_hash=0)
+
+    async def save_file(self, path, file_id=None, file_part=0, progress=None, progress_args=()):
+        """Read and 'upload' path part by part, the way Pyrogram's save_file does"""
+        size = os.path.getsize(path)
+        total_parts = max(1, -(-size // PART_SIZE))
+        file_id = file_id or self.rnd_id()
+        with open(path, 'rb') as f:
+            for part in range(total_parts):
+                data = f.read(PART_SIZE)
+                await self._session.invoke(
+                    raw.functions.upload.SaveFilePart(file_id=file_id, file_part=part, bytes=data)
+                )
+                if progress:
+                    await progress(min((part + 1) * PART_SIZE, size), size, *progress_args)
+        return raw.types.InputFile(id=file_id, parts=total_parts, name=os.path.basename(path), md5_checksum="")
+
+    def _message(self, chat_id):
+        message = types.Message(id=next(self._ids), empty=True, client=self)
+        self.sent.append((chat_id, message.id))
+        return message
+
+    async def _send(self, chat_id, path, progress, progress_args):
+        await self.save_file(path, progress=progress, progress_args=progress_args or ())
+        return self._message(chat_id)
+
+    async def send_document(self, chat_id, document, progress=None, progress_args=(), **kwargs):
+        return await self._send(chat_id, document, progress, progress_args)
+
+    async def send_video(self, chat_id, video, progress=None, progress_args=(), **kwargs):
+        return await self._send(chat_id, video, progress, progress_args)
+
+    async def invoke(self, query):
+        if isinstance(query, (raw.functions.messages.SendMedia, raw.functions.messages.SendMultiMedia)):
+            message = self._message(query.peer.user_id)
+            return raw.types.Updates(
+                updates=[raw.types.UpdateNewMessage(message=raw.types.MessageEmpty(id=message.id), pts=0, pts_count=0)],
+                users=[], chats=[], date=0, seq=0
+            )
+        raise NotImplementedError(type(query).__name__)
+
+    def close(self):
+        upload_engine._sessions.pop(id(self), None)
@@ -0,0 +1,117 @@
+"""
+Local stand-in origin for the benchmarks
+
+One aiohttp server in its own process, so its CPU doesn't count against the
+client being measured. The query string picks the behaviour of each URL:
+
+    /file?size=<bytes>        body length (default: the server's size)
+    &ranges=0                 ignore Range and don't advertise Accept-Ranges
+    &rate=<bytes per second>  throttle the body
+    &disposition=<variant>    none, plain, quoted or extended (RFC 5987)
+"""
+import os
+import time
+import asyncio
+import multiprocessing
+from urllib.parse import urlencode
+
+from aiohttp import web
+
+BLOCK = os.urandom(1024 * 1024)
+WRITE_SIZE = 256 * 1024
+
+DISPOSITIONS = {
+    'none': None,
+    'plain': 'attachment; filename=bench.bin',
+    'quoted': 'attachment; filename="bench file (1).bin"',
+    'extended': "attachment; filename*=UTF-8''bench%20%C3%A9t%C3%A9.bin",
+}
+
+
+def _body_range(request, size, ranges):
+    if ranges and 'Range' in request.headers:
+        first, last = request.headers['Range'].split('=', 1)[1].split('-')
+        return int(first), int(last) if last else size - 1, 206
+    return 0, size - 1, 200
+
+
+def make_app(default_size):
+    async def handler(request):
+        size = int(request.query.get('size', default_size))
+        ranges = request.query.get('ranges', '1') != '0'
+        rate = int(request.query.get('rate', 0))
+        start, end, status = _body_range(request, size, ranges)
+
+        headers = {'Content-Length': str(end - start + 1), 'Content-Type': 'application/octet-stream'}
+        if ranges:
+            headers['Accept-Ranges'] = 'bytes'
+            headers['ETag'] = f'"bench-{size}"'
+        if status == 206:
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        disposition = DISPOSITIONS[request.query.get('disposition', 'none')]
+        if disposition:
+            headers['Content-Disposition'] = disposition
+
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        if request.method == 'HEAD':
+            return response
+
+        started = time.monotonic()
+        position, sent = start, 0
+        while position <= end:
+            offset = position % len(BLOCK)
+            piece = BLOCK[offset:offset + min(WRITE_SIZE, len(BLOCK) - offset, end - position + 1)]
+            await response.write(piece)
+            position += len(piece)
+            sent += len(piece)
+            if rate:
+                ahead = sent / rate - (time.monotonic() - started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        return response
+
+    app = web.Application()
+    app.router.add_route('*', '/{name}', handler)
+    return app
+
+
+def serve(port, size, ready):
+    async def main():
+        runner = web.AppRunner(make_app(size), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+class Origin:
+    """Context manager running the origin in a child process"""
+
+    def __init__(self, port, size):
+        self.port = port
+        self.size = size
+        self._process = None
+
+    def url(self, name='file', **variant):
+        query = urlencode(variant)
+        return f'http://127.0.0.1:{self.port}/{name}' + (f'?{query}' if query else '')
+
+    def __getstate__(self):
+        # Scenario processes only need the URLs
+        return {**self.__dict__, '_process': None}
+
+    def __enter__(self):
+        ready = multiprocessing.Event()
+        self._process = multiprocessing.Process(target=serve, args=(self.port, self.size, ready), daemon=True)
+        self._process.start()
+        if not ready.wait(10):
+            self._process.terminate()
+            raise RuntimeError(f"Origin didn't start on port {self.port}")
+        return self
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.join()
@@ -0,0 +1,259 @@
+"""
+Throughput, CPU and memory of the URL-to-Telegram pipeline
+
+Runs the link flows against the local origin (benchmarks.origin) and a fake
+Telegram client (benchmarks.fake_telegram), each scenario in a fresh process
+so peak RSS is its own, and prints a JSON report:
+
+    metadata    get_filename/get_file_size per Content-Disposition variant
+    download    async_download_file: ranged, single stream, throttled origin
+    send_file   upload_document, falling back to send_document for small files
+    stream      stream_url_to_chat, straight from the origin to the upload
+
+Every transfer runs without and with the bot's progress callback to show
+what progress reporting costs. Pass --baseline with an earlier report to
+exit non-zero when throughput or CPU per GiB regressed beyond --tolerance.
+
+    python -m benchmarks.pipeline --size-mb 256 --output bench.json
+    python -m benchmarks.pipeline --baseline bench.json
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import http_client  # noqa: E402
+from helpers.utils import async_download_file  # noqa: E402
+from helpers.upload_engine import upload_document  # noqa: E402
+from helpers.stream_upload import stream_url_to_chat  # noqa: E402
+from plugins.utils import get_filename, get_file_size, progress as bot_progress  # noqa: E402
+from benchmarks.origin import Origin, DISPOSITIONS  # noqa: E402
+from benchmarks.fake_telegram import FakeClient  # noqa: E402
+
+MIB = 1024 ** 2
+GIB = 1024 ** 3
+CHAT_ID = 1
+METADATA_CALLS = 50
+
+
+class FakeChat:
+    id = CHAT_ID
+
+
+class FakeMessage:
+    """Progress message for the bot's callback; edits go nowhere"""
+    chat = FakeChat()
+    id = 1
+
+    async def edit_text(self, *args, **kwargs):
+        pass
+
+
+def progress_callback(stats):
+    """plugins.utils.progress, timed"""
+    async def callback(current, total, *args):
+        started = time.perf_counter()
+        await bot_progress(current, total, *args)
+        stats['calls'] += 1
+        stats['seconds'] += time.perf_counter() - started
+
+    return callback
+
+
+async def _metadata(origin, args):
+    results = []
+    for disposition in DISPOSITIONS:
+        url = origin.url(disposition=disposition, size=args.small_mb * MIB)
+        timings = {}
+        for phase in ('cold', 'warm'):
+            started = time.perf_counter()
+            for _ in range(METADATA_CALLS):
+                if phase == 'cold':
+                    http_client.probe_cache.clear()
+                filename = await get_filename(url)
+                await get_file_size(url)
+            timings[f'{phase}_ms_per_call'] = round((time.perf_counter() - started) * 1000 / METADATA_CALLS, 3)
+        results.append({'variant': disposition, 'filename': filename, **timings})
+    await http_client.close_session()
+    return results
+
+
+async def _download(origin, args, variant, progress):
+    query = {'ranged': {}, 'single': {'ranges': 0}, 'throttled': {'rate': args.throttle_mib * MIB}}[variant]
+    size = args.size_mb * MIB
+    path = await async_download_file(
+        origin.url(**query), f"{variant}.bin", progress, (FakeMessage(), time.time(), "Downloading")
+    )
+    assert os.path.getsize(path) == size, f"download/{variant}: incomplete download"
+    os.remove(path)
+    http_client.probe_cache.clear()
+    await http_client.close_session()
+    return size
+
+
+async def _send_file(origin, args, variant, progress):
+    size = (args.small_mb if variant == 'small' else args.size_mb) * MIB
+    path = os.path.abspath(f"{variant}.bin")
+    client = FakeClient(args.upload_rate_mib * MIB)
+    progress_args = (FakeMessage(), time.time(), "Uploading")
+    try:
+        # The cascade uploder.send_file runs for an uncached file
+        sent = await upload_document(client, CHAT_ID, path, variant, None, progress, progress_args)
+        if sent is None:
+            sent = await client.send_document(
+                chat_id=CHAT_ID, document=path, file_name=variant, progress=progress, progress_args=progress_args
+            )
+    finally:
+        client.close()
+    assert sent is not None and client.uploaded_bytes == size, f"send_file/{variant}: incomplete upload"
+    return size
+
+
+async def _stream(origin, args, variant, progress):
+    size = args.size_mb * MIB
+    client = FakeClient(args.upload_rate_mib * MIB)
+    try:
+        sent = await stream_url_to_chat(
+            client, CHAT_ID, origin.url(), "stream.bin", None, progress, (FakeMessage(), time.time(), "Uploading")
+        )
+    finally:
+        client.close()
+    assert sent is not None and client.uploaded_bytes == size, "stream: incomplete upload"
+    http_client.probe_cache.clear()
+    await http_client.close_session()
+    return size
+
+
+TRANSFERS = {
+    'download': (_download, ('ranged', 'single', 'throttled')),
+    'send_file': (_send_file, ('small', 'big')),
+    'stream': (_stream, ('url',)),
+}
+
+
+def _local_file(args, variant):
+    """The file send_file uploads, written before the timed runs"""
+    size = (args.small_mb if variant == 'small' else args.size_mb) * MIB
+    with open(f"{variant}.bin", 'wb') as f:
+        for _ in range(size // MIB):
+            f.write(os.urandom(MIB))
+
+
+async def _measure(origin, args, func, variant):
+    result = {'variant': variant}
+    if func is _send_file:
+        _local_file(args, variant)
+    for mode in ('plain', 'progress'):
+        runs = []
+        for _ in range(args.runs):
+            stats = {'calls': 0, 'seconds': 0.0}
+            progress = progress_callback(stats) if mode == 'progress' else None
+            cpu, wall = time.process_time(), time.perf_counter()
+            size = await func(origin, args, variant, progress)
+            runs.append((time.perf_counter() - wall, time.process_time() - cpu, stats))
+        wall, cpu, stats = min(runs, key=lambda r: r[0])
+        if mode == 'plain':
+            result.update({
+                'size_bytes': size,
+                'wall_s': round(wall, 3),
+                'throughput_mib_s': round(size / wall / MIB, 1),
+                'cpu_s_per_gib': round(cpu / (size / GIB), 3),
+            })
+        else:
+            result['progress'] = {
+                'calls': stats['calls'],
+                'callback_ms': round(stats['seconds'] * 1000, 3),
+                'cpu_s_per_gib': round(cpu / (size / GIB), 3),
+            }
+    return result
+
+
+async def _scenario(scenario, origin, args):
+    if scenario == 'metadata':
+        return await _metadata(origin, args)
+    func, variants = TRANSFERS[scenario]
+    return [await _measure(origin, args, func, variant) for variant in variants]
+
+
+def _run_scenario(scenario, origin, args, queue):
+    os.chdir(args.workdir)
+    try:
+        results = asyncio.run(_scenario(scenario, origin, args))
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        queue.put([{'scenario': scenario, **r, 'peak_rss_mib': round(peak, 1)} for r in results])
+    except Exception as e:
+        queue.put({'scenario': scenario, 'error': f"{type(e).__name__}: {str(e)}"})
+
+
+def run(scenario, origin, args):
+    """Run one scenario in a fresh interpreter and return its result rows"""
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_run_scenario, args=(scenario, origin, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    if isinstance(result, dict):
+        raise RuntimeError(f"{result['scenario']}: {result['error']}")
+    return result
+
+
+def regressions(report, baseline, tolerance):
+    """Rows whose throughput fell, or CPU per GiB rose, by more than tolerance"""
+    previous = {(r['scenario'], r['variant']): r for r in baseline['results']}
+    found = []
+    for row in report['results']:
+        old = previous.get((row['scenario'], row['variant']))
+        if old is None or 'throughput_mib_s' not in row:
+            continue
+        if row['throughput_mib_s'] < old['throughput_mib_s'] * (1 - tolerance):
+            found.append(f"{row['scenario']}/{row['variant']}: throughput "
+                         f"{old['throughput_mib_s']} -> {row['throughput_mib_s']} MiB/s")
+        if row['cpu_s_per_gib'] > old['cpu_s_per_gib'] * (1 + tolerance):
+            found.append(f"{row['scenario']}/{row['variant']}: CPU "
+                         f"{old['cpu_s_per_gib']} -> {row['cpu_s_per_gib']} s/GiB")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=256, help="size of the big transfers")
+    parser.add_argument('--small-mb', type=int, default=8, help="size under the big-file threshold")
+    parser.add_argument('--throttle-mib', type=int, default=50, help="origin rate of the throttled variant")
+    parser.add_argument('--upload-rate-mib', type=int, default=0, help="fake Telegram rate per session, 0 = unlimited")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--scenarios', default='metadata,download,send_file,stream')
+    parser.add_argument('--output', help="also write the report to this file")
+    parser.add_argument('--baseline', help="earlier report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    args = parser.parse_args()
+
+    report = {'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')}, 'results': []}
+    with Origin(args.port, args.size_mb * MIB) as origin, tempfile.TemporaryDirectory() as workdir:
+        args.workdir = workdir
+        for scenario in args.scenarios.split(','):
+            report['results'].extend(run(scenario, origin, args))
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if found else 0)
+
+
+if __name__ == '__main__':
+    main()
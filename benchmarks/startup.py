@@ -0,0 +1,125 @@
+"""
+Cold-start cost of the bot's modules
+
+Imports the modules Pyrogram loads at startup in a fresh interpreter run
+with -X importtime, then answers a /queue command through its handler with
+a stand-in message, and reports as JSON: import time, time to that first
+response, peak RSS, whether yt-dlp got imported, the modules with the
+largest cumulative import time, and how long ytdl_service.prewarm() takes
+(the extractor loading the first link would otherwise wait for).
+
+    python -m benchmarks.startup --runs 5 --top 15
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules loaded before the bot can answer; uploder itself also needs the bot's credentials
+MODULES = ['pyrogram', 'plugins.youtube_dl_handler', 'plugins.batch', 'plugins.jobs', 'plugins.metrics', 'plugins.prewarm',
+           'plugins.archive']
+
+PROBE = """
+import time
+started = time.perf_counter()
+import sys, json, asyncio, resource
+for name in {modules!r}:
+    __import__(name)  # -X importtime doesn't see importlib.import_module
+imported = time.perf_counter() - started
+yt_dlp_loaded = 'yt_dlp' in sys.modules
+
+
+class Chat:
+    id = 1
+
+
+class User:
+    id = 1
+
+
+class Message:
+    chat = Chat()
+    from_user = User()
+    command = ['queue']
+
+    async def reply_text(self, text, **kwargs):
+        self.reply = text
+
+
+async def first_response():
+    from plugins.jobs import queue_command
+    message = Message()
+    await queue_command(None, message)
+    return message.reply
+
+
+async def prewarm():
+    from helpers import ytdl_service
+    started = time.perf_counter()
+    await ytdl_service.prewarm()
+    return time.perf_counter() - started
+
+
+assert asyncio.run(first_response())
+responded = time.perf_counter() - started
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({{
+    'import_s': imported, 'first_response_s': responded, 'peak_rss_mib': rss,
+    'yt_dlp_imported_at_startup': yt_dlp_loaded,
+    'prewarm_s': asyncio.run(prewarm()) if {prewarm!r} else None,
+}}))
+"""
+
+
+def parse_importtime(stderr):
+    """{module: (self µs, cumulative µs)} from -X importtime output"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(own), int(cumulative))
+    return modules
+
+
+def measure(modules, prewarm):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(modules=modules, prewarm=prewarm)],
+        cwd=ROOT, capture_output=True, text=True, env={**os.environ, 'YTDL_PREWARM': 'False'}
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10, help="slowest imports to list")
+    parser.add_argument('--modules', default=",".join(MODULES))
+    args = parser.parse_args()
+
+    modules = args.modules.split(",")
+    runs = [measure(modules, prewarm=run == 0) for run in range(args.runs)]
+    best, imports = min(runs, key=lambda r: r[0]['first_response_s'])
+    slowest = sorted(imports.items(), key=lambda item: item[1][1], reverse=True)
+    report = {
+        'modules': modules,
+        'import_s': round(best['import_s'], 3),
+        'first_response_s': round(best['first_response_s'], 3),
+        'peak_rss_mib': round(best['peak_rss_mib'], 1),
+        'yt_dlp_imported_at_startup': best['yt_dlp_imported_at_startup'],
+        'prewarm_s': round(runs[0][0]['prewarm_s'], 3),
+        'slowest_imports': [
+            {'module': name, 'cumulative_ms': round(cumulative / 1000, 1), 'self_ms': round(own / 1000, 1)}
+            for name, (own, cumulative) in slowest[:args.top]
+        ],
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,12 +15,119 @@ DOWNLOAD_LOCATION = "./DOWNLOADS"  # File / video download location
 # Chunk size that should be used with requests
 CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 128))
 
+# Parallel connections used for direct links when the origin supports byte ranges
+DOWNLOAD_CONNECTIONS = int(os.environ.get("DOWNLOAD_CONNECTIONS", 8))
+# Files smaller than this (in bytes) are fetched with a single connection
+MIN_SEGMENT_SIZE = int(os.environ.get("MIN_SEGMENT_SIZE", 8 * 1024 * 1024))
+
+# Upload direct links to Telegram while they download instead of staging them on disk
+STREAM_UPLOAD = os.environ.get("STREAM_UPLOAD", "True").lower() == "true"
+# 512 KiB parts held in memory between the download and the upload
+STREAM_BUFFER_PARTS = int(os.environ.get("STREAM_BUFFER_PARTS", 32))
+# Concurrent saveBigFilePart requests per upload, spread over UPLOAD_SESSIONS media connections
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 8))
+UPLOAD_SESSIONS = int(os.environ.get("UPLOAD_SESSIONS", 2))
+# Upload files above the 2 GB bot limit with the (premium) SESSION_STRING account.
+# The file is posted to LARGE_FILE_CHAT, where the bot must be able to read it, and copied to the user
+PREMIUM_UPLOADS = os.environ.get("PREMIUM_UPLOADS", "False").lower() == "true"
+LARGE_FILE_CHAT = int(os.environ.get("LARGE_FILE_CHAT", 0))
+
+# Job scheduler limits
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", 3))
+MAX_JOBS_PER_USER = int(os.environ.get("MAX_JOBS_PER_USER", 1))
+# Disk space (bytes) always kept free on the download volume
+MIN_FREE_DISK = int(os.environ.get("MIN_FREE_DISK", 512 * 1024 * 1024))
+# Seconds after which files no job owns in the download folders are deleted
+STALE_FILE_AGE = int(os.environ.get("STALE_FILE_AGE", 6 * 60 * 60))
+# Total transfer rate for the node in bytes per second, 0 for unlimited
+BANDWIDTH_LIMIT = int(os.environ.get("BANDWIDTH_LIMIT", 0))
+
+# Previously uploaded files, resent by Telegram file_id instead of uploading again
+UPLOAD_CACHE_DB = os.environ.get("UPLOAD_CACHE_DB", "upload_cache.db")
+UPLOAD_CACHE_SIZE = int(os.environ.get("UPLOAD_CACHE_SIZE", 10000))
+
+# Durable job state for recovery after restarts: SQLite file, or MongoDB when DATABASE_URL is set
+JOB_STORE_DB = os.environ.get("JOB_STORE_DB", "jobs.db")
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
+# Seconds job state changes are batched before being written
+JOB_STORE_FLUSH_INTERVAL = float(os.environ.get("JOB_STORE_FLUSH_INTERVAL", 1))
+
+# Broker between the bot and `python -m worker` processes: "sqlite:///jobs_queue.db" for
+# workers on this machine, "redis://host:6379/0" for workers on several. Empty runs jobs in the bot
+BROKER_URL = os.environ.get("BROKER_URL", "")
+# Seconds a worker may miss heartbeats before its jobs are handed to another worker
+BROKER_LEASE = int(os.environ.get("BROKER_LEASE", 60))
+# Worker processes started by `python -m worker`, each with its own event loop and connections
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", os.cpu_count() or 1))
+
+# Cached user settings, so handlers don't query the database on every message
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 10 * 60))
+
+# /broadcast: messages per second at most, and concurrent senders
+BROADCAST_RATE = int(os.environ.get("BROADCAST_RATE", 25))
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", 8))
+
+# Messages with several links or a playlist: items per batch, items in flight, and extraction look-ahead
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 50))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 3))
+BATCH_EXTRACT_AHEAD = int(os.environ.get("BATCH_EXTRACT_AHEAD", 5))
+
+# /extract: archive entries downloaded and uploaded at once, and limits on what one archive may unpack
+ARCHIVE_CONCURRENCY = int(os.environ.get("ARCHIVE_CONCURRENCY", 3))
+ARCHIVE_MAX_ENTRIES = int(os.environ.get("ARCHIVE_MAX_ENTRIES", 200))
+ARCHIVE_MAX_ENTRY_SIZE = int(os.environ.get("ARCHIVE_MAX_ENTRY_SIZE", 2000 * 1024 * 1024))
+ARCHIVE_MAX_TOTAL_SIZE = int(os.environ.get("ARCHIVE_MAX_TOTAL_SIZE", 10 * 1024 * 1024 * 1024))
+
+# Seconds between progress message edits per chat, backed off up to the max on FloodWait
+PROGRESS_INTERVAL = int(os.environ.get("PROGRESS_INTERVAL", 5))
+PROGRESS_MAX_INTERVAL = int(os.environ.get("PROGRESS_MAX_INTERVAL", 60))
+
 # Proxy for accessing youtube-dl in GeoRestricted Areas
 HTTP_PROXY = os.environ.get("HTTP_PROXY", "TP73313458:vAbYCAvl@208.195.167.246:65095")
 
+# Route direct-link HTTP traffic through HTTP_PROXY as well
+USE_PROXY_FOR_LINKS = os.environ.get("USE_PROXY_FOR_LINKS", "False").lower() == "true"
+
+# Shared HTTP client pool
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 100))
+HTTP_POOL_PER_HOST = int(os.environ.get("HTTP_POOL_PER_HOST", 16))
+HTTP_CONNECT_TIMEOUT = int(os.environ.get("HTTP_CONNECT_TIMEOUT", 30))
+HTTP_READ_TIMEOUT = int(os.environ.get("HTTP_READ_TIMEOUT", 120))
+HTTP_KEEPALIVE_TIMEOUT = int(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", 30))
+DNS_CACHE_TTL = int(os.environ.get("DNS_CACHE_TTL", 300))
+
 # Set timeout for subprocess
 PROCESS_MAX_TIMEOUT = 3700
 
+# Threads available for yt-dlp extraction and downloads
+YTDL_WORKERS = int(os.environ.get("YTDL_WORKERS", 4))
+# Cached yt-dlp extractions; entries also expire before their stream URLs do
+YTDL_CACHE_SIZE = int(os.environ.get("YTDL_CACHE_SIZE", 256))
+YTDL_CACHE_TTL = int(os.environ.get("YTDL_CACHE_TTL", 3 * 60 * 60))
+# Load yt-dlp's extractors in the background once the bot is up, rather than on the first link
+YTDL_PREWARM = os.environ.get("YTDL_PREWARM", "True").lower() == "true"
+# ffprobe/ffmpeg processes run at once for media metadata and thumbnails
+MEDIA_PROBE_WORKERS = int(os.environ.get("MEDIA_PROBE_WORKERS", 4))
+# Fragments yt-dlp fetches at once for DASH/HLS formats
+YTDL_FRAGMENT_CONCURRENCY = int(os.environ.get("YTDL_FRAGMENT_CONCURRENCY", 4))
+
+# Log file, rotated at LOG_MAX_BYTES with LOG_BACKUPS old files kept; records are JSON lines.
+# Worker processes write next to it, to bot.worker.log and bot.worker-<n>.log
+LOG_FILE = os.environ.get("LOG_FILE", "bot.log")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.environ.get("LOG_BACKUPS", 5))
+
+# Files over the upload limit are sent as parts of at most SPLIT_SIZE bytes plus a manifest
+# to rejoin them; with SPLIT_VIDEO, videos are cut into playable pieces by ffmpeg stream copy
+SPLIT_UPLOADS = os.environ.get("SPLIT_UPLOADS", "True").lower() == "true"
+SPLIT_SIZE = int(os.environ.get("SPLIT_SIZE", 2000 * 1024 * 1024))
+SPLIT_VIDEO = os.environ.get("SPLIT_VIDEO", "True").lower() == "true"
+
+# Port of the health check and Prometheus /metrics endpoint
+METRICS_PORT = int(os.environ.get("PORT", 8080))
+
 # Bot request dictionary
 ADL_BOT_RQ = {}
 AUTH_USERS = [OWNER_ID]
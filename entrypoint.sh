@@ -7,5 +7,20 @@ if [ -z "$BOT_TOKEN" ] || [ -z "$API_ID" ] || [ -z "$API_HASH" ]; then
     exit 1
 fi
 
-# Run the bot
-exec python -m uploder
+# ROLE=bot runs the bot alone, ROLE=worker only download/upload workers (needs BROKER_URL),
+# and ROLE=all both in this container
+case "${ROLE:-bot}" in
+    worker)
+        exec python -m worker
+        ;;
+    all)
+        # Without a broker the bot runs every job itself and a worker would exit at once
+        if [ -n "$BROKER_URL" ]; then
+            python -m worker &
+        fi
+        exec python -m uploder
+        ;;
+    *)
+        exec python -m uploder
+        ;;
+esac
@@ -0,0 +1,464 @@
+import io
+import os
+import zlib
+import struct
+import asyncio
+import logging
+import tarfile
+
+from config import ARCHIVE_CONCURRENCY, ARCHIVE_MAX_ENTRIES, ARCHIVE_MAX_ENTRY_SIZE, ARCHIVE_MAX_TOTAL_SIZE
+from helpers import http_client, metrics
+from helpers.ratelimit import bandwidth
+from helpers.downloader import RangeNotSupported
+from helpers.utils import download_path
+from helpers.storage import storage, remove_quietly
+from helpers.job_store import job_store
+from helpers.media_probe import media_info, is_video
+from helpers.upload_engine import upload_document
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 1024 * 1024
+INFLATE_CHUNK = 4 * 1024 * 1024  # most bytes one decompress call may produce, against zip bombs
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+TAR_TYPES = ('application/x-tar', 'application/gzip', 'application/x-gzip', 'application/x-bzip2',
+             'application/x-xz')
+
+# Zip records, see APPNOTE.TXT
+EOCD = struct.Struct('<4s4H2LH')
+ZIP64_LOCATOR = struct.Struct('<4sLQL')
+ZIP64_EOCD = struct.Struct('<4sQ2H2L4Q')
+CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+MAX_COMMENT = 0xFFFF
+STORED, DEFLATED = 0, 8
+
+
+class ArchiveError(Exception):
+    """The archive can't be read, or one of its entries is broken"""
+
+
+def archive_kind(file_name, content_type=None):
+    """'zip' or 'tar' for an archive's file name or content type, else None"""
+    name = (file_name or "").lower()
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if name.endswith('.zip') or content_type in ('application/zip', 'application/x-zip-compressed'):
+        return 'zip'
+    if name.endswith(TAR_SUFFIXES) or content_type in TAR_TYPES:
+        return 'tar'
+    return None
+
+
+class ArchiveEntry:
+    def __init__(self, index, name, size, offset=0, end=0, compressed_size=0, method=STORED, crc=None,
+                 error=None):
+        self.index = index
+        self.name = name
+        self.size = size
+        # Zip only: where the local header starts, the last byte before the next
+        # entry, and how the data is stored
+        self.offset = offset
+        self.end = end
+        self.compressed_size = compressed_size
+        self.method = method
+        self.crc = crc
+        self.error = error  # why the entry can't be extracted
+        self.path = None
+        self.reservation = None
+
+    @property
+    def file_name(self):
+        return os.path.basename(self.name.rstrip("/")) or f"entry-{self.index}"
+
+
+class EntryWriter:
+    """
+    Writes one entry to disk, inflating deflated zip data on the way
+
+    write() runs in a worker thread. Output is produced at most INFLATE_CHUNK
+    bytes at a time and may not exceed the size the archive declared, so a
+    crafted entry can't exhaust memory or disk.
+    """
+
+    def __init__(self, path, size, method=STORED):
+        self.size = size
+        self.written = 0
+        self.crc = 0
+        self._file = open(path, 'wb')
+        self._inflater = zlib.decompressobj(-zlib.MAX_WBITS) if method == DEFLATED else None
+
+    def _emit(self, data):
+        self.written += len(data)
+        if self.written > self.size:
+            raise ArchiveError(f"Entry is larger than the {self.size} bytes it declares")
+        self.crc = zlib.crc32(data, self.crc)
+        self._file.write(data)
+
+    def write(self, data):
+        if self._inflater is None:
+            self._emit(data)
+            return
+        while data:
+            self._emit(self._inflater.decompress(data, INFLATE_CHUNK))
+            data = self._inflater.unconsumed_tail
+
+    def close(self):
+        self._file.close()
+
+
+async def _read_range(url, start, end):
+    async with http_client.get(url, headers={'Range': f'bytes={start}-{end}'}) as response:
+        if response.status != 206:
+            raise RangeNotSupported(f"Range request failed with status {response.status}")
+        data = await response.read()
+    metrics.transfer_bytes.inc(len(data), stage='download')
+    return data
+
+
+def _zip64_extra(extra, size, compressed_size, offset):
+    """Apply the zip64 extended information field, which holds values too big for the header"""
+    position = 0
+    while position + 4 <= len(extra):
+        tag, length = struct.unpack_from('<2H', extra, position)
+        if tag == 1:
+            values = iter(struct.unpack_from(f'<{length // 8}Q', extra, position + 4))
+            if size == 0xFFFFFFFF:
+                size = next(values)
+            if compressed_size == 0xFFFFFFFF:
+                compressed_size = next(values)
+            if offset == 0xFFFFFFFF:
+                offset = next(values)
+            break
+        position += 4 + length
+    return size, compressed_size, offset
+
+
+def _parse_central_directory(data, count, cd_offset):
+    entries = []
+    position = 0
+    for _ in range(count):
+        (signature, _, _, flags, method, _, _, crc, compressed_size, size, name_length, extra_length,
+         comment_length, _, _, _, offset) = CENTRAL_HEADER.unpack_from(data, position)
+        if signature != b'PK\x01\x02':
+            raise ArchiveError("Broken zip central directory")
+        position += CENTRAL_HEADER.size
+        raw_name = data[position:position + name_length]
+        extra = data[position + name_length:position + name_length + extra_length]
+        position += name_length + extra_length + comment_length
+
+        name = raw_name.decode('utf-8' if flags & 0x800 else 'cp437', errors='replace')
+        if name.endswith("/"):
+            continue
+        size, compressed_size, offset = _zip64_extra(extra, size, compressed_size, offset)
+        error = None
+        if flags & 0x1:
+            error = "encrypted"
+        elif method not in (STORED, DEFLATED):
+            error = f"unsupported compression method {method}"
+        entries.append(ArchiveEntry(
+            len(entries), name, size, offset, compressed_size=compressed_size, method=method, crc=crc,
+            error=error
+        ))
+
+    # An entry's data ends where the next one, or the central directory, begins
+    boundaries = sorted({entry.offset for entry in entries} | {cd_offset})
+    following = dict(zip(boundaries, boundaries[1:]))
+    for entry in entries:
+        entry.end = following[entry.offset] - 1
+    return entries
+
+
+async def zip_entries(url, size):
+    """
+    Files listed in a remote zip, read from its central directory
+
+    Costs one ranged request for the end of the archive, plus one for the
+    central directory when it doesn't fit in that.
+    """
+    tail_start = max(0, size - (EOCD.size + MAX_COMMENT + ZIP64_LOCATOR.size))
+    tail = await _read_range(url, tail_start, size - 1)
+    position = tail.rfind(b'PK\x05\x06')
+    if position < 0:
+        raise ArchiveError("Not a zip archive")
+    _, disk, _, _, count, cd_size, cd_offset, _ = EOCD.unpack_from(tail, position)
+    if disk:
+        raise ArchiveError("Multi-part zip archives aren't supported")
+
+    if count == 0xFFFF or 0xFFFFFFFF in (cd_size, cd_offset):
+        locator_position = position - ZIP64_LOCATOR.size
+        signature, _, eocd_offset, _ = ZIP64_LOCATOR.unpack_from(tail, max(locator_position, 0))
+        if locator_position < 0 or signature != b'PK\x06\x07':
+            raise ArchiveError("Broken zip64 archive")
+        record = await _read_range(url, eocd_offset, eocd_offset + ZIP64_EOCD.size - 1)
+        *_, count, cd_size, cd_offset = ZIP64_EOCD.unpack(record)
+
+    if cd_offset >= tail_start:
+        directory = tail[cd_offset - tail_start:cd_offset - tail_start + cd_size]
+    else:
+        directory = await _read_range(url, cd_offset, cd_offset + cd_size - 1)
+    return _parse_central_directory(directory, count, cd_offset)
+
+
+class ResponseReader(io.RawIOBase):
+    """Blocking file object over an aiohttp response, for tarfile running in a worker thread"""
+
+    def __init__(self, extractor, response, loop):
+        self.extractor = extractor
+        self.response = response
+        self.loop = loop
+
+    def readable(self):
+        return True
+
+    async def _read(self, size):
+        chunk = await self.response.content.read(size)
+        await bandwidth.consume(len(chunk))
+        metrics.transfer_bytes.inc(len(chunk), stage='download')
+        return chunk
+
+    def readinto(self, buffer):
+        chunk = self.extractor.call(self._read(len(buffer)), self.loop)
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+class ArchiveExtractor:
+    """
+    Send the files inside a zip or tar link, without storing the archive
+
+    Tar archives are unpacked from the download stream by tarfile in a
+    worker thread. Zip archives are read from their central directory, and
+    every entry is then fetched with its own ranged request. Entries are
+    written to disk only while they upload, at most `concurrency` at a time,
+    and their disk space is reserved first. Entries past `max_entries` or
+    `max_total_size` end the extraction; entries over `max_entry_size`,
+    encrypted ones or ones in unsupported formats are skipped. Indexes of
+    sent entries are checkpointed in the job store so a resumed job skips
+    them.
+    """
+
+    def __init__(self, client, chat_id, url, kind, job_id=None, done=(), progress=None, meta=None,
+                 concurrency=ARCHIVE_CONCURRENCY, max_entries=ARCHIVE_MAX_ENTRIES,
+                 max_entry_size=ARCHIVE_MAX_ENTRY_SIZE, max_total_size=ARCHIVE_MAX_TOTAL_SIZE):
+        self.client = client
+        self.chat_id = chat_id
+        self.url = url
+        self.kind = kind
+        self.job_id = job_id
+        self.done = set(done)
+        self.progress = progress  # called with the entries processed so far and the total, if known
+        self.meta = meta or {}  # extra fields kept in the checkpointed payload
+        self.concurrency = concurrency
+        self.max_entries = max_entries
+        self.max_entry_size = max_entry_size
+        self.max_total_size = max_total_size
+        self.total = None
+        self.seen = 0
+        self.unpacked = 0
+        self.processed = len(self.done)
+        self.failed = []
+        self.skipped = []
+        self.truncated = False
+        self._slots = None
+        self._tasks = []
+        self._stopped = False
+        self._pending = None
+
+    @property
+    def payload(self):
+        return {**self.meta, 'chat_id': self.chat_id, 'url': self.url, 'done': sorted(self.done)}
+
+    def _report(self):
+        self.processed += 1
+        if self.progress:
+            self.progress(self.processed, self.total)
+
+    def call(self, coro, loop):
+        """Run coro on the event loop from the tar thread and wait for its result"""
+        if self._stopped:
+            coro.close()
+            raise ArchiveError("Extraction stopped")
+        self._pending = asyncio.run_coroutine_threadsafe(coro, loop)
+        return self._pending.result()
+
+    async def _admit(self, entry):
+        """Apply the limits to entry and take an upload slot for it; False skips it"""
+        if self.seen >= self.max_entries or self.unpacked + entry.size > self.max_total_size:
+            self.truncated = True
+            return False
+        self.seen += 1
+        self.unpacked += entry.size
+        if entry.index in self.done:
+            return False
+        if entry.error or entry.size > self.max_entry_size:
+            self.skipped.append(f"{entry.name} ({entry.error or 'too big'})")
+            self._report()
+            return False
+
+        await self._slots.acquire()
+        entry.reservation = f"archive-{self.job_id}-{entry.index}"
+        entry.path = download_path(entry.file_name, f"{self.job_id or 'archive'}-{entry.index}")
+        try:
+            storage.reserve(entry.reservation, entry.size)
+        except Exception:
+            self._slots.release()
+            raise
+        storage.track(entry.path, entry.reservation)
+        return True
+
+    def _start(self, entry, fetch=None):
+        self._tasks.append(asyncio.ensure_future(self._process(entry, fetch)))
+
+    async def _fetch_zip_entry(self, entry):
+        async with http_client.get(self.url, headers={'Range': f'bytes={entry.offset}-{entry.end}'}) as response:
+            if response.status != 206:
+                raise RangeNotSupported(f"Range request failed with status {response.status}")
+            header = await response.content.readexactly(LOCAL_HEADER.size)
+            signature, *_, name_length, extra_length = LOCAL_HEADER.unpack(header)
+            if signature != b'PK\x03\x04':
+                raise ArchiveError("Broken zip local header")
+            await response.content.readexactly(name_length + extra_length)
+
+            loop = asyncio.get_running_loop()
+            writer = EntryWriter(entry.path, entry.size, entry.method)
+            remaining = entry.compressed_size
+            try:
+                while remaining:
+                    chunk = await response.content.read(min(READ_SIZE, remaining))
+                    if not chunk:
+                        raise ArchiveError("Archive ended inside an entry")
+                    remaining -= len(chunk)
+                    await bandwidth.consume(len(chunk))
+                    metrics.transfer_bytes.inc(len(chunk), stage='download')
+                    await loop.run_in_executor(None, writer.write, chunk)
+            finally:
+                writer.close()
+        if writer.written != entry.size or writer.crc != entry.crc:
+            raise ArchiveError("Entry is corrupt: size or CRC mismatch")
+
+    async def _send(self, entry):
+        """Upload one extracted entry the way send_file would"""
+        media = None
+        if (self.client.guess_mime_type(entry.file_name) or "").startswith("video/"):
+            # Uncached: the temp path is deleted after sending, so a cache entry would never be hit
+            media = await media_info(entry.path)
+        try:
+            sent = await upload_document(
+                self.client, self.chat_id, entry.path, entry.file_name, entry.name, media_info=media
+            )
+            if sent is None and is_video(media):
+                sent = await self.client.send_video(
+                    chat_id=self.chat_id,
+                    video=entry.path,
+                    caption=entry.name,
+                    file_name=entry.file_name,
+                    duration=media['duration'],
+                    width=media['width'],
+                    height=media['height'],
+                    thumb=media['thumbnail'],
+                    supports_streaming=True
+                )
+            if sent is None:
+                await self.client.send_document(
+                    chat_id=self.chat_id, document=entry.path, caption=entry.name, file_name=entry.file_name
+                )
+        finally:
+            if media:
+                remove_quietly(media['thumbnail'])
+
+    async def _process(self, entry, fetch=None):
+        try:
+            if fetch:
+                await fetch(entry)
+            await self._send(entry)
+            self.done.add(entry.index)
+            if self.job_id:
+                job_store.record(self.job_id, progress=len(self.done), payload=self.payload)
+        except Exception as e:
+            logger.warning(f"Archive entry {entry.name} failed: {str(e)}")
+            self.failed.append(entry.name)
+        finally:
+            storage.release(entry.reservation)
+            self._slots.release()
+            self._report()
+
+    async def _run_zip(self):
+        info = await http_client.probe(self.url)
+        if not (info['ranges'] and info['size']):
+            raise ArchiveError("The server doesn't support ranged requests, which reading a zip needs")
+        entries = await zip_entries(self.url, info['size'])
+        self.total = min(len(entries), self.max_entries)
+        for entry in entries:
+            if await self._admit(entry):
+                self._start(entry, self._fetch_zip_entry)
+            elif self.truncated:
+                break
+
+    def _untar(self, response, loop):
+        source = io.BufferedReader(ResponseReader(self, response, loop), READ_SIZE)
+        with tarfile.open(fileobj=source, mode='r|*') as tar:
+            for index, member in enumerate(m for m in tar if m.isfile()):
+                entry = ArchiveEntry(index, member.name, member.size)
+                if not self.call(self._admit(entry), loop):
+                    if self.truncated:
+                        return
+                    continue
+                written = False
+                try:
+                    written = self._write_member(tar, member, entry)
+                finally:
+                    # Only _process gives back the entry's reservation and slot
+                    loop.call_soon_threadsafe(self._start if written else self._discard, entry)
+                if not written:
+                    return
+
+    def _write_member(self, tar, member, entry):
+        """Write a tar member to entry.path; False if the extraction was stopped meanwhile"""
+        writer = EntryWriter(entry.path, entry.size)
+        try:
+            data = tar.extractfile(member)
+            for block in iter(lambda: data.read(READ_SIZE), b""):
+                if self._stopped:
+                    return False
+                writer.write(block)
+        finally:
+            writer.close()
+        return True
+
+    def _discard(self, entry):
+        """Free an admitted entry that won't be sent"""
+        storage.release(entry.reservation)
+        self._slots.release()
+
+    async def _run_tar(self):
+        loop = asyncio.get_running_loop()
+        async with http_client.get(self.url) as response:
+            if response.status != 200:
+                raise ArchiveError(f"Download failed with status {response.status}")
+            thread = loop.run_in_executor(None, self._untar, response, loop)
+            try:
+                await asyncio.shield(thread)
+            except asyncio.CancelledError:
+                # The thread may be waiting on the loop; wake it up and let it finish
+                self._stopped = True
+                if self._pending:
+                    self._pending.cancel()
+                await asyncio.gather(thread, return_exceptions=True)
+                raise
+
+    async def run(self):
+        """Extract and send every entry not yet done; returns (sent, failed names, skipped names)"""
+        self._slots = asyncio.Semaphore(self.concurrency)
+        try:
+            if self.kind == 'zip':
+                await self._run_zip()
+            else:
+                await self._run_tar()
+            await asyncio.gather(*self._tasks)
+        except BaseException:
+            self._stopped = True
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            raise
+        return len(self.done), self.failed, self.skipped
@@ -0,0 +1,304 @@
+import os
+import re
+import asyncio
+import logging
+
+from pyrogram import raw
+from pyrogram.file_id import FileId
+
+from config import DOWNLOAD_LOCATION, BATCH_CONCURRENCY, BATCH_EXTRACT_AHEAD, BATCH_MAX_ITEMS, STREAM_UPLOAD
+from helpers import http_client, ytdl_service
+from helpers.downloader import download_file
+from helpers.utils import download_path
+from helpers.storage import storage, remove_quietly, current_job
+from helpers.media_probe import media_info, is_video
+from helpers.upload_engine import upload_media, send_album, BOT_UPLOAD_LIMIT
+from helpers.stream_upload import stream_url_media
+from helpers.upload_cache import upload_cache, url_key, ytdl_key, media_file_id
+from helpers.job_store import job_store
+from helpers.scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+URL_REGEX = r'https?://[^\s<>"]+'
+ALBUM_SIZE = 10  # Telegram's media group limit
+# Batches favour throughput over resolution
+BATCH_FORMAT = "bestvideo[ext=mp4][height<=720]+bestaudio[ext=m4a]/best[ext=mp4]/best"
+YTDL_OUTTMPL = os.path.join(DOWNLOAD_LOCATION, "%(title)s - %(extractor)s-%(id)s.%(ext)s")
+
+
+def find_urls(text):
+    """Distinct URLs in text, in order of appearance"""
+    return list(dict.fromkeys(re.findall(URL_REGEX, text or "")))
+
+
+async def expand(urls, limit=BATCH_MAX_ITEMS):
+    """Replace playlist and channel links by their videos, up to `limit` items in total"""
+    items = []
+    for url in urls:
+        if ytdl_service.is_playlist(url):
+            _, entries = await ytdl_service.list_entries(url, limit - len(items))
+            items.extend(entries)
+        else:
+            items.append(url)
+        if len(items) >= limit:
+            break
+    return list(dict.fromkeys(items))[:limit]
+
+
+def _input_document(file_id):
+    decoded = FileId.decode(file_id)
+    return raw.types.InputDocument(
+        id=decoded.media_id,
+        access_hash=decoded.access_hash,
+        file_reference=decoded.file_reference
+    )
+
+
+class BatchItem:
+    def __init__(self, index, url):
+        self.index = index
+        self.url = url
+        self.ytdl = False
+        self.info = None
+        self.key = None
+        self.file_name = None
+        self.caption = None
+        self.path = None
+        self.size = 0
+        self.kind = 'document'
+        self.document = None
+        self.cached = False
+
+
+class Batch:
+    """
+    Download and upload many URLs, each as its own scheduler job
+
+    Items move through a pipeline: up to BATCH_EXTRACT_AHEAD items are
+    extracted/probed ahead, and BATCH_CONCURRENCY submitters hand prepared
+    items to the scheduler one job each, so extraction latency overlaps the
+    transfers while the scheduler admits, lists and cancels items like any
+    other job. Uploaded files are collected per kind (video, audio,
+    document) and sent as media groups of up to ten, in the order the URLs
+    were given within each group. Indexes of sent items are checkpointed in
+    the job store under job_id so a resumed batch skips them.
+    """
+
+    def __init__(self, client, chat_id, user_id, urls, job_id=None, done=(), progress=None, meta=None):
+        self.client = client
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.urls = urls
+        self.job_id = job_id
+        self.done = set(done)
+        self.progress = progress  # called with the number of items processed so far
+        self.meta = meta or {}  # extra fields kept in the checkpointed payload
+        self.failed = []
+        self.processed = len(self.done)
+        self.cancelled = False
+        self._albums = {'video': [], 'audio': [], 'document': []}
+        self._album_lock = asyncio.Lock()
+        self._task = None
+
+    @property
+    def total(self):
+        return len(self.urls)
+
+    async def _prepare(self, item):
+        if re.search(ytdl_service.YOUTUBE_REGEX, item.url):
+            item.ytdl = True
+        else:
+            probe = await http_client.probe(item.url)
+            item.ytdl = (probe['content_type'] or "").startswith("text/html")
+            item.info = probe
+
+        if item.ytdl:
+            item.info = await ytdl_service.extract_info(item.url, format=BATCH_FORMAT)
+            formats = item.info.get('requested_formats') or [item.info]
+            item.size = sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in formats)
+            item.key = ytdl_key(ytdl_service.cache_key(item.url), BATCH_FORMAT)
+            title = item.info.get('title') or item.url
+            item.caption = f'<b><a href="{item.info.get("webpage_url", item.url)}">{title}</a></b>'
+        else:
+            item.size = item.info['size']
+            item.key = url_key(item.url)
+            item.file_name = item.info['filename'] or http_client.filename_from_url(item.url) or "file"
+            item.caption = item.file_name
+
+        entry = await upload_cache.get(item.key)
+        if entry and entry['kind'] in self._albums:
+            try:
+                item.document, item.kind, item.cached = _input_document(entry['file_id']), entry['kind'], True
+            except Exception as e:
+                logger.warning(f"Cached file_id for {item.key} unusable, re-uploading: {str(e)}")
+                await upload_cache.invalidate(item.key)
+        if not item.cached and item.size > BOT_UPLOAD_LIMIT:
+            raise ValueError("file is larger than the bot upload limit")
+
+    async def _download(self, item):
+        if item.ytdl:
+            opts = {'format': BATCH_FORMAT, 'outtmpl': YTDL_OUTTMPL}
+            item.info, item.path = await ytdl_service.download(item.url, opts)
+            item.file_name = os.path.basename(item.path)
+            storage.track(item.path)
+        else:
+            # Named by batch rather than item job, so a resumed batch continues the partial file
+            item.path = download_path(item.file_name, f"{self.job_id}-{item.index}")
+            storage.track(item.path)
+            await download_file(item.url, item.path)
+
+    def _set_kind(self, item, media):
+        mime_type = self.client.guess_mime_type(item.file_name) or ""
+        item.kind = 'video' if is_video(media) else 'audio' if mime_type.startswith("audio/") else 'document'
+
+    async def _stream(self, item):
+        """Upload a direct link while it downloads; False when it has to go through disk instead"""
+        # ffprobe reads the headers straight from the URL while the body streams
+        media = asyncio.ensure_future(media_info(item.url, item.key))
+        try:
+            item.document = await stream_url_media(self.client, self.chat_id, item.url, item.file_name, media)
+        except Exception as e:
+            logger.warning(f"Streaming {item.url} failed, downloading it first: {str(e)}")
+        if item.document is None:
+            return False
+        self._set_kind(item, await media)
+        return True
+
+    @staticmethod
+    def _streams(item):
+        return not item.ytdl and STREAM_UPLOAD
+
+    async def _fetch(self, item):
+        """Scheduler job: download and upload one item, leaving its InputDocument on the item"""
+        if self._streams(item):
+            if await self._stream(item):
+                return
+            # Admitted without a reservation in case it streamed; it needs the disk after all
+            storage.reserve(current_job.get(), item.size)
+        try:
+            await self._download(item)
+            if os.path.getsize(item.path) > BOT_UPLOAD_LIMIT:
+                raise ValueError("file is larger than the bot upload limit")
+            media = await media_info(item.path, item.key)
+            self._set_kind(item, media)
+            item.document = await upload_media(self.client, self.chat_id, item.path, item.file_name, media)
+        finally:
+            if item.ytdl and item.info:
+                for thumbnail in item.info.get('thumbnails') or []:
+                    remove_quietly(thumbnail.get('filepath'))
+
+    async def _send(self, kind):
+        """Send the collected items of kind as one media group"""
+        items = sorted(self._albums[kind], key=lambda i: i.index)
+        self._albums[kind] = []
+        if not items:
+            return
+        try:
+            messages = await send_album(
+                self.client, self.chat_id, [i.document for i in items], [i.caption for i in items]
+            )
+        except Exception as e:
+            logger.error(f"Sending a {kind} album of {len(items)} failed: {str(e)}")
+            self.failed.extend(i.url for i in items)
+            return
+        for item, message in zip(items, messages):
+            if not item.cached:
+                await upload_cache.put(item.key, media_file_id(message), item.kind, meta={'caption': item.caption})
+            self.done.add(item.index)
+        if self.job_id:
+            job_store.record(self.job_id, progress=len(self.done), payload=self.payload)
+
+    async def _collect(self, item):
+        async with self._album_lock:
+            self._albums[item.kind].append(item)
+            if len(self._albums[item.kind]) >= ALBUM_SIZE:
+                await self._send(item.kind)
+
+    def _report(self):
+        self.processed += 1
+        if self.progress:
+            self.progress(self.processed)
+
+    async def _preparer(self, pending, prepared):
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            try:
+                await self._prepare(item)
+            except Exception as e:
+                logger.warning(f"Batch item {item.url} failed to extract: {str(e)}")
+                self.failed.append(item.url)
+                self._report()
+                continue
+            await prepared.put(item)
+
+    async def _submit(self, item):
+        """Run _fetch(item) as its own scheduler job and wait for it to end"""
+        job = scheduler.submit(
+            self.user_id, self._fetch, item, size=0 if self._streams(item) else item.size,
+            name=f"batch {self.job_id} {item.index + 1}/{self.total}"
+        )
+        try:
+            # wait() rather than awaiting job.done, which the scheduler still has to resolve
+            await asyncio.wait({job.done})
+        except asyncio.CancelledError:
+            # A stopping bot leaves the job to be interrupted and resumed with the batch
+            if self.cancelled:
+                scheduler.cancel(job.id)
+            raise
+        if job.done.cancelled():
+            raise ValueError("cancelled")
+        job.done.result()
+
+    async def _worker(self, prepared):
+        while True:
+            item = await prepared.get()
+            if item is None:
+                return
+            try:
+                if item.document is None:
+                    await self._submit(item)
+                await self._collect(item)
+            except Exception as e:
+                logger.warning(f"Batch item {item.url} failed: {str(e)}")
+                self.failed.append(item.url)
+            self._report()
+
+    @property
+    def payload(self):
+        return {**self.meta, 'chat_id': self.chat_id, 'urls': self.urls, 'done': sorted(self.done)}
+
+    def cancel(self):
+        """Stop the batch and its item jobs; run() still sends what was uploaded"""
+        self.cancelled = True
+        if self._task:
+            self._task.cancel()
+
+    async def run(self):
+        """Process every URL not yet done; returns (sent, failed URLs)"""
+        self._task = asyncio.current_task()
+        pending = asyncio.Queue()
+        for index, url in enumerate(self.urls):
+            if index not in self.done:
+                pending.put_nowait(BatchItem(index, url))
+        prepared = asyncio.Queue(maxsize=BATCH_EXTRACT_AHEAD)
+        preparers = [asyncio.create_task(self._preparer(pending, prepared)) for _ in range(BATCH_CONCURRENCY)]
+        workers = [asyncio.create_task(self._worker(prepared)) for _ in range(BATCH_CONCURRENCY)]
+        for _ in preparers:
+            pending.put_nowait(None)
+        try:
+            await asyncio.gather(*preparers)
+            for _ in workers:
+                await prepared.put(None)
+            await asyncio.gather(*workers)
+        except BaseException:
+            for task in preparers + workers:
+                task.cancel()
+            await asyncio.gather(*preparers, *workers, return_exceptions=True)
+            if not self.cancelled:
+                raise
+        for kind in self._albums:
+            await self._send(kind)
+        return len(self.done), self.failed
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from collections import deque
+
+from pyrogram.errors import FloodWait, UserIsBlocked, InputUserDeactivated, PeerIdInvalid, UserDeactivated
+
+from config import BROADCAST_RATE, BROADCAST_WORKERS
+from helpers import metrics
+from helpers.ratelimit import TokenBucket
+from helpers.job_store import job_store
+from plugins.database.database import db
+
+logger = logging.getLogger(__name__)
+
+# Users that can never receive the message; counted as blocked, not retried
+UNREACHABLE = (UserIsBlocked, InputUserDeactivated, UserDeactivated, PeerIdInvalid)
+MIN_RATE = 1
+RATE_RECOVERY = 1.05  # multiplier applied to the send rate after each clean batch
+RECOVERY_BATCH = 100
+SEND_RETRIES = 3
+
+
+class Broadcast:
+    """
+    Copy one message to every user in the database
+
+    User ids are streamed from a cursor in ascending order and fanned out to
+    BROADCAST_WORKERS senders sharing a token bucket. FloodWait pauses every
+    sender and halves the rate, which then creeps back up towards
+    BROADCAST_RATE. The highest user id below which every send has finished is
+    checkpointed in the job store together with the counts of exactly those
+    sends and the outcomes of the sends already finished past it, so a
+    restart continues from there without messaging or counting anyone twice.
+    """
+
+    def __init__(self, client, job_id, from_chat_id, message_id, after=0, counts=None, done=()):
+        self.client = client
+        self.job_id = job_id
+        self.from_chat_id = from_chat_id
+        self.message_id = message_id
+        self.after = after
+        self.counts = counts or {'delivered': 0, 'blocked': 0, 'failed': 0}
+        self.limiter = TokenBucket(BROADCAST_RATE)
+        self._dispatched = deque()  # user ids in cursor order, not yet checkpointed
+        self._finished = dict(done)  # user id -> outcome, for sends past the cursor
+        self._clean = 0
+
+    @property
+    def payload(self):
+        return {
+            'from_chat_id': self.from_chat_id,
+            'message_id': self.message_id,
+            'after': self.after,
+            'counts': dict(self.counts),
+            'done': list(self._finished.items()),
+        }
+
+    @property
+    def processed(self):
+        return sum(self.counts.values()) + len(self._finished)
+
+    def _users(self):
+        return db.col.find({'id': {'$gt': self.after}}, {'id': 1}).sort('id', 1)
+
+    def _checkpoint(self, user_id, outcome):
+        self._finished[user_id] = outcome
+        while self._dispatched and self._dispatched[0] in self._finished:
+            self.after = self._dispatched.popleft()
+            self.counts[self._finished.pop(self.after)] += 1
+        job_store.record(self.job_id, payload=self.payload, progress=self.processed)
+
+    def _throttle(self, seconds):
+        metrics.record_flood_wait('broadcast', seconds)
+        self.limiter.rate = max(MIN_RATE, self.limiter.rate / 2)
+        self.limiter.penalize(seconds)
+        self._clean = 0
+        logger.warning(f"Broadcast FloodWait {seconds}s, rate now {self.limiter.rate:.1f}/s")
+
+    def _recover_rate(self):
+        self._clean += 1
+        if self._clean >= RECOVERY_BATCH and self.limiter.rate < BROADCAST_RATE:
+            self.limiter.rate = min(BROADCAST_RATE, self.limiter.rate * RATE_RECOVERY)
+            self._clean = 0
+
+    async def _send(self, user_id):
+        for attempt in range(1, SEND_RETRIES + 1):
+            await self.limiter.consume()
+            try:
+                await self.client.copy_message(user_id, self.from_chat_id, self.message_id)
+                self._recover_rate()
+                return 'delivered'
+            except FloodWait as e:
+                self._throttle(e.value)
+            except UNREACHABLE:
+                return 'blocked'
+            except Exception as e:
+                if attempt == SEND_RETRIES:
+                    logger.debug(f"Broadcast to {user_id} failed: {str(e)}")
+        return 'failed'
+
+    async def _worker(self, queue, progress):
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            self._checkpoint(user_id, await self._send(user_id))
+            if progress:
+                progress(self.processed)
+
+    async def run(self, progress=None):
+        """Send to every remaining user; `progress(processed)` is called after each send"""
+        queue = asyncio.Queue(maxsize=BROADCAST_WORKERS * 2)
+        workers = [asyncio.create_task(self._worker(queue, progress)) for _ in range(BROADCAST_WORKERS)]
+        try:
+            async for doc in self._users():
+                self._dispatched.append(doc['id'])
+                if doc['id'] in self._finished:
+                    self._checkpoint(doc['id'], self._finished[doc['id']])
+                else:
+                    await queue.put(doc['id'])
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except BaseException:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        return self.counts
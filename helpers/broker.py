@@ -0,0 +1,355 @@
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+from config import BROKER_URL, BROKER_LEASE
+from helpers.job_store import ACTIVE_STATES, FINISHED_RETENTION
+
+logger = logging.getLogger(__name__)
+
+# Job store fields a worker may write back; the broker owns queueing and leases
+WRITABLE = ('state', 'progress', 'payload', 'updated')
+
+
+def _writable(fields):
+    fields = {name: value for name, value in fields.items() if name in WRITABLE}
+    # The worker's local scheduler records its own 'queued' step; the job is claimed already
+    if fields.get('state') == 'queued':
+        del fields['state']
+    return fields
+
+
+class SQLiteBroker:
+    """
+    Job queue in a SQLite file shared by the bot and workers on one machine
+
+    Claims run in an immediate transaction, so two workers never take the
+    same job. A running job whose lease lapses (its worker died or hung) is
+    claimed again by the next worker that asks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="broker")
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS broker_jobs ("
+                " id TEXT PRIMARY KEY, user_id INTEGER, kind TEXT, payload TEXT, state TEXT,"
+                " worker TEXT, lease REAL, cancel INTEGER DEFAULT 0, progress INTEGER DEFAULT 0,"
+                " created REAL, updated REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS broker_jobs_state ON broker_jobs (state, created)")
+        return self._db
+
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _put(self, job_id, user_id, kind, payload):
+        now = time.time()
+        self._connect().execute(
+            "INSERT OR REPLACE INTO broker_jobs (id, user_id, kind, payload, state, created, updated)"
+            " VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, user_id, kind, json.dumps(payload), now, now)
+        )
+
+    def _claim(self, worker, lease):
+        db = self._connect()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT id, user_id, kind, payload, progress FROM broker_jobs"
+                " WHERE state = 'queued' OR (state = 'running' AND (lease IS NULL OR lease < ?))"
+                " ORDER BY created LIMIT 1", (now,)
+            ).fetchone()
+            if row:
+                db.execute(
+                    "UPDATE broker_jobs SET state = 'running', worker = ?, lease = ?, updated = ? WHERE id = ?",
+                    (worker, now + lease, now, row[0])
+                )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return {'id': row[0], 'user_id': row[1], 'kind': row[2], 'payload': json.loads(row[3]), 'progress': row[4]}
+
+    def _heartbeat(self, worker, job_ids, lease):
+        db = self._connect()
+        marks = ", ".join("?" * len(job_ids))
+        db.execute(
+            f"UPDATE broker_jobs SET lease = ? WHERE worker = ? AND state = 'running' AND id IN ({marks})",
+            (time.time() + lease, worker, *job_ids)
+        )
+        rows = db.execute(f"SELECT id FROM broker_jobs WHERE cancel = 1 AND id IN ({marks})", job_ids)
+        return [r[0] for r in rows]
+
+    def _release(self, worker, job_ids):
+        marks = ", ".join("?" * len(job_ids))
+        self._connect().execute(
+            f"UPDATE broker_jobs SET state = 'queued', worker = NULL, lease = NULL"
+            f" WHERE worker = ? AND state = 'running' AND id IN ({marks})", (worker, *job_ids)
+        )
+
+    def _write(self, records):
+        db = self._connect()
+        db.execute("BEGIN")
+        for job_id, fields in records.items():
+            fields = _writable(fields)
+            if 'payload' in fields:
+                fields['payload'] = json.dumps(fields['payload'])
+            if fields.get('state') not in (None, *ACTIVE_STATES):
+                fields['lease'] = None
+            if fields:
+                columns = ", ".join(f"{name} = ?" for name in fields)
+                db.execute(f"UPDATE broker_jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+        db.execute("COMMIT")
+
+    def _cancel(self, job_id, user_id):
+        db = self._connect()
+        queued = db.execute(
+            "UPDATE broker_jobs SET state = 'cancelled', updated = ? WHERE id = ? AND user_id = ? AND state = 'queued'",
+            (time.time(), job_id, user_id)
+        ).rowcount
+        running = db.execute(
+            "UPDATE broker_jobs SET cancel = 1 WHERE id = ? AND user_id = ? AND state = 'running'", (job_id, user_id)
+        ).rowcount
+        return bool(queued or running)
+
+    def _position(self, job_id):
+        db = self._connect()
+        row = db.execute("SELECT state, created FROM broker_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row[0] not in ACTIVE_STATES:
+            return None
+        if row[0] == 'running':
+            return 0
+        return db.execute(
+            "SELECT COUNT(*) FROM broker_jobs WHERE state = 'queued' AND created <= ?", (row[1],)
+        ).fetchone()[0]
+
+    def _user_jobs(self, user_id):
+        rows = self._connect().execute(
+            "SELECT id, kind, state, progress FROM broker_jobs"
+            " WHERE user_id = ? AND state IN (?, ?) ORDER BY created", (user_id, *ACTIVE_STATES)
+        ).fetchall()
+        return [{'id': r[0], 'kind': r[1], 'state': r[2], 'progress': r[3]} for r in rows]
+
+    def _purge(self, before):
+        self._connect().execute(
+            "DELETE FROM broker_jobs WHERE state NOT IN (?, ?) AND updated < ?", (*ACTIVE_STATES, before)
+        )
+
+    async def put(self, job_id, user_id, kind, payload):
+        await self._call(self._put, job_id, user_id, kind, payload)
+
+    async def claim(self, worker, lease=BROKER_LEASE):
+        return await self._call(self._claim, worker, lease)
+
+    async def heartbeat(self, worker, job_ids, lease=BROKER_LEASE):
+        if not job_ids:
+            return []
+        return await self._call(self._heartbeat, worker, list(job_ids), lease)
+
+    async def release(self, worker, job_ids):
+        if job_ids:
+            await self._call(self._release, worker, list(job_ids))
+
+    async def write(self, records):
+        await self._call(self._write, records)
+
+    async def cancel(self, job_id, user_id):
+        return await self._call(self._cancel, job_id, user_id)
+
+    async def position(self, job_id):
+        return await self._call(self._position, job_id)
+
+    async def user_jobs(self, user_id):
+        return await self._call(self._user_jobs, user_id)
+
+    async def active(self):
+        # Interrupted jobs go back to the queue by lease expiry, not by job store recovery
+        return []
+
+    async def purge(self, before):
+        await self._call(self._purge, before)
+
+
+# Re-queue lapsed leases, then pop the oldest queued job and lease it to the caller
+_CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('HSET', ARGV[4] .. id, 'state', 'queued', 'worker', '')
+    redis.call('RPUSH', KEYS[1], id)
+end
+local id = redis.call('RPOP', KEYS[1])
+if not id then
+    return false
+end
+redis.call('HSET', ARGV[4] .. id, 'state', 'running', 'worker', ARGV[2], 'updated', now)
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), id)
+return id
+"""
+
+# Extends only the leases still held by this worker, so a stale worker can't
+# keep alive a job another one has claimed since; returns the cancelled ids
+_HEARTBEAT_SCRIPT = """
+local cancelled = {}
+for i = 4, #ARGV do
+    local id = ARGV[i]
+    local job = redis.call('HMGET', ARGV[3] .. id, 'worker', 'state', 'cancel')
+    if job[1] == ARGV[1] and job[2] == 'running' then
+        redis.call('ZADD', KEYS[1], 'XX', ARGV[2], id)
+    end
+    if job[3] == '1' then
+        table.insert(cancelled, id)
+    end
+end
+return cancelled
+"""
+
+
+class RedisBroker:
+    """
+    Job queue in Redis, for workers spread over several machines
+
+    Jobs are hashes under <prefix>:job:<id>; queued ids sit in a list and
+    running ids in a sorted set scored by lease expiry. Needs the redis
+    package (redis.asyncio) and Redis 6.0.6 or later for LPOS.
+    """
+
+    def __init__(self, url, prefix="uploader"):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._queue = f"{prefix}:queue"
+        self._leases = f"{prefix}:leases"
+        self._job = f"{prefix}:job:"
+        self._user = f"{prefix}:user:"
+        self._claim_script = self._redis.register_script(_CLAIM_SCRIPT)
+        self._heartbeat_script = self._redis.register_script(_HEARTBEAT_SCRIPT)
+
+    def _record(self, job_id, fields):
+        return {
+            'id': job_id, 'user_id': int(fields['user_id']), 'kind': fields['kind'], 'state': fields['state'],
+            'payload': json.loads(fields.get('payload') or "{}"), 'progress': int(fields.get('progress') or 0)
+        }
+
+    async def put(self, job_id, user_id, kind, payload):
+        now = time.time()
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._job + job_id, mapping={
+                'user_id': user_id, 'kind': kind, 'payload': json.dumps(payload), 'state': 'queued',
+                'progress': 0, 'cancel': 0, 'created': now, 'updated': now
+            })
+            pipe.sadd(f"{self._user}{user_id}", job_id)
+            pipe.lpush(self._queue, job_id)
+            await pipe.execute()
+
+    async def claim(self, worker, lease=BROKER_LEASE):
+        job_id = await self._claim_script(
+            keys=[self._queue, self._leases], args=[time.time(), worker, lease, self._job]
+        )
+        if not job_id:
+            return None
+        return self._record(job_id, await self._redis.hgetall(self._job + job_id))
+
+    async def heartbeat(self, worker, job_ids, lease=BROKER_LEASE):
+        job_ids = list(job_ids)
+        if not job_ids:
+            return []
+        return await self._heartbeat_script(
+            keys=[self._leases], args=[worker, time.time() + lease, self._job, *job_ids]
+        )
+
+    async def release(self, worker, job_ids):
+        for job_id in job_ids:
+            if await self._redis.hget(self._job + job_id, 'worker') != worker:
+                continue
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.zrem(self._leases, job_id)
+                pipe.hset(self._job + job_id, mapping={'state': 'queued', 'worker': ''})
+                pipe.rpush(self._queue, job_id)
+                await pipe.execute()
+
+    async def write(self, records):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for job_id, fields in records.items():
+                fields = _writable(fields)
+                if 'payload' in fields:
+                    fields['payload'] = json.dumps(fields['payload'])
+                if not fields:
+                    continue
+                pipe.hset(self._job + job_id, mapping=fields)
+                if fields.get('state') not in (None, *ACTIVE_STATES):
+                    pipe.zrem(self._leases, job_id)
+                    pipe.expire(self._job + job_id, FINISHED_RETENTION)
+            await pipe.execute()
+
+    async def cancel(self, job_id, user_id):
+        fields = await self._redis.hgetall(self._job + job_id)
+        if not fields or int(fields['user_id']) != user_id:
+            return False
+        if fields['state'] == 'queued' and await self._redis.lrem(self._queue, 0, job_id):
+            await self.write({job_id: {'state': 'cancelled', 'updated': time.time()}})
+            return True
+        if fields['state'] == 'running':
+            await self._redis.hset(self._job + job_id, 'cancel', 1)
+            return True
+        return False
+
+    async def position(self, job_id):
+        state = await self._redis.hget(self._job + job_id, 'state')
+        if state == 'running':
+            return 0
+        if state != 'queued':
+            return None
+        index = await self._redis.lpos(self._queue, job_id)
+        if index is None:
+            return None
+        # Jobs are pushed on the left and claimed from the right
+        return await self._redis.llen(self._queue) - index
+
+    async def user_jobs(self, user_id):
+        key = f"{self._user}{user_id}"
+        jobs = []
+        for job_id in await self._redis.smembers(key):
+            fields = await self._redis.hgetall(self._job + job_id)
+            if fields.get('state') in ACTIVE_STATES:
+                jobs.append({**self._record(job_id, fields), 'created': float(fields['created'])})
+            else:
+                await self._redis.srem(key, job_id)
+        return sorted(jobs, key=lambda job: job['created'])
+
+    async def active(self):
+        return []
+
+    async def purge(self, before):
+        # Finished jobs expire on their own
+        pass
+
+
+def open_broker(url=BROKER_URL):
+    """Broker for url, or None when jobs run inside the bot process"""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return SQLiteBroker(url[len("sqlite:///"):])
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported BROKER_URL scheme {parsed.scheme!r}")
+
+
+broker = open_broker()
@@ -0,0 +1,255 @@
+import os
+import time
+import asyncio
+import logging
+import aiohttp
+
+from config import DOWNLOAD_CONNECTIONS, MIN_SEGMENT_SIZE, CHUNK_SIZE
+from helpers import http_client, metrics
+from helpers.progress import throttled
+from helpers.ratelimit import bandwidth
+from helpers.journal import DownloadJournal
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_RETRIES = 3
+
+# Read sizes follow each connection's throughput: about READ_WINDOW seconds of
+# data per read and FLUSH_WINDOW seconds per disk write, within these bounds
+MIN_READ_SIZE = 16 * 1024
+MAX_READ_SIZE = 4 * 1024 * 1024
+MIN_FLUSH_SIZE = 256 * 1024
+MAX_FLUSH_SIZE = 4 * 1024 * 1024
+READ_WINDOW = 0.02
+FLUSH_WINDOW = 0.25
+SPEED_SMOOTHING = 0.2
+
+
+class RangeNotSupported(Exception):
+    """The origin answered a ranged request with something other than 206"""
+
+
+class ChunkSizer:
+    """Adapts read and write-buffer sizes to the observed throughput of one connection"""
+
+    def __init__(self, initial=CHUNK_SIZE * 1024):
+        self.read_size = min(max(initial, MIN_READ_SIZE), MAX_READ_SIZE)
+        self.flush_size = MIN_FLUSH_SIZE
+        self.speed = 0.0
+        self._last = time.monotonic()
+
+    def observe(self, nbytes):
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        if elapsed <= 0:
+            return
+        instant = nbytes / elapsed
+        self.speed = instant if not self.speed else (
+            SPEED_SMOOTHING * instant + (1 - SPEED_SMOOTHING) * self.speed
+        )
+        self.read_size = int(min(max(self.speed * READ_WINDOW, MIN_READ_SIZE), MAX_READ_SIZE))
+        self.flush_size = int(min(max(self.speed * FLUSH_WINDOW, MIN_FLUSH_SIZE), MAX_FLUSH_SIZE))
+
+
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+class PositionedWriter:
+    """
+    Coalesces received chunks and writes them at their file offset in a worker thread
+
+    At most one write is in flight while the next buffer fills, so disk I/O
+    overlaps with the network instead of blocking the event loop. `on_written`
+    is called with the inclusive range of every completed write.
+    """
+
+    def __init__(self, fd, offset, on_written=None):
+        self.fd = fd
+        self.offset = offset  # where the buffered data starts
+        self.on_written = on_written
+        self._buffer = bytearray()
+        self._pending = None
+
+    @property
+    def position(self):
+        """Offset just past the last byte received"""
+        return self.offset + len(self._buffer)
+
+    async def write(self, chunk, flush_size):
+        self._buffer += chunk
+        if len(self._buffer) >= flush_size:
+            await self.flush()
+
+    async def _write(self, data, offset):
+        await asyncio.get_running_loop().run_in_executor(None, _pwrite_all, self.fd, data, offset)
+        if self.on_written:
+            self.on_written(offset, offset + len(data) - 1)
+
+    async def flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, None
+            await pending
+        if self._buffer:
+            data, self._buffer = self._buffer, bytearray()
+            offset, self.offset = self.offset, self.offset + len(data)
+            self._pending = asyncio.ensure_future(self._write(data, offset))
+
+    async def close(self):
+        await self.flush()
+        if self._pending:
+            pending, self._pending = self._pending, None
+            await pending
+
+
+def split_ranges(gaps, connections=DOWNLOAD_CONNECTIONS):
+    """Split inclusive (start, end) gaps into at most roughly `connections` segments"""
+    missing = sum(end - start + 1 for start, end in gaps)
+    segment_size = max(MIN_SEGMENT_SIZE, -(-missing // connections))
+    segments = []
+    for gap_start, gap_end in gaps:
+        for start in range(gap_start, gap_end + 1, segment_size):
+            segments.append((start, min(start + segment_size - 1, gap_end)))
+    return segments
+
+
+def _preallocate(file_path, total_size):
+    fd = os.open(file_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if hasattr(os, 'posix_fallocate'):
+            os.posix_fallocate(fd, 0, total_size)
+        else:
+            os.ftruncate(fd, total_size)
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
+
+
+async def _read_into(response, writer, sizer, state, total, progress, progress_args):
+    while True:
+        chunk = await response.content.read(sizer.read_size)
+        if not chunk:
+            return
+        await bandwidth.consume(len(chunk))
+        metrics.transfer_bytes.inc(len(chunk), stage='download')
+        sizer.observe(len(chunk))
+        await writer.write(chunk, sizer.flush_size)
+        state['downloaded'] += len(chunk)
+        if progress:
+            await progress(state['downloaded'], total, *progress_args)
+
+
+async def _fetch_segment(url, fd, start, end, journal, state, progress, progress_args):
+    def written(first, last):
+        journal.mark(first, last)
+        journal.maybe_save()
+
+    writer = PositionedWriter(fd, start, written)
+    sizer = ChunkSizer()
+    try:
+        for attempt in range(1, SEGMENT_RETRIES + 1):
+            try:
+                headers = {'Range': f'bytes={writer.position}-{end}'}
+                validator = journal.etag or journal.last_modified
+                if validator:
+                    # A changed origin answers 200 with the full body instead of mixing versions
+                    headers['If-Range'] = validator
+                async with http_client.get(url, headers=headers) as response:
+                    if response.status != 206:
+                        raise RangeNotSupported(f"Range request failed with status {response.status}")
+                    await _read_into(
+                        response, writer, sizer, state, journal.total_size, progress, progress_args
+                    )
+
+                if writer.position > end:
+                    return
+                raise aiohttp.ClientPayloadError(f"Segment {start}-{end} ended at {writer.position}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == SEGMENT_RETRIES:
+                    raise
+                logger.warning(f"Segment {start}-{end} failed ({str(e)}), retrying from {writer.position}")
+    finally:
+        # Whatever arrived is valid data; get it on disk so the journal can record it
+        await writer.close()
+
+
+async def _segmented_download(url, file_path, info, progress, progress_args):
+    journal = DownloadJournal.load(file_path)
+    if journal and journal.matches(info['size'], info['etag'], info['last_modified']):
+        logger.info(f"Resuming {file_path} at {journal.completed_bytes}/{journal.total_size} bytes")
+        fd = os.open(file_path, os.O_RDWR)
+    else:
+        journal = DownloadJournal(file_path, info['size'], info['etag'], info['last_modified'])
+        fd = _preallocate(file_path, info['size'])
+
+    state = {'downloaded': journal.completed_bytes}
+    tasks = [
+        asyncio.create_task(
+            _fetch_segment(url, fd, start, end, journal, state, progress, progress_args)
+        )
+        for start, end in split_ranges(journal.missing())
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        journal.save()
+        raise
+    finally:
+        os.close(fd)
+
+    journal.remove()
+
+
+async def _single_stream_download(url, file_path, progress, progress_args):
+    async with http_client.get(url) as response:
+        if response.status != 200:
+            raise Exception("Download failed")
+
+        total_size = int(response.headers.get('content-length', 0))
+        fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        writer = PositionedWriter(fd, 0)
+        try:
+            await _read_into(
+                response, writer, ChunkSizer(), {'downloaded': 0}, total_size, progress, progress_args
+            )
+        finally:
+            try:
+                await writer.close()
+            finally:
+                os.close(fd)
+
+
+async def download_file(url, file_path, progress=None, progress_args=()):
+    """
+    Download url to file_path, using several ranged connections when the origin allows it
+
+    Ranged downloads keep a sidecar journal next to file_path, so calling this
+    again after a failure or restart only fetches the missing byte ranges.
+    Unknown sizes and origins without range support use a single GET.
+    """
+    info = await http_client.probe(url)
+    progress = throttled(progress)
+    started = time.monotonic()
+
+    with metrics.Timer(metrics.stage_seconds, stage='download'):
+        if info['ranges'] and info['size']:
+            try:
+                await _segmented_download(url, file_path, info, progress, progress_args)
+            except RangeNotSupported as e:
+                logger.warning(f"Ranged download refused for {url}: {str(e)}, using single stream")
+                DownloadJournal(file_path, info['size']).remove()
+                await _single_stream_download(url, file_path, progress, progress_args)
+        else:
+            await _single_stream_download(url, file_path, progress, progress_args)
+
+    metrics.observe_transfer('download', os.path.getsize(file_path), started)
+    return file_path
@@ -0,0 +1,181 @@
+import re
+import asyncio
+import logging
+from urllib.parse import unquote
+
+import aiohttp
+
+from config import (
+    HTTP_PROXY, USE_PROXY_FOR_LINKS, HTTP_POOL_SIZE, HTTP_POOL_PER_HOST,
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_KEEPALIVE_TIMEOUT, DNS_CACHE_TTL
+)
+
+from helpers.cache import TTLCache, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+PROBE_CACHE_TTL = 60  # seconds a probe result is reused for the same URL
+PROBE_CACHE_SIZE = 256
+
+_session = None
+probe_cache = TTLCache(PROBE_CACHE_SIZE, PROBE_CACHE_TTL)
+_inflight = SingleFlight()
+
+
+def _proxy_url():
+    if not USE_PROXY_FOR_LINKS or not HTTP_PROXY:
+        return None
+    return HTTP_PROXY if "://" in HTTP_PROXY else f"http://{HTTP_PROXY}"
+
+
+def get_session():
+    """Return the process-wide pooled ClientSession, creating it on first use"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_SIZE,
+            limit_per_host=HTTP_POOL_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        # No total timeout: multi-GB bodies legitimately take longer than any fixed limit
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=HTTP_CONNECT_TIMEOUT,
+            sock_read=HTTP_READ_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def request(method, url, **kwargs):
+    """session.request() on the shared session with the configured proxy applied"""
+    kwargs.setdefault('proxy', _proxy_url())
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def head(url, **kwargs):
+    kwargs.setdefault('allow_redirects', True)
+    return request('HEAD', url, **kwargs)
+
+
+def filename_from_url(url):
+    return url.split('/')[-1].split('?')[0]
+
+
+def _safe_filename(name):
+    """
+    The last path component of a server-supplied name, or None when nothing
+    usable is left; the name is joined into download paths as is
+    """
+    name = re.split(r'[/\\]', name)[-1].strip()
+    if name in ('', '.', '..') or '\0' in name:
+        return None
+    return name
+
+
+def parse_content_disposition(value):
+    """Extract the filename from a Content-Disposition header, or None"""
+    if not value:
+        return None
+    extended = re.search(r"filename\*\s*=\s*([^']*)'[^']*'([^;]+)", value, re.IGNORECASE)
+    if extended:
+        # Percent-decoding can produce separators, e.g. ..%2F..%2Fetc
+        return _safe_filename(unquote(extended.group(2).strip(), encoding=extended.group(1) or 'utf-8'))
+    quoted = re.search(r'filename\s*=\s*"([^"]+)"', value, re.IGNORECASE)
+    if quoted:
+        return _safe_filename(quoted.group(1))
+    bare = re.search(r'filename\s*=\s*([^;]+)', value, re.IGNORECASE)
+    if bare:
+        return _safe_filename(bare.group(1))
+    return None
+
+
+def _apply_headers(info, headers):
+    info['filename'] = parse_content_disposition(headers.get('Content-Disposition')) or info['filename']
+    content_type = headers.get('Content-Type')
+    if content_type:
+        info['content_type'] = content_type.split(';')[0].strip()
+    info['etag'] = headers.get('ETag')
+    info['last_modified'] = headers.get('Last-Modified')
+
+
+def _content_length(headers):
+    """Content-Length as an int, 0 when missing or malformed"""
+    value = headers.get('Content-Length', '').strip()
+    return int(value) if value.isdigit() else 0
+
+
+async def _probe(url):
+    """Return (info, ok); ok is False when neither request got an answer"""
+    info = {
+        'size': 0,
+        'filename': filename_from_url(url),
+        'content_type': None,
+        'ranges': False,
+        'etag': None,
+        'last_modified': None,
+    }
+
+    head_ok = False
+    try:
+        async with head(url) as response:
+            if response.status < 400:
+                head_ok = True
+                _apply_headers(info, response.headers)
+                info['size'] = _content_length(response.headers)
+                info['ranges'] = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(f"HEAD failed for {url}: {str(e)}")
+
+    if head_ok and (info['ranges'] or not info['size']):
+        return info, True
+
+    # HEAD refused, or ranges not advertised: a one-byte ranged GET answers both
+    get_ok = False
+    try:
+        async with get(url, headers={'Range': 'bytes=0-0'}) as response:
+            if response.status == 206:
+                info['ranges'] = True
+                content_range = response.headers.get('Content-Range', '')
+                total = content_range.rsplit('/', 1)[-1]
+                if total.isdigit():
+                    info['size'] = int(total)
+            elif response.status == 200 and not head_ok:
+                info['size'] = _content_length(response.headers)
+            if response.status < 400:
+                get_ok = True
+                if not head_ok:
+                    _apply_headers(info, response.headers)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(f"Ranged probe failed for {url}: {str(e)}")
+
+    return info, head_ok or get_ok
+
+
+async def probe(url):
+    """
+    Return size, filename, content type, range support and validators for url
+
+    Uses a single HEAD where possible, falling back to a one-byte ranged GET.
+    Results are cached briefly so the size, name and download lookups that
+    follow one user request share a single round trip; failed probes are not
+    cached, so a transient error doesn't stick to the URL.
+    """
+    info = probe_cache.get(url)
+    if info is None:
+        info, ok = await _inflight.do(url, _probe, url)
+        if ok:
+            probe_cache.set(url, info)
+    return dict(info)
@@ -0,0 +1,227 @@
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from config import JOB_STORE_DB, DATABASE_URL, JOB_STORE_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATES = ('queued', 'running')
+FINISHED_RETENTION = 24 * 60 * 60  # finished jobs are kept this long for /queue history and debugging
+
+
+class SQLiteBackend:
+    """Job rows in a local SQLite file, written from a single worker thread"""
+
+    def __init__(self, path=JOB_STORE_DB):
+        self.path = path
+        self._db = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, user_id INTEGER, kind TEXT, state TEXT,"
+                " payload TEXT, progress INTEGER, created REAL, updated REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        return self._db
+
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _write(self, records):
+        db = self._connect()
+        for job_id, fields in records.items():
+            fields = dict(fields)
+            if 'payload' in fields:
+                fields['payload'] = json.dumps(fields['payload'])
+            db.execute("INSERT OR IGNORE INTO jobs (id) VALUES (?)", (job_id,))
+            columns = ", ".join(f"{name} = ?" for name in fields)
+            db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+        db.commit()
+
+    def _active(self):
+        rows = self._connect().execute(
+            "SELECT id, user_id, kind, state, payload, progress FROM jobs"
+            " WHERE state IN (?, ?) ORDER BY created", ACTIVE_STATES
+        ).fetchall()
+        return [
+            {'id': r[0], 'user_id': r[1], 'kind': r[2], 'state': r[3],
+             'payload': json.loads(r[4] or "{}"), 'progress': r[5] or 0}
+            for r in rows
+        ]
+
+    def _purge(self, before):
+        db = self._connect()
+        db.execute(
+            "DELETE FROM jobs WHERE state NOT IN (?, ?) AND updated < ?", (*ACTIVE_STATES, before)
+        )
+        db.commit()
+
+    async def write(self, records):
+        await self._call(self._write, records)
+
+    async def active(self):
+        return await self._call(self._active)
+
+    async def purge(self, before):
+        await self._call(self._purge, before)
+
+
+class MongoBackend:
+    """Job documents in MongoDB through motor"""
+
+    def __init__(self, url=DATABASE_URL, database="uploader"):
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        self._jobs = AsyncIOMotorClient(url)[database]["jobs"]
+
+    async def write(self, records):
+        from pymongo import UpdateOne
+
+        await self._jobs.bulk_write([
+            UpdateOne({'_id': job_id}, {'$set': fields}, upsert=True)
+            for job_id, fields in records.items()
+        ], ordered=False)
+
+    async def active(self):
+        cursor = self._jobs.find({'state': {'$in': list(ACTIVE_STATES)}}).sort('created', 1)
+        return [
+            {'id': doc['_id'], 'user_id': doc.get('user_id'), 'kind': doc.get('kind'),
+             'state': doc['state'], 'payload': doc.get('payload') or {}, 'progress': doc.get('progress') or 0}
+            async for doc in cursor
+        ]
+
+    async def purge(self, before):
+        await self._jobs.delete_many({'state': {'$nin': list(ACTIVE_STATES)}, 'updated': {'$lt': before}})
+
+
+class JobStore:
+    """
+    Durable record of scheduler jobs so queued and running work survives restarts
+
+    record() only merges the change into an in-memory batch and returns; a
+    background task writes all pending changes every JOB_STORE_FLUSH_INTERVAL
+    seconds, so job state and progress updates never wait on the database.
+    Jobs are recorded only when they carry a resumable `kind` and a payload
+    describing how to rebuild them.
+    """
+
+    def __init__(self, backend=None, interval=JOB_STORE_FLUSH_INTERVAL):
+        self._backend = backend
+        self.interval = interval
+        self._pending = {}  # job_id -> fields changed since the last flush
+        self._durable = set()
+        self._flusher = None
+        self._handlers = {}
+        self._recovered = False
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = MongoBackend() if DATABASE_URL else SQLiteBackend()
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
+    def handler(self, kind):
+        """The resume handler registered for kind, or None"""
+        return self._handlers.get(kind)
+
+    def resumable(self, kind):
+        """
+        Register `async def handler(client, record)` as the way to rebuild jobs
+        of `kind` after a restart; it should submit the job again under
+        record['id'] from record['payload'].
+        """
+        def decorator(handler):
+            self._handlers[kind] = handler
+            return handler
+        return decorator
+
+    def add(self, job_id, user_id, kind, payload, state='queued'):
+        """Start recording a job; kind selects the resume handler after a restart"""
+        self._durable.add(job_id)
+        self.record(
+            job_id, user_id=user_id, kind=kind, payload=payload, state=state, progress=0, created=time.time()
+        )
+
+    def record(self, job_id, **fields):
+        if job_id not in self._durable:
+            return
+        fields['updated'] = time.time()
+        self._pending.setdefault(job_id, {}).update(fields)
+        if fields.get('state') not in (None, *ACTIVE_STATES):
+            self._durable.discard(job_id)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    def progress(self, job_id, offset):
+        """Remember how far a job got, e.g. bytes downloaded"""
+        if offset is not None:
+            self.record(job_id, progress=offset)
+
+    async def _flush_later(self):
+        # Also picks up changes recorded mid-flush and retries failed batches
+        while self._pending:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write every pending change in one batch"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await self.backend.write(batch)
+        except Exception as e:
+            logger.error(f"Job store write of {len(batch)} jobs failed: {str(e)}")
+            # Keep the changes for the next flush, newer values winning
+            for job_id, fields in batch.items():
+                self._pending[job_id] = {**fields, **self._pending.get(job_id, {})}
+
+    async def recover(self, client, prepare=None):
+        """
+        Re-queue the jobs a previous process left queued or running through
+        their resumable() handlers. `prepare(records)` is awaited first, e.g.
+        to warm caches for all of them at once. Runs once per process;
+        returns the number of jobs recovered.
+        """
+        if self._recovered:
+            return 0
+        self._recovered = True
+        try:
+            await self.backend.purge(time.time() - FINISHED_RETENTION)
+            records = await self.backend.active()
+        except Exception as e:
+            logger.error(f"Job recovery failed: {str(e)}")
+            return 0
+
+        if prepare and records:
+            await prepare(records)
+        recovered = 0
+        for record in records:
+            handler = self._handlers.get(record['kind'])
+            try:
+                if handler is None:
+                    raise ValueError(f"no resume handler for {record['kind']!r}")
+                await handler(client, record)
+                recovered += 1
+            except Exception as e:
+                logger.warning(f"Dropping job {record['id']} on recovery: {str(e)}")
+                self._durable.add(record['id'])
+                self.record(record['id'], state='lost')
+        if records:
+            logger.info(f"Recovered {recovered} of {len(records)} unfinished jobs")
+        return recovered
+
+
+job_store = JobStore()
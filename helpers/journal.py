@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = ".journal"
+CHECKPOINT_INTERVAL = 2  # seconds between journal flushes
+
+
+class DownloadJournal:
+    """
+    Sidecar checkpoint for a partially downloaded file
+
+    Records the total size, the origin's ETag / Last-Modified validators and the
+    byte ranges already written, so an interrupted download can be continued by
+    requesting only the missing ranges.
+    """
+
+    def __init__(self, file_path, total_size, etag=None, last_modified=None, completed=None):
+        self.file_path = file_path
+        self.path = file_path + JOURNAL_SUFFIX
+        self.total_size = total_size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.completed = completed or []
+        self._last_save = 0
+
+    @classmethod
+    def load(cls, file_path):
+        path = file_path + JOURNAL_SUFFIX
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            return cls(
+                file_path,
+                data['total_size'],
+                data.get('etag'),
+                data.get('last_modified'),
+                [list(r) for r in data.get('completed', [])]
+            )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable journal {path}: {str(e)}")
+            return None
+
+    def matches(self, total_size, etag, last_modified):
+        """True if the journal describes the same remote file and the partial file is intact"""
+        if self.total_size != total_size or not (etag or last_modified):
+            return False
+        if etag and self.etag != etag:
+            return False
+        if last_modified and self.last_modified != last_modified:
+            return False
+        return os.path.isfile(self.file_path) and os.path.getsize(self.file_path) == total_size
+
+    @property
+    def completed_bytes(self):
+        return sum(end - start + 1 for start, end in self.completed)
+
+    def mark(self, start, end):
+        """Record the inclusive range start-end as written"""
+        if end < start:
+            return
+        ranges = sorted(self.completed + [[start, end]])
+        merged = [ranges[0]]
+        for r_start, r_end in ranges[1:]:
+            if r_start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], r_end)
+            else:
+                merged.append([r_start, r_end])
+        self.completed = merged
+
+    def missing(self):
+        """Inclusive ranges not yet written"""
+        gaps = []
+        position = 0
+        for start, end in self.completed:
+            if start > position:
+                gaps.append((position, start - 1))
+            position = max(position, end + 1)
+        if position < self.total_size:
+            gaps.append((position, self.total_size - 1))
+        return gaps
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                'total_size': self.total_size,
+                'etag': self.etag,
+                'last_modified': self.last_modified,
+                'completed': self.completed,
+            }, f)
+        os.replace(tmp_path, self.path)
+        self._last_save = time.monotonic()
+
+    def maybe_save(self):
+        if time.monotonic() - self._last_save >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,113 @@
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import datetime
+import logging.handlers
+
+from config import LOG_FILE, LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUPS
+from helpers.storage import current_job
+
+CONSOLE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+class JobFilter(logging.Filter):
+    """Stamp records with the scheduler job of the task that logged them"""
+
+    def filter(self, record):
+        record.job_id = current_job.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, job id and traceback"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'job_id', None):
+            entry['job_id'] = record.job_id
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        job_id = getattr(record, 'job_id', None)
+        return f"[{job_id}] {text}" if job_id else text
+
+
+class BufferedHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that hands records over as they are
+
+    The stock prepare() formats the whole record on the calling thread; here
+    only the message and traceback are rendered to strings, and formatting
+    is left to the writer thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def log_path(role, path=LOG_FILE):
+    """
+    Log file of one process role: LOG_FILE with the role before its extension
+
+    Every process needs a file of its own: rotation renames the file, and
+    other processes would keep writing to the renamed one.
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}.{role}{ext}"
+
+
+def setup_logging(level=LOG_LEVEL, path=LOG_FILE, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUPS):
+    """
+    Route every log record through a queue to a background writer thread
+
+    Logging calls on the event loop only enqueue the record; the listener
+    thread writes text to stderr and JSON lines to a size-rotated log file.
+    Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(ConsoleFormatter(CONSOLE_FORMAT))
+    file = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True
+    )
+    file.setFormatter(JsonFormatter())
+
+    handler = BufferedHandler(queue.SimpleQueue())
+    handler.addFilter(JobFilter())
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(handler.queue, console, file)
+    _listener.start()
+    # Flush whatever is still queued on shutdown
+    atexit.register(_listener.stop)
@@ -0,0 +1,130 @@
+import os
+import json
+import uuid
+import asyncio
+import hashlib
+import logging
+
+from config import DOWNLOAD_LOCATION, MEDIA_PROBE_WORKERS
+from helpers import metrics
+from helpers.cache import TTLCache, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = os.path.join(DOWNLOAD_LOCATION, "thumbs")
+THUMBNAIL_WIDTH = 320  # Telegram's maximum thumbnail size
+PROBE_TIMEOUT = 60
+CACHE_TTL = 24 * 60 * 60
+
+# Results by content key, so the same file or URL is never probed twice
+media_cache = TTLCache(1024, CACHE_TTL)
+_inflight = SingleFlight()
+_semaphore = None
+
+
+def _slots():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MEDIA_PROBE_WORKERS)
+    return _semaphore
+
+
+async def _run(*args):
+    """Run an ffmpeg tool and return its stdout; raises on failure or timeout"""
+    async with _slots():
+        process = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+    if process.returncode != 0:
+        raise RuntimeError(f"{args[0]} failed: {stderr.decode(errors='replace').strip()[-200:]}")
+    return stdout
+
+
+async def probe(source):
+    """
+    Duration and dimensions of a local file or URL via ffprobe
+
+    ffprobe only reads the container headers, so URLs cost a few ranged
+    requests rather than a download.
+    """
+    output = await _run(
+        "ffprobe", "-v", "error", "-print_format", "json",
+        "-show_format", "-show_streams", source
+    )
+    data = json.loads(output)
+    streams = data.get('streams', [])
+    video = next(
+        (s for s in streams if s.get('codec_type') == 'video'
+         and not s.get('disposition', {}).get('attached_pic')),
+        None
+    )
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    duration = float(data.get('format', {}).get('duration') or (video or audio or {}).get('duration') or 0)
+    return {
+        'duration': int(duration),
+        'seconds': duration,
+        'width': int(video['width']) if video else 0,
+        'height': int(video['height']) if video else 0,
+        'has_video': video is not None,
+        'has_audio': audio is not None,
+    }
+
+
+async def extract_thumbnail(source, duration, key=None):
+    """
+    Grab one frame from a tenth of the way in as a JPEG thumbnail; returns its
+    path, named by a hash of key so each cached result keeps its own file
+    """
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    name = hashlib.sha1(key.encode()).hexdigest() if key else uuid.uuid4().hex
+    path = os.path.join(THUMBNAIL_DIR, name + ".jpg")
+    await _run(
+        "ffmpeg", "-y", "-v", "error", "-ss", str(duration / 10 if duration else 0),
+        "-i", source, "-frames:v", "1", "-vf", f"scale='min({THUMBNAIL_WIDTH},iw)':-2", "-q:v", "4",
+        path
+    )
+    return path
+
+
+async def _media_info(source, key):
+    try:
+        with metrics.Timer(metrics.stage_seconds, stage='media_probe'):
+            info = await probe(source)
+        info['thumbnail'] = None
+        if info['has_video']:
+            try:
+                info['thumbnail'] = await extract_thumbnail(source, info['duration'], key)
+            except Exception as e:
+                logger.warning(f"Thumbnail extraction failed for {key or source}: {str(e)}")
+    except Exception as e:
+        logger.warning(f"Media probe failed for {key or source}: {str(e)}")
+        return None
+    if key:
+        media_cache.set(key, info)
+    return info
+
+
+async def media_info(source, key=None):
+    """
+    Cached probe() result plus a 'thumbnail' path for videos, or None when
+    the source can't be probed. `key` identifies the content (a content hash
+    or URL cache key) so repeated uploads skip ffprobe/ffmpeg entirely.
+    Without a key nothing is cached, for one-off files such as split pieces;
+    the caller then deletes the thumbnail once it has been sent.
+    """
+    if not key:
+        return await _media_info(source, None)
+    info = media_cache.get(key)
+    if info is not None and (not info['thumbnail'] or os.path.exists(info['thumbnail'])):
+        return info
+    return await _inflight.do(key, _media_info, source, key)
+
+
+def is_video(info):
+    return bool(info and info['has_video'] and info['duration'])
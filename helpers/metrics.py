@@ -0,0 +1,196 @@
+import time
+import asyncio
+import logging
+
+from aiohttp import web
+
+from config import METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_INTERVAL = 0.5
+THROUGHPUT_BUCKETS = tuple(2 ** i * 1024 * 1024 for i in range(-2, 10))  # 256 KiB/s .. 512 MiB/s
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+_registry = []
+_started = time.time()
+
+
+def _escape(value):
+    """A label value as the Prometheus text format quotes it"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Metric:
+    """
+    Minimal Prometheus metric with optional labels
+
+    Values are plain dict updates, cheap enough for per-chunk hot paths.
+    Metrics created with `collect=` are computed at scrape time from a
+    function returning {label values tuple: value} instead.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.collect = collect
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        values = self.collect() if self.collect else self._values
+        for key, value in values.items():
+            yield self.name, _labels(self.labelnames, key), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {value}" for name, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][i] += 1
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _labels(self.labelnames + ("le",), key + (bound,))
+                yield f"{self.name}_bucket", labels, bucket_count
+            yield f"{self.name}_bucket", _labels(self.labelnames + ("le",), key + ("+Inf",)), count
+            yield f"{self.name}_sum", _labels(self.labelnames, key), total
+            yield f"{self.name}_count", _labels(self.labelnames, key), count
+
+
+def collector(func):
+    """Adapt a function returning a number or {label value: number} to a collect= callback"""
+    def collect():
+        value = func()
+        if isinstance(value, dict):
+            return {(key,) if not isinstance(key, tuple) else key: v for key, v in value.items()}
+        return {(): value}
+    return collect
+
+
+class Timer:
+    """Context manager observing the elapsed seconds into a histogram"""
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.started, **self.labels)
+
+
+transfer_bytes = Counter("uploader_transfer_bytes_total", "Bytes moved per stage", ["stage"])
+transfer_throughput = Histogram(
+    "uploader_transfer_throughput_bytes_per_second", "Throughput of finished transfers per stage",
+    ["stage"], THROUGHPUT_BUCKETS
+)
+stage_seconds = Histogram("uploader_stage_seconds", "Duration of pipeline stages", ["stage"])
+flood_waits = Counter("uploader_floodwait_total", "FloodWait errors received", ["source"])
+flood_wait_seconds = Counter("uploader_floodwait_seconds_total", "Seconds Telegram asked us to wait", ["source"])
+loop_lag = Histogram("uploader_event_loop_lag_seconds", "Event loop scheduling delay", buckets=LAG_BUCKETS)
+
+
+def observe_transfer(stage, size, started):
+    """Record a finished transfer of `size` bytes that began at monotonic time `started`"""
+    elapsed = time.monotonic() - started
+    if size and elapsed > 0:
+        transfer_throughput.observe(size / elapsed, stage=stage)
+
+
+def record_flood_wait(source, seconds):
+    flood_waits.inc(source=source)
+    flood_wait_seconds.inc(seconds, source=source)
+
+
+def render():
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+async def _measure_loop_lag():
+    while True:
+        expected = time.monotonic() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        loop_lag.observe(max(0.0, time.monotonic() - expected))
+
+
+async def _metrics(_):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def _health(_):
+    return web.json_response({'status': 'ok', 'uptime': round(time.time() - _started)})
+
+
+_runner = None
+
+
+async def start_server(port=METRICS_PORT):
+    """Serve /metrics and the / and /health checks, and start measuring loop lag"""
+    global _runner
+    if _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/", _health)
+    app.router.add_get("/health", _health)
+    app.router.add_get("/metrics", _metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, "0.0.0.0", port).start()
+    except BaseException:
+        # Left unset so a later call can try again, e.g. once the port is free
+        await runner.cleanup()
+        raise
+    _runner = runner
+    asyncio.create_task(_measure_loop_lag())
+    logger.info(f"Metrics server listening on port {port}")
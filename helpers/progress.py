@@ -0,0 +1,158 @@
+import time
+import asyncio
+import logging
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from config import PROGRESS_INTERVAL, PROGRESS_MAX_INTERVAL
+from helpers import metrics
+
+logger = logging.getLogger(__name__)
+
+SPEED_SMOOTHING = 0.3  # EWMA weight of the newest speed sample
+IDLE_TIMEOUT = 120  # drop trackers that stopped reporting
+CALLBACK_INTERVAL = 0.5  # minimum gap between callbacks from a transfer loop
+
+
+class ProgressTracker:
+    """
+    Byte counter for one transfer
+
+    update() is synchronous and cheap, so it can be called for every chunk;
+    rendering and message edits happen on the owning chat's timer instead.
+    """
+
+    def __init__(self, message, render, total=0, label=None):
+        self.message = message
+        self.render = render
+        self.label = label
+        self.current = 0
+        self.total = total
+        self.started = time.monotonic()
+        self.updated = self.started
+        self.speed = 0.0
+        self.finished = False
+        self.last_text = None
+        self._sample = (self.started, 0)
+
+    def update(self, current, total=None):
+        self.current = current
+        if total:
+            self.total = total
+        self.updated = time.monotonic()
+        if self.total and current >= self.total:
+            self.finished = True
+
+    def sample(self, now):
+        """Fold the bytes moved since the previous sample into the smoothed speed"""
+        last_time, last_bytes = self._sample
+        elapsed = now - last_time
+        if elapsed <= 0:
+            return
+        instant = (self.current - last_bytes) / elapsed
+        self.speed = instant if not self.speed else (
+            SPEED_SMOOTHING * instant + (1 - SPEED_SMOOTHING) * self.speed
+        )
+        self._sample = (now, self.current)
+
+    @property
+    def percentage(self):
+        return self.current * 100 / self.total if self.total else 0
+
+    @property
+    def eta(self):
+        """Seconds left at the smoothed speed, or None when unknown"""
+        if not self.total or not self.speed:
+            return None
+        return max(self.total - self.current, 0) / self.speed
+
+
+class ProgressHub:
+    """
+    Coalesces progress edits per chat
+
+    Every chat with active trackers gets one loop that samples its trackers on
+    a timer and edits only messages whose rendered text changed. The chat's
+    edit interval backs off when Telegram answers with FloodWait and recovers
+    gradually afterwards, so concurrent jobs in one chat share one budget.
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL, max_interval=PROGRESS_MAX_INTERVAL):
+        self.interval = interval
+        self.max_interval = max_interval
+        self._trackers = {}  # chat_id -> {message_id: ProgressTracker}
+        self._loops = {}
+
+    def get(self, message):
+        return self._trackers.get(message.chat.id, {}).get(message.id)
+
+    def track(self, message, render, total=0, label=None):
+        """
+        Return the tracker for message, creating it (and the chat loop) if needed
+
+        A message reused for a new stage (e.g. "Downloading" then "Uploading")
+        gets a fresh tracker when its `label` changes.
+        """
+        chat_trackers = self._trackers.setdefault(message.chat.id, {})
+        tracker = chat_trackers.get(message.id)
+        if tracker is None or tracker.label != label:
+            tracker = chat_trackers[message.id] = ProgressTracker(message, render, total, label)
+        loop_task = self._loops.get(message.chat.id)
+        if loop_task is None or loop_task.done():
+            self._loops[message.chat.id] = asyncio.create_task(self._chat_loop(message.chat.id))
+        return tracker
+
+    def forget(self, message):
+        self._trackers.get(message.chat.id, {}).pop(message.id, None)
+
+    async def _chat_loop(self, chat_id):
+        interval = self.interval
+        while self._trackers.get(chat_id):
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for message_id, tracker in list(self._trackers.get(chat_id, {}).items()):
+                tracker.sample(now)
+                done = tracker.finished or now - tracker.updated > IDLE_TIMEOUT
+                text = tracker.render(tracker)
+                if text and text != tracker.last_text:
+                    try:
+                        await tracker.message.edit_text(text)
+                        tracker.last_text = text
+                        interval = max(self.interval, interval * 0.8)
+                    except FloodWait as e:
+                        metrics.record_flood_wait('progress', e.value)
+                        interval = min(self.max_interval, max(interval * 2, e.value))
+                        logger.warning(f"FloodWait in chat {chat_id}, progress interval now {interval:.0f}s")
+                        await asyncio.sleep(e.value)
+                        break
+                    except MessageNotModified:
+                        tracker.last_text = text
+                    except Exception as e:
+                        logger.debug(f"Progress edit failed: {str(e)}")
+                if done:
+                    self._trackers[chat_id].pop(message_id, None)
+        self._trackers.pop(chat_id, None)
+        self._loops.pop(chat_id, None)
+
+
+hub = ProgressHub()
+
+
+def throttled(progress, interval=CALLBACK_INTERVAL):
+    """
+    Wrap a progress callback so it runs at most once per `interval` seconds
+
+    The final call (current >= total) is always delivered.
+    """
+    if progress is None:
+        return None
+    last = [0.0]
+
+    async def wrapper(current, total, *args):
+        now = time.monotonic()
+        if now - last[0] < interval and not (total and current >= total):
+            return
+        last[0] = now
+        await progress(current, total, *args)
+
+    return wrapper
@@ -0,0 +1,43 @@
+import time
+import asyncio
+
+from config import BANDWIDTH_LIMIT
+
+
+class TokenBucket:
+    """
+    Async token bucket shared by many tasks
+
+    `rate` is tokens per second and 0 disables limiting. Consumers may overdraw
+    the bucket; they then sleep off their share of the debt, which queues
+    concurrent callers fairly without needing a lock.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def consume(self, amount=1):
+        if not self.rate:
+            return
+        self._refill()
+        self._tokens -= amount
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+    def penalize(self, seconds):
+        """Put the bucket `seconds` into debt, pausing every consumer for that long"""
+        if self.rate:
+            self._refill()
+            self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+# Shared by every transfer so the node stays under BANDWIDTH_LIMIT in total
+bandwidth = TokenBucket(BANDWIDTH_LIMIT)
@@ -0,0 +1,234 @@
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from config import MAX_CONCURRENT_JOBS, MAX_JOBS_PER_USER
+from helpers.storage import storage, current_job
+from helpers.job_store import job_store
+from helpers.broker import broker
+
+logger = logging.getLogger(__name__)
+
+
+class JobRejected(Exception):
+    """The job can never be admitted, e.g. it needs more disk than the node has"""
+
+
+class Job:
+    def __init__(self, user_id, func, args, kwargs, size=0, name=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex[:8]
+        self.user_id = user_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.size = size
+        self.name = name or getattr(func, '__name__', 'job')
+        self.state = 'queued'
+        self.task = None
+        self.cancel_requested = False
+        self.done = asyncio.get_event_loop().create_future()
+        # Most submitters never await the outcome; retrieve it so failures aren't reported twice
+        self.done.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.name} user={self.user_id} {self.state}>"
+
+
+class JobScheduler:
+    """
+    Bounded worker pool with round-robin fairness between users
+
+    Each user has a FIFO of jobs; workers take the head job of the next user in
+    rotation who is under MAX_JOBS_PER_USER. A job is only started when the
+    storage manager can reserve its expected size, and its reservation and
+    temp files are released however it ends.
+
+    With a broker configured, enqueue() hands jobs that have a `kind` to the
+    worker processes instead (see worker.py); workers run them here through
+    the kind's resume handler with the broker unset.
+    """
+
+    def __init__(self, workers=MAX_CONCURRENT_JOBS, per_user=MAX_JOBS_PER_USER, storage=storage, broker=broker):
+        self.workers = workers
+        self.per_user = per_user
+        self.storage = storage
+        self.broker = broker
+        self._queues = OrderedDict()  # user_id -> deque of queued jobs, in rotation order
+        self._jobs = {}
+        self._running = {}  # user_id -> running job count
+        self._condition = None
+        self._tasks = []
+
+    def _ensure_workers(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+            self.storage.start()
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    def submit(self, user_id, func, *args, size=0, name=None, kind=None, payload=None, job_id=None, **kwargs):
+        """
+        Queue func(*args, **kwargs) for user_id and return its Job
+
+        Jobs given a `kind` and a JSON-serialisable `payload` are persisted in
+        the job store and rebuilt by that kind's resume handler after a restart.
+        """
+        self._ensure_workers()
+        job = Job(user_id, func, args, kwargs, size, name, job_id)
+        self._jobs[job.id] = job
+        if kind:
+            job_store.add(job.id, user_id, kind, payload)
+        self._queues.setdefault(user_id, deque()).append(job)
+        asyncio.create_task(self._notify())
+        return job
+
+    def is_remote(self, kind):
+        """Whether jobs of kind run in a worker process rather than here"""
+        return self.broker is not None and kind is not None
+
+    async def enqueue(self, user_id, func, *args, size=0, name=None, kind=None, payload=None, job_id=None,
+                      **kwargs):
+        """
+        submit() through the broker when jobs of kind run remotely
+
+        Returns (job id, queue position). Remote jobs carry only their kind
+        and payload; the worker rebuilds func and args with the resume handler.
+        """
+        if self.is_remote(kind):
+            job_id = job_id or uuid.uuid4().hex[:8]
+            await self.broker.put(job_id, user_id, kind, payload)
+            return job_id, await self.broker.position(job_id)
+        job = self.submit(
+            user_id, func, *args, size=size, name=name, kind=kind, payload=payload, job_id=job_id, **kwargs
+        )
+        return job.id, self.position(job.id)
+
+    async def _notify(self):
+        async with self._condition:
+            self._condition.notify_all()
+
+    def _order(self):
+        """Queued jobs in the order workers will pick them, ignoring admission"""
+        queues = [list(q) for q in self._queues.values()]
+        order = []
+        depth = 0
+        while any(depth < len(q) for q in queues):
+            order.extend(q[depth] for q in queues if depth < len(q))
+            depth += 1
+        return order
+
+    def position(self, job_id):
+        """1-based queue position, 0 if the job is running, None if unknown or finished"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if job.state == 'running':
+            return 0
+        return self._order().index(job) + 1
+
+    def queue_depth(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def running(self):
+        return sum(self._running.values())
+
+    def jobs(self):
+        return list(self._jobs.values())
+
+    def user_jobs(self, user_id):
+        return [job for job in self._jobs.values() if job.user_id == user_id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if there was nothing to cancel"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        if job.state == 'queued':
+            self._queues[job.user_id].remove(job)
+            if not self._queues[job.user_id]:
+                del self._queues[job.user_id]
+            self._finish(job, 'cancelled')
+            job.done.cancel()
+            return True
+        if job.task:
+            job.cancel_requested = True
+            job.task.cancel()
+            return True
+        return False
+
+    def _pick(self):
+        for user_id, queue in list(self._queues.items()):
+            if self._running.get(user_id, 0) >= self.per_user:
+                continue
+            job = queue[0]
+            if job.size and not self.storage.can_reserve(job.size):
+                if not self.storage.reserved:
+                    # Nothing running that could free space up: this job can never start
+                    queue.popleft()
+                    self._finish(job, 'rejected')
+                    job.done.set_exception(JobRejected("Not enough disk space for this file"))
+                    if not queue:
+                        del self._queues[user_id]
+                continue
+            queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            return job
+        return None
+
+    def _finish(self, job, state):
+        job.state = state
+        self._jobs.pop(job.id, None)
+        if state != 'interrupted':
+            job_store.record(job.id, state=state)
+
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                job = await self._condition.wait_for(self._pick)
+                job.state = 'running'
+                self._running[job.user_id] = self._running.get(job.user_id, 0) + 1
+
+            interrupted = False
+            try:
+                # _pick saw enough space, but a reservation made since may have taken it
+                self.storage.reserve(job.id, job.size)
+                job_store.record(job.id, state='running')
+                # The task copies the context, so everything it spawns sees its job id
+                token = current_job.set(job.id)
+                job.task = asyncio.create_task(job.func(*job.args, **job.kwargs))
+                current_job.reset(token)
+                result = await job.task
+            except asyncio.CancelledError:
+                job.done.cancel()
+                if not job.cancel_requested:
+                    # Shutdown rather than /cancel: leave the job stored as running to resume it
+                    interrupted = True
+                    self._finish(job, 'interrupted')
+                    raise
+                self._finish(job, 'cancelled')
+            except Exception as e:
+                logger.error(f"Job {job.id} ({job.name}) failed: {str(e)}")
+                self._finish(job, 'failed')
+                job.done.set_exception(e)
+            else:
+                self._finish(job, 'done')
+                job.done.set_result(result)
+            finally:
+                async with self._condition:
+                    self._running[job.user_id] -= 1
+                    if not self._running[job.user_id]:
+                        del self._running[job.user_id]
+                    # An interrupted job resumes from its partial files and journals
+                    self.storage.release(job.id, keep_files=interrupted)
+                    self._condition.notify_all()
+
+
+scheduler = JobScheduler()
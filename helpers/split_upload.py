@@ -0,0 +1,183 @@
+import os
+import math
+import asyncio
+import hashlib
+import logging
+
+from config import SPLIT_SIZE, SPLIT_VIDEO
+from helpers.storage import storage, remove_quietly
+from helpers.utils import file_size_format
+from helpers.media_probe import media_info, is_video
+from helpers.upload_engine import (
+    PART_SIZE, upload_limit, uploader_for, upload_parts, file_parts, deliver_document
+)
+
+logger = logging.getLogger(__name__)
+
+# Segments are cut by duration, so leave room for bitrate peaks and container overhead
+SEGMENT_HEADROOM = 0.9
+SEGMENT_RETRIES = 3
+# A tail shorter than this is folded into the piece before it
+MIN_SEGMENT_SECONDS = 5
+
+
+def split_ranges(size, limit):
+    """(start, end) byte ranges of at most limit bytes covering size, cut on PART_SIZE boundaries"""
+    step = max(limit // PART_SIZE, 1) * PART_SIZE
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def part_name(file_name, index):
+    return f"{file_name}.{index:03d}"
+
+
+def _offset(progress, done, total):
+    """Progress callback of one part, reporting against the whole file"""
+    if progress is None:
+        return None
+
+    async def callback(current, _, *args):
+        await progress(min(done + current, total), total, *args)
+
+    return callback
+
+
+async def _hashed(parts, digest):
+    """Pass (index, bytes) parts through, feeding them to digest off the event loop"""
+    loop = asyncio.get_running_loop()
+    async for index, data in parts:
+        await loop.run_in_executor(None, digest.update, data)
+        yield index, data
+
+
+async def _send_part(client, chat_id, parts, size, file_name, caption, progress, progress_args, media=None):
+    uploader = await uploader_for(client, size)
+    input_file = await upload_parts(uploader, parts, size, file_name, progress, progress_args)
+    return await deliver_document(client, uploader, chat_id, input_file, file_name, caption=caption, media_info=media)
+
+
+async def _split_bytes(client, chat_id, path, file_name, limit, caption, progress, progress_args):
+    """Send path as byte ranges read straight from the file; returns (messages, manifest lines)"""
+    size = os.path.getsize(path)
+    ranges = split_ranges(size, limit)
+    digest = hashlib.sha256()
+    sent = []
+    for index, (start, end) in enumerate(ranges, 1):
+        name = part_name(file_name, index)
+        sent.append(await _send_part(
+            client, chat_id, _hashed(file_parts(path, start, end), digest), end - start, name,
+            f"{caption or file_name}\n\nPart {index}/{len(ranges)}",
+            _offset(progress, start, size), progress_args
+        ))
+    names = [part_name(file_name, index) for index in range(1, len(ranges) + 1)]
+    lines = [f"`{name}` - {file_size_format(end - start)}" for name, (start, end) in zip(names, ranges)]
+    lines += [
+        "",
+        "Rejoin the parts in order:",
+        f"`cat {' '.join(names)} > {file_name}`",
+        f"`copy /b {'+'.join(names)} {file_name}` (Windows)",
+        f"SHA-256: `{digest.hexdigest()}`",
+    ]
+    return sent, lines
+
+
+async def cut_segment(path, output, start, duration=None):
+    """
+    Copy duration seconds of path, or the rest of it, from the keyframe at or
+    before start into output, without re-encoding
+    """
+    limit = ["-t", str(duration)] if duration is not None else []
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-ss", str(start), "-i", path, *limit,
+        "-map", "0", "-c", "copy", "-avoid_negative_ts", "make_zero", "-movflags", "+faststart",
+        output,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg segment failed: {stderr.decode(errors='replace').strip()}")
+
+
+async def _split_video(client, chat_id, path, file_name, limit, caption, progress, progress_args, media):
+    """
+    Send a video as pieces that each play on their own
+
+    Pieces are cut one at a time by stream copy, sized from the average
+    bitrate, and deleted once sent, so at most one extra piece is on disk.
+    Cuts snap to keyframes, so neighbouring pieces may share a few frames.
+    A tail under MIN_SEGMENT_SECONDS goes into the last piece.
+    """
+    size = os.path.getsize(path)
+    duration = media.get('seconds') or media['duration']
+    stem, ext = os.path.splitext(file_name)
+    step = duration * limit * SEGMENT_HEADROOM / size
+    total = math.ceil(duration / step)
+    sent, lines, done, start, index = [], [], 0, 0.0, 1
+    while start < duration:
+        name = f"{stem}.part{index:03d}{ext}"
+        segment = os.path.join(os.path.dirname(path), name)
+        storage.track(segment)
+        probe = None
+        try:
+            remaining = duration - start
+            length = step if remaining - step >= MIN_SEGMENT_SECONDS else remaining
+            for _ in range(SEGMENT_RETRIES):
+                await cut_segment(path, segment, start, length if length < remaining else None)
+                if os.path.getsize(segment) <= limit:
+                    break
+                length *= limit * SEGMENT_HEADROOM / os.path.getsize(segment)
+                length = min(length, max(remaining - MIN_SEGMENT_SECONDS, MIN_SEGMENT_SECONDS))
+            else:
+                raise ValueError(f"Couldn't cut {file_name} into pieces under {file_size_format(limit)}")
+            segment_size = os.path.getsize(segment)
+            # Probed while the piece uploads; pieces are one-off, so the result isn't cached
+            probe = asyncio.ensure_future(media_info(segment))
+            sent.append(await _send_part(
+                client, chat_id, file_parts(segment), segment_size, name,
+                f"{caption or file_name}\n\nPart {index}/{max(total, index)}",
+                _offset(progress, done, size), progress_args, probe
+            ))
+        finally:
+            remove_quietly(segment)
+            if probe is not None:
+                probe.cancel()
+                if probe.done() and not probe.cancelled() and probe.result():
+                    remove_quietly(probe.result()['thumbnail'])
+        lines.append(f"`{name}` - {file_size_format(segment_size)}")
+        done += segment_size
+        start += length
+        index += 1
+    lines += ["", "Each part plays on its own."]
+    return sent, lines
+
+
+async def upload_split(client, chat_id, path, file_name, caption=None, progress=None, progress_args=(),
+                       media=None, limit=None):
+    """
+    Send a file too big for one upload as consecutive parts, then a manifest
+
+    Parts are uploaded from byte ranges of the file itself, so nothing is
+    copied to disk; with SPLIT_VIDEO, videos are instead cut into playable
+    pieces by ffmpeg. The manifest lists the parts and, for byte ranges, how
+    to rejoin them and the SHA-256 of the whole file. It is sent as a reply
+    to the first part and returned.
+    """
+    limit = min(limit or SPLIT_SIZE, await upload_limit(client))
+    if asyncio.isfuture(media):
+        media = await media
+    size = os.path.getsize(path)
+    if SPLIT_VIDEO and is_video(media):
+        sent, lines = await _split_video(
+            client, chat_id, path, file_name, limit, caption, progress, progress_args, media
+        )
+    else:
+        sent, lines = await _split_bytes(client, chat_id, path, file_name, limit, caption, progress, progress_args)
+    logger.info(f"Sent {file_name} ({size} bytes) in {len(sent)} parts")
+    header = f"**{file_name}** ({file_size_format(size)}) was sent in {len(sent)} parts:"
+    return await client.send_message(
+        chat_id,
+        "\n".join([header, ""] + lines),
+        reply_to_message_id=sent[0].id if sent and sent[0] else None
+    )
@@ -0,0 +1,196 @@
+import os
+import re
+import time
+import shutil
+import asyncio
+import logging
+import contextvars
+
+from config import DOWNLOAD_LOCATION, MIN_FREE_DISK, STALE_FILE_AGE
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_ROOTS = (DOWNLOAD_LOCATION, "Download")
+EVICT_INTERVAL = 10 * 60
+SCAN_INTERVAL = 5  # seconds a count of evictable bytes is reused by admission checks
+JOURNAL_SUFFIX = ".journal"
+
+# Id of the scheduler job the current task belongs to, so helpers deep in a
+# download can attach their temp files to it without threading it through
+current_job = contextvars.ContextVar('current_job', default=None)
+
+# User thumbnails saved as DOWNLOAD_LOCATION/<user_id>.jpg are kept forever
+_THUMBNAIL = re.compile(r"^\d+\.jpg$")
+
+
+class InsufficientStorage(Exception):
+    """Not enough free disk space for a job, even after evicting stale files"""
+
+
+class StorageManager:
+    """
+    Disk space reservations and temp-file bookkeeping for the download folders
+
+    Jobs reserve their expected size before starting and register the files
+    they create; release() frees the reservation and deletes whatever the job
+    left behind, whether it succeeded, failed or was cancelled. Files no job
+    owns are removed at startup and evicted least-recently-used first when
+    space runs short or they outlive STALE_FILE_AGE.
+    """
+
+    def __init__(self, roots=DOWNLOAD_ROOTS, min_free=MIN_FREE_DISK, max_age=STALE_FILE_AGE):
+        self.roots = roots
+        self.min_free = min_free
+        self.max_age = max_age
+        self._reservations = {}  # job_id -> bytes
+        self._files = {}  # job_id -> set of paths
+        self._evictor = None
+        self._evictable = None  # (monotonic time, bytes of unowned files) of the last scan
+
+    @property
+    def reserved(self):
+        return sum(self._reservations.values())
+
+    def _disk_path(self):
+        for root in self.roots:
+            if os.path.isdir(root):
+                return root
+        return "."
+
+    def available(self):
+        """Bytes that can still be promised to new jobs"""
+        return shutil.disk_usage(self._disk_path()).free - self.reserved - self.min_free
+
+    def evictable(self):
+        """Bytes eviction could free, from a scan at most SCAN_INTERVAL seconds old"""
+        now = time.monotonic()
+        if self._evictable is None or now - self._evictable[0] >= SCAN_INTERVAL:
+            self._evictable = (now, sum(size for _, size, _ in self._candidates()))
+        return self._evictable[1]
+
+    def can_reserve(self, size):
+        """
+        Whether size bytes fit, evicting unowned files if that is enough to make room
+
+        Called by the scheduler on every wakeup for each waiting job, so the
+        folders are only walked again once the last count is SCAN_INTERVAL old.
+        """
+        shortfall = size - self.available()
+        if shortfall <= 0:
+            return True
+        if shortfall > self.evictable():
+            return False
+        return self.evict(shortfall) >= shortfall
+
+    def reserve(self, job_id, size):
+        if size and not self.can_reserve(size):
+            raise InsufficientStorage(f"Need {size} bytes, {max(self.available(), 0)} available")
+        self._reservations[job_id] = self._reservations.get(job_id, 0) + size
+
+    def track(self, path, job_id=None):
+        """Register path as a temp file of job_id (default: the current job)"""
+        job_id = job_id or current_job.get()
+        if job_id and path:
+            self._files.setdefault(job_id, set()).add(os.path.abspath(path))
+
+    def release(self, job_id, keep_files=False):
+        """
+        Drop the job's reservation and delete any of its temp files still on disk
+
+        With keep_files the files stay for a resumed job to continue from;
+        they are only no longer owned by this process.
+        """
+        self._reservations.pop(job_id, None)
+        files = self._files.pop(job_id, ())
+        if keep_files:
+            return
+        for path in files:
+            remove_quietly(path)
+            remove_quietly(path + JOURNAL_SUFFIX)
+
+    def _owned(self):
+        return set().union(*self._files.values()) if self._files else set()
+
+    def _candidates(self):
+        """Unowned files under the roots, least recently used first"""
+        owned = self._owned()
+        candidates = []
+        for root in self.roots:
+            if not os.path.isdir(root):
+                continue
+            for dirpath, _, filenames in os.walk(root):
+                for name in filenames:
+                    path = os.path.abspath(os.path.join(dirpath, name))
+                    if path in owned or path.endswith(JOURNAL_SUFFIX) or _THUMBNAIL.match(name):
+                        continue
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    candidates.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path))
+        candidates.sort()
+        return candidates
+
+    def evict(self, needed=0):
+        """
+        Delete unowned files older than max_age, then more LRU files until
+        `needed` bytes are freed. Returns the number of bytes freed.
+        """
+        freed = 0
+        now = time.time()
+        for used, size, path in self._candidates():
+            if now - used < self.max_age and freed >= needed:
+                break
+            if remove_quietly(path):
+                remove_quietly(path + JOURNAL_SUFFIX)
+                freed += size
+        self._evictable = None
+        if freed:
+            logger.info(f"Evicted {freed} bytes of stale downloads")
+        return freed
+
+    def cleanup_startup(self):
+        """
+        Remove files left behind by a previous process
+
+        Partial downloads with a recent resume journal are kept so they can
+        be continued; everything else unowned goes.
+        """
+        now = time.time()
+        for _, _, path in self._candidates():
+            journal = path + JOURNAL_SUFFIX
+            if os.path.exists(journal) and now - os.path.getmtime(journal) < self.max_age:
+                continue
+            remove_quietly(path)
+            remove_quietly(journal)
+
+    def start(self):
+        """Clean up after the previous run and start periodic eviction (idempotent)"""
+        if self._evictor is None:
+            self.cleanup_startup()
+            self._evictor = asyncio.create_task(self._evict_periodically())
+
+    async def _evict_periodically(self):
+        while True:
+            await asyncio.sleep(EVICT_INTERVAL)
+            try:
+                self.evict()
+            except Exception as e:
+                logger.error(f"Stale file eviction failed: {str(e)}")
+
+
+def remove_quietly(path):
+    """os.remove that ignores missing files and empty paths; True if something was deleted"""
+    if not path:
+        return False
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logger.warning(f"Could not remove {path}: {str(e)}")
+        return False
+
+
+storage = StorageManager()
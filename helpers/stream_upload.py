@@ -0,0 +1,121 @@
+import asyncio
+import inspect
+import logging
+
+import aiohttp
+
+from config import STREAM_BUFFER_PARTS
+from helpers import http_client, metrics
+from helpers.progress import throttled
+from helpers.ratelimit import bandwidth
+from helpers.upload_engine import (
+    PART_SIZE, BIG_FILE_THRESHOLD, BOT_UPLOAD_LIMIT, upload_limit, uploader_for, upload_parts, deliver_document,
+    uploaded_document
+)
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+STREAM_RETRIES = 3
+
+
+async def _read_parts(url, info):
+    """
+    Cut the HTTP body into PART_SIZE parts, yielded in order as (index, bytes)
+
+    When the connection breaks and the origin supports ranges and sent a
+    validator, the body is requested again from the first part not yet
+    yielded, up to STREAM_RETRIES times, so bytes already handed to the
+    upload are never fetched twice.
+    If-Range makes a changed origin answer 200 instead, which fails the
+    stream rather than mixing two versions of the file.
+    """
+    total_size = info['size']
+    validator = info['etag'] or info['last_modified']
+    part = 0
+    for attempt in range(1, STREAM_RETRIES + 1):
+        offset = part * PART_SIZE
+        headers = {}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            if validator:
+                headers['If-Range'] = validator
+        received = offset
+        buffer = bytearray()
+        try:
+            async with http_client.get(url, headers=headers) as response:
+                if response.status != (206 if offset else 200):
+                    raise Exception(f"Download failed with status {response.status}")
+
+                async for chunk in response.content.iter_chunked(READ_SIZE):
+                    await bandwidth.consume(len(chunk))
+                    metrics.transfer_bytes.inc(len(chunk), stage='download')
+                    buffer += chunk
+                    received += len(chunk)
+                    while len(buffer) >= PART_SIZE:
+                        yield part, bytes(buffer[:PART_SIZE])
+                        del buffer[:PART_SIZE]
+                        part += 1
+
+            if received < total_size:
+                raise aiohttp.ClientPayloadError(f"Origin closed the body at {received} bytes")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == STREAM_RETRIES or not (info['ranges'] and validator):
+                raise
+            logger.warning(f"Stream of {url} broke ({str(e)}), resuming at byte {part * PART_SIZE}")
+            continue
+
+        if received != total_size:
+            raise Exception(f"Origin sent {received} bytes, expected {total_size}")
+        if buffer:
+            yield part, bytes(buffer)
+        return
+
+
+async def stream_url_to_chat(client, chat_id, url, file_name, caption=None, progress=None, progress_args=(),
+                             media_info=None):
+    """
+    Upload url to chat_id while it downloads, without staging it on disk
+
+    Parts are handed to the upload engine as soon as they arrive, through a
+    queue of at most STREAM_BUFFER_PARTS parts, so memory stays bounded and
+    the upload finishes shortly after the download does. Returns None when
+    the URL is not suitable for streaming (unknown or small size, or too big
+    for one upload) so the caller can fall back to downloading the file first. `media_info` is
+    passed on to deliver_document.
+    """
+    info = await http_client.probe(url)
+    total_size = info['size']
+    if total_size <= BIG_FILE_THRESHOLD or total_size > await upload_limit(client):
+        return None
+
+    uploader = await uploader_for(client, total_size)
+    input_file = await upload_parts(
+        uploader, _read_parts(url, info), total_size, file_name,
+        throttled(progress), progress_args, buffer=STREAM_BUFFER_PARTS
+    )
+    return await deliver_document(
+        client, uploader, chat_id, input_file, file_name, info['content_type'], caption, media_info
+    )
+
+
+async def stream_url_media(client, chat_id, url, file_name, media_info=None):
+    """
+    upload_media() for a URL: upload it while it downloads, without sending it
+
+    Returns the InputDocument for send_album(), or None when the URL is not
+    suitable for streaming or too big for the bot, so the caller can
+    download it first. `media_info` may be an awaitable, e.g. a probe
+    started alongside the upload.
+    """
+    info = await http_client.probe(url)
+    total_size = info['size']
+    if total_size <= BIG_FILE_THRESHOLD or total_size > BOT_UPLOAD_LIMIT:
+        return None
+
+    input_file = await upload_parts(
+        client, _read_parts(url, info), total_size, file_name, buffer=STREAM_BUFFER_PARTS
+    )
+    if inspect.isawaitable(media_info):
+        media_info = await media_info
+    return await uploaded_document(client, chat_id, input_file, file_name, media_info)
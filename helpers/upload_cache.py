@@ -0,0 +1,157 @@
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+from config import UPLOAD_CACHE_DB, UPLOAD_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def url_key(url):
+    """Cache key for a direct link: scheme/host lower-cased, fragment dropped, query sorted"""
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return "url:" + urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+
+def ytdl_key(video_key, format_id):
+    """Cache key for a yt-dlp download: normalised video key plus the format selector"""
+    return f"ytdl:{video_key}|{format_id}"
+
+
+def _hash_file(path):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return "hash:" + digest.hexdigest()
+
+
+async def content_key(path):
+    """Cache key derived from the file contents, hashed off the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(None, _hash_file, path)
+
+
+def media_file_id(message):
+    """file_id of whatever media a sent Message carries, or None"""
+    for attr in ("document", "video", "audio", "animation", "voice", "photo"):
+        media = getattr(message, attr, None)
+        if media:
+            return media.file_id
+    return None
+
+
+class UploadCache:
+    """
+    Persistent map from content keys to Telegram file_ids already uploaded by the bot
+
+    Backed by SQLite and accessed from a single worker thread. Entries carry
+    the origin's ETag/Last-Modified so a changed source is uploaded again, and
+    the least recently used entries are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, path=UPLOAD_CACHE_DB, max_entries=UPLOAD_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload-cache")
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                " key TEXT PRIMARY KEY, file_id TEXT NOT NULL, kind TEXT,"
+                " validator TEXT, meta TEXT, created REAL, last_used REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS uploads_last_used ON uploads (last_used)")
+        return self._db
+
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _get(self, key, validator):
+        db = self._connect()
+        row = db.execute(
+            "SELECT file_id, kind, validator, meta FROM uploads WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        file_id, kind, stored_validator, meta = row
+        if validator and stored_validator and validator != stored_validator:
+            db.execute("DELETE FROM uploads WHERE key = ?", (key,))
+            db.commit()
+            return None
+        db.execute("UPDATE uploads SET last_used = ? WHERE key = ?", (time.time(), key))
+        db.commit()
+        return {'file_id': file_id, 'kind': kind, 'meta': json.loads(meta or "{}")}
+
+    def _put(self, key, file_id, kind, validator, meta):
+        db = self._connect()
+        now = time.time()
+        db.execute(
+            "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, file_id, kind, validator, json.dumps(meta or {}), now, now)
+        )
+        db.execute(
+            "DELETE FROM uploads WHERE key IN ("
+            " SELECT key FROM uploads ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        db.commit()
+
+    def _delete(self, key):
+        db = self._connect()
+        db.execute("DELETE FROM uploads WHERE key = ?", (key,))
+        db.commit()
+
+    async def get(self, key, validator=None):
+        """Cached entry for key, dropped and reported as a miss if `validator` changed"""
+        try:
+            entry = await self._call(self._get, key, validator)
+        except sqlite3.Error as e:
+            logger.error(f"Upload cache lookup failed: {str(e)}")
+            entry = None
+        if entry:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    async def put(self, key, file_id, kind="document", validator=None, meta=None):
+        try:
+            await self._call(self._put, key, file_id, kind, validator, meta)
+        except sqlite3.Error as e:
+            logger.error(f"Upload cache write failed: {str(e)}")
+
+    async def invalidate(self, key):
+        try:
+            await self._call(self._delete, key)
+        except sqlite3.Error as e:
+            logger.error(f"Upload cache invalidation failed: {str(e)}")
+
+
+upload_cache = UploadCache()
+
+
+async def send_cached(client, chat_id, key, validator=None, **kwargs):
+    """Resend the cached upload for key to chat_id; None on a miss or a stale file_id"""
+    entry = await upload_cache.get(key, validator)
+    if not entry:
+        return None
+    kwargs.setdefault('caption', entry['meta'].get('caption'))
+    try:
+        return await client.send_cached_media(chat_id, entry['file_id'], **kwargs)
+    except Exception as e:
+        logger.warning(f"Cached file_id for {key} unusable, re-uploading: {str(e)}")
+        await upload_cache.invalidate(key)
+        return None
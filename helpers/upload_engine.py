@@ -0,0 +1,358 @@
+import os
+import math
+import time
+import asyncio
+import inspect
+import logging
+
+from pyrogram import Client, raw, types, utils
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+
+from config import (
+    API_ID, API_HASH, SESSION_STRING, UPLOAD_SESSIONS, UPLOAD_WORKERS,
+    PREMIUM_UPLOADS, LARGE_FILE_CHAT
+)
+
+from helpers import metrics
+
+logger = logging.getLogger(__name__)
+
+PART_SIZE = 512 * 1024  # largest part accepted by upload.saveBigFilePart
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024  # Telegram's cut-off for "big" uploads
+BOT_UPLOAD_LIMIT = 2000 * 1024 * 1024
+PREMIUM_UPLOAD_LIMIT = 4000 * 1024 * 1024
+PART_RETRIES = 3
+PART_RETRY_DELAY = 1  # seconds before the first retry, doubled for each one after
+
+_sessions = {}  # id(client) -> list of started media sessions
+_sessions_lock = None
+_premium_client = None
+
+
+def _lock():
+    global _sessions_lock
+    if _sessions_lock is None:
+        _sessions_lock = asyncio.Lock()
+    return _sessions_lock
+
+
+async def media_sessions(client):
+    """UPLOAD_SESSIONS media connections for client, opened once and reused"""
+    async with _lock():
+        sessions = _sessions.get(id(client))
+        if sessions is None:
+            dc_id = await client.storage.dc_id()
+            auth_key = await client.storage.auth_key()
+            test_mode = await client.storage.test_mode()
+            sessions = []
+            for _ in range(UPLOAD_SESSIONS):
+                session = Session(client, dc_id, auth_key, test_mode, is_media=True)
+                await session.start()
+                sessions.append(session)
+            _sessions[id(client)] = sessions
+        return sessions
+
+
+async def close_sessions():
+    async with _lock():
+        for sessions in _sessions.values():
+            for session in sessions:
+                await session.stop()
+        _sessions.clear()
+
+
+async def premium_client():
+    """The user-session client used for uploads above the bot limit, or None"""
+    global _premium_client
+    if not (PREMIUM_UPLOADS and SESSION_STRING and LARGE_FILE_CHAT):
+        return None
+    async with _lock():
+        if _premium_client is None:
+            uploader = Client(
+                "premium-uploader",
+                api_id=API_ID,
+                api_hash=API_HASH,
+                session_string=SESSION_STRING,
+                in_memory=True,
+                no_updates=True
+            )
+            await uploader.start()
+            _premium_client = uploader
+    return _premium_client
+
+
+async def upload_limit(client):
+    """Largest file client can get into a chat in one piece, with the premium session if there is one"""
+    uploader = await premium_client()
+    if uploader is not None and uploader.me.is_premium:
+        return PREMIUM_UPLOAD_LIMIT
+    return BOT_UPLOAD_LIMIT
+
+
+async def uploader_for(client, size):
+    """Client that should upload `size` bytes: the bot, or the premium user above 2000 MiB"""
+    if size <= BOT_UPLOAD_LIMIT:
+        return client
+    uploader = await premium_client()
+    if uploader is None or not uploader.me.is_premium or size > PREMIUM_UPLOAD_LIMIT:
+        raise ValueError(f"Can't upload files bigger than {BOT_UPLOAD_LIMIT // 1024 // 1024} MiB")
+    return uploader
+
+
+async def _save_parts(session, file_id, total_parts, queue, state, progress, progress_args):
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+
+        part, data = item
+        rpc = raw.functions.upload.SaveBigFilePart(
+            file_id=file_id,
+            file_part=part,
+            file_total_parts=total_parts,
+            bytes=data
+        )
+        for attempt in range(1, PART_RETRIES + 1):
+            try:
+                await session.invoke(rpc)
+                break
+            except FloodWait as e:
+                if attempt == PART_RETRIES:
+                    raise
+                metrics.record_flood_wait('upload', e.value)
+                logger.warning(f"Part {part} upload hit a flood wait, sleeping {e.value}s")
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                if attempt == PART_RETRIES:
+                    raise
+                delay = PART_RETRY_DELAY * 2 ** (attempt - 1)
+                logger.warning(f"Part {part} upload failed ({str(e)}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+        metrics.transfer_bytes.inc(len(data), stage='upload')
+        state['uploaded'] += len(data)
+        if progress:
+            await progress(state['uploaded'], state['total'], *progress_args)
+
+
+async def upload_parts(client, parts, total_size, file_name, progress=None, progress_args=(),
+                       buffer=UPLOAD_WORKERS * 2):
+    """
+    Upload a big file from an async iterator of (index, bytes) parts
+
+    Parts are spread over UPLOAD_WORKERS concurrent saveBigFilePart calls on
+    the client's pooled media sessions, with at most `buffer` parts queued.
+    Returns the InputFileBig to send.
+    """
+    sessions = await media_sessions(client)
+    file_id = client.rnd_id()
+    total_parts = math.ceil(total_size / PART_SIZE)
+    queue = asyncio.Queue(maxsize=buffer)
+    state = {'uploaded': 0, 'total': total_size}
+    started = time.monotonic()
+
+    async def produce():
+        async for item in parts:
+            await queue.put(item)
+
+    workers = [
+        asyncio.create_task(
+            _save_parts(sessions[i % len(sessions)], file_id, total_parts, queue, state, progress, progress_args)
+        )
+        for i in range(UPLOAD_WORKERS)
+    ]
+    producer = asyncio.create_task(produce())
+    try:
+        # Workers only finish before the sentinel by failing, so whichever task
+        # completes first either ends the stream or carries the error
+        done, _ = await asyncio.wait([producer, *workers], return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    except BaseException:
+        for task in [producer, *workers]:
+            task.cancel()
+        await asyncio.gather(producer, *workers, return_exceptions=True)
+        raise
+
+    metrics.stage_seconds.observe(time.monotonic() - started, stage='upload')
+    metrics.observe_transfer('upload', total_size, started)
+    return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+
+
+async def file_parts(path, start=0, end=None):
+    """Async iterator of (index, bytes) parts of path[start:end], read off the event loop"""
+    loop = asyncio.get_running_loop()
+    end = os.path.getsize(path) if end is None else end
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        for index, offset in enumerate(range(start, end, PART_SIZE)):
+            length = min(PART_SIZE, end - offset)
+            yield index, await loop.run_in_executor(None, os.pread, fd, length, offset)
+    finally:
+        os.close(fd)
+
+
+async def uploaded_media(client, input_file, file_name, mime_type=None, media_info=None):
+    """
+    InputMediaUploadedDocument for an uploaded file
+
+    With a media_probe.media_info() result for a video, the document carries
+    duration, dimensions and thumbnail so it is shown as a streamable video.
+    """
+    attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+    thumb = None
+    if media_info and media_info['has_video'] and media_info['duration']:
+        attributes.append(raw.types.DocumentAttributeVideo(
+            duration=media_info['duration'],
+            w=media_info['width'],
+            h=media_info['height'],
+            supports_streaming=True
+        ))
+        if media_info['thumbnail']:
+            thumb = await client.save_file(media_info['thumbnail'])
+    return raw.types.InputMediaUploadedDocument(
+        mime_type=client.guess_mime_type(file_name) or mime_type or "application/zip",
+        file=input_file,
+        thumb=thumb,
+        attributes=attributes
+    )
+
+
+async def send_uploaded_document(client, chat_id, input_file, file_name, mime_type=None, caption=None,
+                                 media_info=None):
+    """Send an already uploaded InputFile/InputFileBig as a document and return the Message"""
+    media = await uploaded_media(client, input_file, file_name, mime_type, media_info)
+    r = await client.invoke(
+        raw.functions.messages.SendMedia(
+            peer=await client.resolve_peer(chat_id),
+            media=media,
+            random_id=client.rnd_id(),
+            **await utils.parse_text_entities(client, caption, None, None)
+        )
+    )
+    for update in r.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(
+                client, update.message,
+                {u.id: u for u in r.users},
+                {c.id: c for c in r.chats}
+            )
+
+
+async def deliver_document(client, uploader, chat_id, input_file, file_name, mime_type=None, caption=None,
+                           media_info=None):
+    """
+    Send an uploaded file to chat_id from the bot
+
+    Files uploaded by the premium user session are posted to LARGE_FILE_CHAT
+    first and copied from there, since the file belongs to the user account.
+    `media_info` may also be an awaitable, e.g. a probe started alongside
+    the upload.
+    """
+    if inspect.isawaitable(media_info):
+        media_info = await media_info
+    if uploader is client:
+        return await send_uploaded_document(client, chat_id, input_file, file_name, mime_type, caption, media_info)
+
+    relay = await send_uploaded_document(
+        uploader, LARGE_FILE_CHAT, input_file, file_name, mime_type, caption, media_info
+    )
+    return await client.copy_message(chat_id, LARGE_FILE_CHAT, relay.id)
+
+
+async def upload_document(client, chat_id, path, file_name, caption=None, progress=None, progress_args=(),
+                          media_info=None):
+    """
+    Upload a big local file over parallel media sessions and send it as a document
+
+    Returns None for files under Telegram's big-file threshold, which gain
+    nothing from parallel parts; send those with send_document as usual.
+    """
+    size = os.path.getsize(path)
+    if size <= BIG_FILE_THRESHOLD:
+        return None
+
+    uploader = await uploader_for(client, size)
+    input_file = await upload_parts(uploader, file_parts(path), size, file_name, progress, progress_args)
+    return await deliver_document(
+        client, uploader, chat_id, input_file, file_name, caption=caption, media_info=media_info
+    )
+
+
+async def upload_media(client, chat_id, path, file_name, media_info=None, progress=None, progress_args=()):
+    """
+    Upload a local file without sending it, for grouping into an album
+
+    Returns the InputDocument that send_album() accepts. Big files use the
+    parallel part upload, small ones a single save_file.
+    """
+    size = os.path.getsize(path)
+    if size <= BIG_FILE_THRESHOLD:
+        input_file = await client.save_file(path, progress=progress, progress_args=progress_args)
+    else:
+        input_file = await upload_parts(client, file_parts(path), size, file_name, progress, progress_args)
+    return await uploaded_document(client, chat_id, input_file, file_name, media_info)
+
+
+async def uploaded_document(client, chat_id, input_file, file_name, media_info=None):
+    """InputDocument for an uploaded InputFile/InputFileBig, registered with Telegram but not sent"""
+    r = await client.invoke(
+        raw.functions.messages.UploadMedia(
+            peer=await client.resolve_peer(chat_id),
+            media=await uploaded_media(client, input_file, file_name, media_info=media_info)
+        )
+    )
+    return raw.types.InputDocument(
+        id=r.document.id,
+        access_hash=r.document.access_hash,
+        file_reference=r.document.file_reference
+    )
+
+
+async def send_album(client, chat_id, documents, captions=None):
+    """Send up to ten uploaded documents as one media group and return the Messages"""
+    captions = captions or [None] * len(documents)
+    if len(documents) == 1:
+        # A media group needs at least two items
+        r = await client.invoke(
+            raw.functions.messages.SendMedia(
+                peer=await client.resolve_peer(chat_id),
+                media=raw.types.InputMediaDocument(id=documents[0]),
+                random_id=client.rnd_id(),
+                **await utils.parse_text_entities(client, captions[0], None, None)
+            )
+        )
+        return await _parse_sent(client, r)
+    multi_media = [
+        raw.types.InputSingleMedia(
+            media=raw.types.InputMediaDocument(id=document),
+            random_id=client.rnd_id(),
+            **await utils.parse_text_entities(client, caption, None, None)
+        )
+        for document, caption in zip(documents, captions)
+    ]
+    r = await client.invoke(
+        raw.functions.messages.SendMultiMedia(
+            peer=await client.resolve_peer(chat_id),
+            multi_media=multi_media
+        )
+    )
+    return await _parse_sent(client, r)
+
+
+async def _parse_sent(client, r):
+    return await utils.parse_messages(
+        client,
+        raw.types.messages.Messages(
+            messages=[
+                update.message for update in r.updates
+                if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage))
+            ],
+            users=r.users,
+            chats=r.chats
+        )
+    )
@@ -0,0 +1,93 @@
+import os
+import logging
+
+from config import DOWNLOAD_LOCATION, USER_CACHE_SIZE, USER_CACHE_TTL
+from helpers.cache import TTLCache, SingleFlight
+from plugins.database.database import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {'upload_as_doc': False, 'thumbnail': None}
+
+
+class UserSettings:
+    """
+    In-process cache of per-user settings in front of the database
+
+    Reads are served from a TTL/LRU cache and concurrent misses for one user
+    share a single db.get_user_data() query. Updates go through set(), which
+    writes to the database first (db.set_<field>) and then to the cache, so
+    a cached entry is never newer than what is stored.
+    """
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self._cache = TTLCache(maxsize, ttl)
+        self._inflight = SingleFlight()
+
+    async def _load(self, user_id):
+        data = await db.get_user_data(user_id)
+        if data:
+            self._cache.set(user_id, dict(data))
+        return data
+
+    async def get(self, user_id):
+        """The user's settings document, or None when the user is unknown"""
+        data = self._cache.get(user_id)
+        if data is None:
+            data = await self._inflight.do(user_id, self._load, user_id)
+        return dict(data) if data else None
+
+    async def value(self, user_id, key):
+        data = await self.get(user_id) or {}
+        return data.get(key, DEFAULTS.get(key))
+
+    async def upload_as_doc(self, user_id):
+        return await self.value(user_id, 'upload_as_doc')
+
+    async def thumbnail(self, user_id):
+        return await self.value(user_id, 'thumbnail')
+
+    async def set(self, user_id, **fields):
+        """Write fields through to the database (db.set_<field>) and the cache"""
+        for key, value in fields.items():
+            await getattr(db, f"set_{key}")(user_id, value)
+        data = self._cache.get(user_id)
+        if data is not None:
+            data.update(fields)
+
+    def invalidate(self, user_id):
+        self._cache.pop(user_id)
+
+    async def prefetch(self, user_ids):
+        """Load the settings of many users with one query instead of one per user"""
+        missing = [user_id for user_id in set(user_ids) if user_id not in self._cache]
+        if not missing:
+            return
+        try:
+            async for doc in db.col.find({'id': {'$in': missing}}):
+                self._cache.set(doc['id'], dict(doc))
+        except Exception as e:
+            logger.warning(f"Settings prefetch for {len(missing)} users failed: {str(e)}")
+
+
+user_settings = UserSettings()
+
+
+def thumbnail_path(user_id):
+    """Local copy of the user's custom thumbnail, which the storage manager never evicts"""
+    return f"{DOWNLOAD_LOCATION}/{user_id}.jpg"
+
+
+async def thumbnail_file(client, user_id):
+    """The user's custom thumbnail as a local file, fetched once from its file_id; None when unset"""
+    path = thumbnail_path(user_id)
+    if os.path.isfile(path):
+        return path
+    file_id = await user_settings.thumbnail(user_id)
+    if not file_id:
+        return None
+    try:
+        return await client.download_media(file_id, file_name=path)
+    except Exception as e:
+        logger.warning(f"Fetching the thumbnail of user {user_id} failed: {str(e)}")
+        return None
@@ -1,7 +1,9 @@
-import re
 import os
 import logging
-import aiohttp
+
+from helpers import http_client
+from helpers.downloader import download_file
+from helpers.storage import storage, current_job
 
 PROGRESS_BAR_TEMPLATE = """
 Percentage: {percentage} | {current}
@@ -20,29 +22,26 @@ def progressArgs(action: str, progress_message, start_time):
         '░'
     )
 
-async def async_download_file(url, filename, progress=None, progress_args=()):
+def download_path(filename, prefix=None):
+    """
+    Download/<prefix>-<filename>, the prefix defaulting to the current job's id
+
+    Keeps jobs that fetch files of the same name from sharing one file and
+    journal; a job resumed after a restart keeps its id and finds its
+    partial file again.
+    """
     download_directory = "Download"
     if not os.path.exists(download_directory):
         os.makedirs(download_directory)
-    
-    file_path = os.path.join(download_directory, filename)
+    prefix = prefix or current_job.get()
+    return os.path.join(download_directory, f"{prefix}-{filename}" if prefix else filename)
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status != 200:
-                raise Exception("Download failed")
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded_size = 0
+async def async_download_file(url, filename, progress=None, progress_args=()):
+    file_path = download_path(filename)
+    # Owned by the running job, so a failed or cancelled download gets cleaned up
+    storage.track(file_path)
 
-            with open(file_path, "wb") as file:
-                async for chunk in response.content.iter_chunked(1024):
-                    file.write(chunk)
-                    downloaded_size += len(chunk)
-                    if progress:
-                        await progress(downloaded_size, total_size, *progress_args)
-    
-    return file_path
+    return await download_file(url, file_path, progress, progress_args)
 
 def file_size_format(num, suffix='B'):
     for unit in ['', 'Ki', 'Mi', 'Gi', 'Ti', 'Pi', 'Ei', 'Zi']:
@@ -52,25 +51,13 @@ def file_size_format(num, suffix='B'):
     return f"{num:.1f}Yi{suffix}"
 
 async def get_file_size(url):
-    async with aiohttp.ClientSession() as session:
-        async with session.head(url, allow_redirects=True) as response:
-            size = response.headers.get('content-length')
-            if size:
-                return int(size)
-            else:
-                return 0
+    info = await http_client.probe(url)
+    return info['size']
 
 async def get_filename(url):
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.head(url, allow_redirects=True) as response:
-                content_disposition = response.headers.get('Content-Disposition')
-                if content_disposition:
-                    filename_match = re.findall('filename="(.+)"', content_disposition)
-                    if filename_match:
-                        return filename_match[0]
-
-                return url.split('/')[-1].split('?')[0]
+        info = await http_client.probe(url)
+        return info['filename']
     except Exception as e:
         logging.error(f"Error fetching filename from headers: {str(e)}")
-        return url.split('/')[-1].split('?')[0]
+        return http_client.filename_from_url(url)
@@ -0,0 +1,305 @@
+import os
+import re
+import time
+import copy
+import asyncio
+import inspect
+import logging
+import threading
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    YTDL_WORKERS, PROCESS_MAX_TIMEOUT, YTDL_CACHE_SIZE, YTDL_CACHE_TTL, YTDL_FRAGMENT_CONCURRENCY
+)
+from helpers import metrics
+from helpers.cache import TTLCache, SingleFlight
+from helpers.storage import storage, current_job, remove_quietly
+from helpers.job_store import job_store
+
+logger = logging.getLogger(__name__)
+
+YOUTUBE_REGEX = r'(?:https?://)?(?:www\.)?(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/shorts/)([a-zA-Z0-9_-]+)'
+PLAYLIST_REGEX = r'(?:https?://)?(?:www\.|m\.)?youtube\.com/(?:playlist\?|channel/|c/|user/|@)'
+
+# Signed stream URLs must still be valid when the download starts
+EXPIRY_MARGIN = 15 * 60
+
+# yt-dlp spends most of its time in network I/O and ffmpeg subprocesses, so
+# threads give the needed concurrency without pickling hooks across processes
+_executor = ThreadPoolExecutor(max_workers=YTDL_WORKERS, thread_name_prefix="ytdl")
+
+# Raw (unprocessed) extractor results, so format selection and downloads can
+# reuse one extraction whatever processing options they are run with
+info_cache = TTLCache(YTDL_CACHE_SIZE, YTDL_CACHE_TTL)
+# Options that change the extractor's result rather than its processing;
+# they are applied to the extraction and make part of its cache key
+EXTRACT_OPTIONS = ('noplaylist', 'playlist_items', 'playlistend', 'extractor_args', 'cookiefile', 'proxy')
+_inflight = SingleFlight()
+
+
+class DownloadAborted(Exception):
+    """Raised inside yt-dlp's progress hook to stop a timed-out or cancelled download"""
+
+
+def cache_key(url):
+    """Normalise url to a cache key: the video id for YouTube links, else the URL"""
+    match = re.search(YOUTUBE_REGEX, url)
+    if match:
+        return f"youtube:{match.group(1)}"
+    return url.strip()
+
+
+def _extract_opts(opts):
+    """The options of opts that change what is extracted; single videos unless noplaylist=False"""
+    extract = {name: opts[name] for name in EXTRACT_OPTIONS if name in opts}
+    extract.setdefault('noplaylist', True)
+    return extract
+
+
+def _info_key(url, extract_opts):
+    """info_cache key: cache_key(url), plus any extraction options beyond the default"""
+    extra = {name: value for name, value in extract_opts.items() if (name, value) != ('noplaylist', True)}
+    return f"{cache_key(url)}|{sorted(extra.items())!r}" if extra else cache_key(url)
+
+
+def _ttl_for(info):
+    """Cache lifetime for an extraction, capped by the earliest stream URL expiry"""
+    ttl = YTDL_CACHE_TTL
+    now = time.time()
+    for fmt in info.get('formats') or []:
+        expire = parse_qs(urlparse(fmt.get('url', '')).query).get('expire')
+        if expire and expire[0].isdigit():
+            ttl = min(ttl, int(expire[0]) - now - EXPIRY_MARGIN)
+    return max(ttl, 0)
+
+
+# yt_dlp is imported on first use, in the pool threads: loading it and its
+# extractors costs about a second and tens of MB the bot doesn't need to start
+
+def _extract_raw(url, opts):
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        return ydl.extract_info(url, download=False, process=False)
+
+
+def _process(raw_info, opts, download):
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.process_ie_result(copy.deepcopy(raw_info), download=download)
+        return info, ydl.prepare_filename(info)
+
+
+async def _run(func, *args, timeout=PROCESS_MAX_TIMEOUT, abort=None):
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, func, *args)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # The worker thread can't be killed; ask yt-dlp to bail out at its next hook call
+        if abort is not None:
+            abort.set()
+        raise
+
+
+def _load_extractors():
+    from yt_dlp.extractor import gen_extractor_classes
+
+    # Matching a URL compiles the _VALID_URL of every extractor tried; the
+    # generic fallback tries them all, so the first extraction pays for it
+    for ie in gen_extractor_classes():
+        ie.suitable("https://example.com/")
+
+
+async def prewarm():
+    """Import yt-dlp and compile its extractors in the pool, ahead of the first request"""
+    started = time.monotonic()
+    await _run(_load_extractors)
+    logger.info(f"yt-dlp extractors loaded in {time.monotonic() - started:.1f}s")
+
+
+async def _fetch_raw(url, key, extract_opts):
+    with metrics.Timer(metrics.stage_seconds, stage='ytdl_extract'):
+        raw_info = await _run(_extract_raw, url, {'quiet': True, 'no_warnings': True, **extract_opts})
+    ttl = _ttl_for(raw_info)
+    if ttl:
+        info_cache.set(key, raw_info, ttl)
+    return raw_info
+
+
+async def get_raw_info(url, opts=None):
+    """
+    Unprocessed extractor result for url, served from cache when fresh
+
+    Only the EXTRACT_OPTIONS in opts are used. Links to a video in a
+    playlist extract just that video unless opts sets noplaylist=False.
+    """
+    extract_opts = _extract_opts(opts or {})
+    key = _info_key(url, extract_opts)
+    raw_info = info_cache.get(key)
+    if raw_info is None:
+        # Concurrent requests for the same video share one extraction
+        raw_info = await _inflight.do(key, _fetch_raw, url, key, extract_opts)
+    return raw_info
+
+
+async def extract_info(url, **opts):
+    """Equivalent of YoutubeDL(opts).extract_info(url, download=False), cached"""
+    opts.setdefault('quiet', True)
+    opts.setdefault('no_warnings', True)
+    raw_info = await get_raw_info(url, opts)
+    info, _ = await _run(_process, raw_info, opts, False)
+    return info
+
+
+def is_playlist(url):
+    """Whether url is a YouTube playlist or channel rather than a single video"""
+    return re.match(PLAYLIST_REGEX, url.strip()) is not None
+
+
+def _list_entries(url, limit):
+    import yt_dlp
+
+    opts = {'quiet': True, 'no_warnings': True, 'extract_flat': 'in_playlist', 'playlistend': limit}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    urls = []
+    for entry in info.get('entries') or []:
+        if entry.get('ie_key') == 'YoutubeTab':
+            continue  # a nested tab or playlist, not a video
+        if entry.get('ie_key') == 'Youtube':
+            urls.append(f"https://www.youtube.com/watch?v={entry['id']}")
+        elif entry.get('url'):
+            urls.append(entry['url'])
+    return info.get('title'), urls[:limit]
+
+
+async def list_entries(url, limit):
+    """(title, video URLs) of a playlist or channel, without extracting each video"""
+    url = url.strip()
+    if "playlist?" not in url and not re.search(r'/(videos|shorts|streams)/?$', url):
+        # A channel's home page lists its tabs; the uploads live on /videos
+        url = url.split('?')[0].rstrip('/') + '/videos'
+    return await _run(_list_entries, url, limit)
+
+
+async def estimate_size(url, format):
+    """Expected download size in bytes of url in `format`, 0 when unknown"""
+    try:
+        info = await extract_info(url, format=format)
+    except Exception as e:
+        logger.debug(f"Size estimate failed for {url}: {str(e)}")
+        return 0
+    formats = info.get('requested_formats') or [info]
+    return sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in formats)
+
+
+async def _download(url, raw_info, opts, progress, timeout):
+    loop = asyncio.get_running_loop()
+    abort = threading.Event()
+    job_id = current_job.get()
+
+    def deliver(status):
+        result = progress(status)
+        if inspect.isawaitable(result):
+            asyncio.ensure_future(result)
+
+    def track(status):
+        storage.track(status.get('tmpfilename'), job_id)
+        storage.track(status.get('filename'), job_id)
+        job_store.progress(job_id, status.get('downloaded_bytes'))
+
+    def hook(status):
+        if abort.is_set():
+            raise DownloadAborted("Download aborted")
+        loop.call_soon_threadsafe(track, status)
+        if progress:
+            loop.call_soon_threadsafe(deliver, status)
+
+    opts = dict(opts)
+    opts['progress_hooks'] = list(opts.get('progress_hooks', [])) + [hook]
+    info, filename = await _run(_process, raw_info, opts, True, timeout=timeout, abort=abort)
+    storage.track(filename, job_id)
+    for thumbnail in info.get('thumbnails') or []:
+        storage.track(thumbnail.get('filepath'), job_id)
+    return info, filename
+
+
+async def merge_streams(video_file, audio_file, output_file):
+    """Remux a video-only and an audio-only file into output_file without re-encoding"""
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-i", video_file, "-i", audio_file,
+        "-map", "0:v:0", "-map", "1:a:0", "-c", "copy", "-movflags", "+faststart",
+        output_file,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg merge failed: {stderr.decode(errors='replace').strip()}")
+
+
+async def _download_merged(url, raw_info, info, filename, opts, progress, timeout):
+    """
+    Fetch the video and audio formats of a DASH selection at the same time,
+    each into its own .f<format_id> file, then merge them into filename
+    """
+    base = filename.rsplit(".", 1)[0].replace("%", "%%")  # literal in the output template
+
+    async def fetch(fmt, extra):
+        part_opts = dict(opts, **extra, format=fmt['format_id'], outtmpl=f"{base}.f{fmt['format_id']}.%(ext)s")
+        return await _download(url, raw_info, part_opts, progress, timeout)
+
+    video, audio = info['requested_formats']
+    (video_info, video_file), (_, audio_file) = await asyncio.gather(
+        fetch(video, {}),
+        fetch(audio, {'writethumbnail': False})
+    )
+    storage.track(filename)
+    try:
+        with metrics.Timer(metrics.stage_seconds, stage='ffmpeg_merge'):
+            await merge_streams(video_file, audio_file, filename)
+    finally:
+        remove_quietly(video_file)
+        remove_quietly(audio_file)
+    info['thumbnails'] = video_info.get('thumbnails')
+    return info, filename
+
+
+async def _download_selected(url, raw_info, opts, progress, timeout):
+    if '+' in str(opts.get('format', '')):
+        info, filename = await _run(_process, raw_info, opts, False)
+        if len(info.get('requested_formats') or []) == 2:
+            return await _download_merged(url, raw_info, info, filename, opts, progress, timeout)
+    return await _download(url, raw_info, opts, progress, timeout)
+
+
+async def download(url, opts, progress=None, timeout=PROCESS_MAX_TIMEOUT):
+    """
+    Download url in the yt-dlp pool, returning (info_dict, filename)
+
+    Reuses a cached extraction when there is one. `progress` receives yt-dlp's
+    progress dicts on the event loop and may be a plain function or a
+    coroutine function. The download is aborted once `timeout` seconds pass
+    or the awaiting task is cancelled. Files yt-dlp writes are tracked as
+    temp files of the current scheduler job.
+
+    Selections of separate video and audio formats (e.g. "137+140") are
+    downloaded concurrently with fragment concurrency and remuxed with
+    ffmpeg stream copy, rather than one after the other by yt-dlp.
+    """
+    opts = dict(opts)
+    opts.setdefault('quiet', True)
+    opts.setdefault('no_warnings', True)
+    opts.setdefault('concurrent_fragment_downloads', YTDL_FRAGMENT_CONCURRENCY)
+    raw_info = await get_raw_info(url, opts)
+    started = time.monotonic()
+    with metrics.Timer(metrics.stage_seconds, stage='ytdl_download'):
+        info, filename = await _download_selected(url, raw_info, opts, progress, timeout)
+    size = os.path.getsize(filename) if os.path.exists(filename) else 0
+    metrics.transfer_bytes.inc(size, stage='ytdl_download')
+    metrics.observe_transfer('ytdl_download', size, started)
+    return info, filename
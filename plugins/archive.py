@@ -0,0 +1,91 @@
+import logging
+
+from pyrogram import Client, filters, StopPropagation
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from helpers import http_client
+from helpers.archive import ArchiveExtractor, archive_kind
+from helpers.batch import find_urls
+from helpers.job_store import job_store
+from helpers.progress import hub
+from helpers.scheduler import scheduler
+from helpers.storage import current_job
+
+logger = logging.getLogger(__name__)
+
+
+def render_archive(tracker):
+    total = f"/{tracker.total}" if tracker.total else ""
+    return (
+        f"🗜 **Extracting archive...**\n\n"
+        f"Processed: {tracker.current}{total}"
+    )
+
+
+async def archive_job(status, url, kind, done=()):
+    """Scheduler job: send the files inside the archive at url"""
+    tracker = hub.track(status, render_archive, label="archive")
+    extractor = ArchiveExtractor(
+        status._client, status.chat.id, url, kind, current_job.get(), done,
+        progress=tracker.update, meta={'status_id': status.id, 'kind': kind}
+    )
+    tracker.update(extractor.processed)
+    try:
+        sent, failed, skipped = await extractor.run()
+    finally:
+        hub.forget(status)
+
+    lines = [f"✅ **Archive extracted:** {sent} file(s) sent"]
+    if extractor.truncated:
+        lines.append("⚠️ Stopped at the file count or size limit.")
+    for title, names in (("❌ {} failed:", failed), ("⏭ {} skipped:", skipped)):
+        if names:
+            lines.append(title.format(len(names)))
+            lines.extend(f"• {name}" for name in names[:10])
+    await status.edit_text("\n".join(lines), disable_web_page_preview=True)
+
+
+async def submit_archive(status, user_id, url, kind, done=(), job_id=None):
+    job_id, position = await scheduler.enqueue(
+        user_id, archive_job, status, url, kind, done, job_id=job_id, name="archive",
+        kind="archive", payload={'chat_id': status.chat.id, 'status_id': status.id, 'url': url, 'kind': kind,
+                                 'done': list(done)}
+    )
+    await status.edit_text(
+        f"🗜 **Archive queued at position {position}...**",
+        reply_markup=InlineKeyboardMarkup(
+            [[InlineKeyboardButton("✖️ Cancel", callback_data=f"cancel_job|{job_id}")]]
+        )
+    )
+
+
+@job_store.resumable("archive")
+async def resume_archive(client, record):
+    payload = record['payload']
+    status = await client.get_messages(payload['chat_id'], payload['status_id'])
+    if status.empty:
+        status = await client.send_message(payload['chat_id'], "🗜 **Resuming archive after restart...**")
+    await submit_archive(
+        status, record['user_id'], payload['url'], payload['kind'], payload['done'], job_id=record['id']
+    )
+
+
+# Ahead of the single-link handler, which would upload the archive itself
+@Client.on_message(filters.command("extract") & filters.private, group=-2)
+async def extract_command(_, message):
+    reply = message.reply_to_message
+    urls = find_urls(" ".join(message.command[1:])) or find_urls(reply.text if reply else None)
+    if not urls:
+        await message.reply_text("Usage: `/extract <link to a .zip or .tar archive>`", quote=True)
+        raise StopPropagation
+
+    url = urls[0]
+    info = await http_client.probe(url)
+    kind = archive_kind(info['filename'], info['content_type'])
+    if kind is None:
+        await message.reply_text("❌ **That link isn't a zip or tar archive.**", quote=True)
+        raise StopPropagation
+
+    status = await message.reply_text("🗜 **Preparing archive...**", quote=True)
+    await submit_archive(status, message.from_user.id, url, kind)
+    raise StopPropagation
@@ -0,0 +1,108 @@
+import uuid
+import asyncio
+import logging
+
+from pyrogram import Client, filters, StopPropagation
+
+from helpers import ytdl_service
+from helpers.batch import Batch, find_urls, expand
+from helpers.job_store import job_store
+from helpers.progress import hub
+
+logger = logging.getLogger(__name__)
+
+_batches = {}  # batch id -> running Batch
+
+
+def is_batch(_, __, message):
+    urls = find_urls(message.text)
+    return len(urls) > 1 or any(ytdl_service.is_playlist(url) for url in urls)
+
+
+batch_filter = filters.create(is_batch)
+
+
+def render_batch(tracker, batch_id):
+    return (
+        f"📦 **Batch in progress...**\n\n"
+        f"Processed: {tracker.current}/{tracker.total}\n"
+        f"Stop it with `/cancel {batch_id}`"
+    )
+
+
+async def run_batch(status, user_id, urls, batch_id, done=()):
+    """
+    Expand playlists, then download and upload every item as its own scheduler
+    job. A stopping bot cancels this task, leaving the batch stored as running
+    so it resumes after the restart.
+    """
+    try:
+        if not done:
+            await status.edit_text("🔎 **Collecting links...**")
+            urls = await expand(urls)
+        tracker = hub.track(status, lambda t: render_batch(t, batch_id), len(urls), label="batch")
+        batch = Batch(
+            status._client, status.chat.id, user_id, urls, batch_id, done,
+            progress=tracker.update, meta={'status_id': status.id}
+        )
+        _batches[batch_id] = batch
+        # Checkpoint the expanded list so a resumed batch doesn't expand playlists again
+        job_store.record(batch_id, state='running', payload=batch.payload)
+        tracker.update(batch.processed)
+        try:
+            sent, failed = await batch.run()
+        finally:
+            _batches.pop(batch_id, None)
+            hub.forget(status)
+    except Exception as e:
+        logger.error(f"Batch {batch_id} failed: {str(e)}")
+        job_store.record(batch_id, state='failed')
+        await status.edit_text(f"❌ **Batch failed:** {str(e)}")
+        return
+
+    job_store.record(batch_id, state='cancelled' if batch.cancelled else 'done')
+    title = "🛑 **Batch cancelled:**" if batch.cancelled else "✅ **Batch finished:**"
+    lines = [f"{title} {sent}/{len(urls)} sent"]
+    if failed:
+        lines.append(f"❌ {len(failed)} failed:")
+        lines.extend(f"• {url}" for url in failed[:10])
+    await status.edit_text("\n".join(lines), disable_web_page_preview=True)
+
+
+def start_batch(status, user_id, urls, done=(), batch_id=None):
+    """
+    Run a batch in the background; only its items go through the scheduler,
+    so a batch never holds one of the user's job slots while it waits on them
+    """
+    batch_id = batch_id or uuid.uuid4().hex[:8]
+    payload = {'chat_id': status.chat.id, 'status_id': status.id, 'urls': urls, 'done': list(done)}
+    job_store.add(batch_id, user_id, "batch", payload, state='running')
+    asyncio.create_task(run_batch(status, user_id, urls, batch_id, done))
+    return batch_id
+
+
+def cancel_batch(batch_id, user_id):
+    """Cancel one of the user's running batches; False if there is no such batch"""
+    batch = _batches.get(batch_id)
+    if batch is None or batch.user_id != user_id:
+        return False
+    batch.cancel()
+    return True
+
+
+@job_store.resumable("batch")
+async def resume_batch(client, record):
+    payload = record['payload']
+    status = await client.get_messages(payload['chat_id'], payload['status_id'])
+    if status.empty:
+        status = await client.send_message(payload['chat_id'], "📦 **Resuming batch after restart...**")
+    start_batch(status, record['user_id'], payload['urls'], payload['done'], batch_id=record['id'])
+
+
+# Ahead of the single-link handler, which would otherwise take the first URL only
+@Client.on_message(filters.private & filters.text & batch_filter, group=-2)
+async def batch_message(_, message):
+    urls = find_urls(message.text)
+    status = await message.reply_text("📦 **Preparing batch...**", quote=True)
+    start_batch(status, message.from_user.id, urls)
+    raise StopPropagation
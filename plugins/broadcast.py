@@ -0,0 +1,102 @@
+import uuid
+import asyncio
+import logging
+
+from pyrogram import Client, filters
+
+from config import OWNER_ID
+from helpers.broadcast import Broadcast
+from helpers.job_store import job_store
+from helpers.progress import hub
+from plugins.database.database import db
+
+logger = logging.getLogger(__name__)
+
+_running = {}  # job_id -> asyncio.Task
+
+
+def render_broadcast(broadcast):
+    def render(tracker):
+        counts = broadcast.counts
+        return (
+            f"📣 **Broadcasting...** `{broadcast.job_id}`\n\n"
+            f"Processed: {tracker.current}/{tracker.total or '?'}\n"
+            f"✅ Delivered: {counts['delivered']}\n"
+            f"🚫 Blocked: {counts['blocked']}\n"
+            f"❌ Failed: {counts['failed']}\n"
+            f"Rate: {broadcast.limiter.rate:.1f} msg/s\n\n"
+            f"Use `/broadcast stop` to stop it."
+        )
+    return render
+
+
+async def run_broadcast(broadcast, status):
+    """Run a broadcast in the background, reporting on the `status` message"""
+    total = await db.col.count_documents({})
+    tracker = hub.track(status, render_broadcast(broadcast), total, label="broadcast")
+    tracker.update(broadcast.processed)
+    try:
+        counts = await broadcast.run(progress=tracker.update)
+    except asyncio.CancelledError:
+        if broadcast.job_id in _running:
+            # Shutdown, not /broadcast stop: stay recorded as running and resume later
+            raise
+        job_store.record(broadcast.job_id, state='cancelled')
+        counts, title = broadcast.counts, "🛑 **Broadcast stopped**"
+    except Exception as e:
+        logger.error(f"Broadcast {broadcast.job_id} failed: {str(e)}")
+        job_store.record(broadcast.job_id, state='failed')
+        counts, title = broadcast.counts, f"❌ **Broadcast failed:** {str(e)}"
+    else:
+        job_store.record(broadcast.job_id, state='done')
+        title = "✅ **Broadcast finished**"
+    finally:
+        _running.pop(broadcast.job_id, None)
+        hub.forget(status)
+
+    await status.edit_text(
+        f"{title}\n\n"
+        f"✅ Delivered: {counts['delivered']}\n"
+        f"🚫 Blocked: {counts['blocked']}\n"
+        f"❌ Failed: {counts['failed']}"
+    )
+
+
+def start_broadcast(broadcast, status):
+    _running[broadcast.job_id] = asyncio.create_task(run_broadcast(broadcast, status))
+
+
+@job_store.resumable("broadcast")
+async def resume_broadcast(client, record):
+    payload = record['payload']
+    broadcast = Broadcast(
+        client, record['id'], payload['from_chat_id'], payload['message_id'],
+        after=payload['after'], counts=payload['counts'], done=payload.get('done', ())
+    )
+    job_store.add(record['id'], record['user_id'], "broadcast", broadcast.payload, state='running')
+    status = await client.send_message(record['user_id'], "📣 **Resuming broadcast after restart...**")
+    start_broadcast(broadcast, status)
+
+
+@Client.on_message(filters.command("broadcast") & filters.user(OWNER_ID))
+async def broadcast_command(client, message):
+    if len(message.command) > 1 and message.command[1] == "stop":
+        if not _running:
+            await message.reply_text("No broadcast is running.")
+            return
+        for job_id in list(_running):
+            _running.pop(job_id).cancel()
+        return
+
+    if not message.reply_to_message:
+        await message.reply_text("Reply to the message you want to broadcast with `/broadcast`.")
+        return
+    if _running:
+        await message.reply_text("A broadcast is already running. Use `/broadcast stop` first.")
+        return
+
+    job_id = uuid.uuid4().hex[:8]
+    broadcast = Broadcast(client, job_id, message.chat.id, message.reply_to_message.id)
+    job_store.add(job_id, message.from_user.id, "broadcast", broadcast.payload, state='running')
+    status = await message.reply_text("📣 **Starting broadcast...**")
+    start_broadcast(broadcast, status)
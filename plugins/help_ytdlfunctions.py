@@ -1,12 +1,10 @@
-import re
-import aiohttp
+from helpers import http_client
 
 async def get_file_extension_from_url(url):
-    async with aiohttp.ClientSession() as session:
-        async with session.head(url, allow_redirects=True) as response:
-            content_type = response.headers.get('Content-Type')
-            if content_type:
-                return content_type.split('/')[-1]
+    info = await http_client.probe(url)
+    content_type = info['content_type']
+    if content_type:
+        return content_type.split('/')[-1]
     return "jpg"
 
 def get_resolution(info_dict):
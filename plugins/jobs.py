@@ -0,0 +1,91 @@
+import logging
+
+from pyrogram import Client, filters
+
+from helpers.scheduler import scheduler
+from helpers.job_store import job_store
+from helpers.user_settings import user_settings
+from plugins.batch import cancel_batch
+
+logger = logging.getLogger(__name__)
+
+
+async def user_jobs(user_id):
+    """(id, name, queue position) of the user's jobs, here and at the broker"""
+    jobs = [(job.id, job.name, scheduler.position(job.id)) for job in scheduler.user_jobs(user_id)]
+    if scheduler.broker:
+        for job in await scheduler.broker.user_jobs(user_id):
+            jobs.append((job['id'], job['kind'], await scheduler.broker.position(job['id'])))
+    return [job for job in jobs if job[2] is not None]
+
+
+async def describe_jobs(user_id):
+    jobs = await user_jobs(user_id)
+    if not jobs:
+        return "📭 **You have no queued or running jobs.**"
+
+    lines = ["**Your jobs:**", ""]
+    for job_id, name, position in jobs:
+        status = "⚙️ running" if position == 0 else f"⏳ queued #{position}"
+        lines.append(f"• `{job_id}` {name} — {status}")
+    if not scheduler.broker:
+        lines.append("")
+        lines.append(f"Total queued: {scheduler.queue_depth()}")
+    lines.append("Use `/cancel <id>` to cancel a job.")
+    return "\n".join(lines)
+
+
+async def cancel_job(job_id, user_id):
+    """Cancel one of the user's jobs or batches wherever it runs; False if there was nothing to cancel"""
+    if cancel_batch(job_id, user_id):
+        return True
+    job = scheduler.get(job_id)
+    if job is not None:
+        return job.user_id == user_id and scheduler.cancel(job_id)
+    if scheduler.broker:
+        # Running jobs are stopped by their worker at its next heartbeat
+        return await scheduler.broker.cancel(job_id, user_id)
+    return False
+
+
+async def recover_jobs(client):
+    """
+    Re-queue jobs interrupted by the last restart; called by the bot once
+    `client` has started. job_store.recover() is a no-op after the first call.
+    The resumed jobs' settings are loaded in one query rather than per job.
+    """
+    try:
+        await job_store.recover(
+            client, prepare=lambda records: user_settings.prefetch(record['user_id'] for record in records)
+        )
+    except Exception as e:
+        logger.error(f"Job recovery failed: {str(e)}")
+
+
+@Client.on_message(filters.command("queue") & filters.private)
+async def queue_command(_, message):
+    await message.reply_text(await describe_jobs(message.from_user.id))
+
+
+@Client.on_message(filters.command("cancel") & filters.private)
+async def cancel_command(_, message):
+    if len(message.command) < 2:
+        await message.reply_text("Usage: `/cancel <job id>`")
+        return
+
+    job_id = message.command[1]
+    if not await cancel_job(job_id, message.from_user.id):
+        await message.reply_text("❌ No such job.")
+        return
+    await message.reply_text(f"🛑 Job `{job_id}` cancelled.")
+
+
+@Client.on_callback_query(filters.regex(r"^cancel_job\|"))
+async def cancel_job_callback(_, callback_query):
+    job_id = callback_query.data.split("|", 1)[1]
+    if not await cancel_job(job_id, callback_query.from_user.id):
+        await callback_query.answer("This job is no longer active.", show_alert=True)
+        return
+
+    await callback_query.answer("Cancelled")
+    await callback_query.edit_message_text("🛑 **Cancelled.**")
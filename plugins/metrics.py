@@ -0,0 +1,39 @@
+import logging
+
+from helpers import metrics, http_client, ytdl_service, media_probe
+from helpers.scheduler import scheduler
+from helpers.storage import storage
+from helpers.upload_cache import upload_cache
+
+logger = logging.getLogger(__name__)
+
+CACHES = {
+    'upload': upload_cache,
+    'ytdl_info': ytdl_service.info_cache,
+    'http_probe': http_client.probe_cache,
+    'media_probe': media_probe.media_cache,
+}
+
+
+def _disk():
+    return {'available': storage.available(), 'reserved': storage.reserved}
+
+
+# Computed when /metrics is scraped, so the hot paths pay nothing for these
+metrics.Gauge("uploader_queue_depth", "Jobs waiting for a scheduler slot",
+              collect=metrics.collector(scheduler.queue_depth))
+metrics.Gauge("uploader_running_jobs", "Jobs currently running",
+              collect=metrics.collector(scheduler.running))
+metrics.Gauge("uploader_disk_bytes", "Download disk space by kind", ["kind"], collect=metrics.collector(_disk))
+metrics.Counter("uploader_cache_hits_total", "Cache lookups served from cache", ["cache"],
+                collect=metrics.collector(lambda: {name: c.hits for name, c in CACHES.items()}))
+metrics.Counter("uploader_cache_misses_total", "Cache lookups that missed", ["cache"],
+                collect=metrics.collector(lambda: {name: c.misses for name, c in CACHES.items()}))
+
+
+async def start_metrics():
+    """Called once by the bot after it starts; a failure leaves the bot running without metrics"""
+    try:
+        await metrics.start_server()
+    except Exception as e:
+        logger.error(f"Metrics server failed to start: {str(e)}")
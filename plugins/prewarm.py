@@ -0,0 +1,26 @@
+import asyncio
+import logging
+
+from config import YTDL_PREWARM
+from helpers import ytdl_service
+
+logger = logging.getLogger(__name__)
+
+# Give the bot time to connect and answer its first updates before loading yt-dlp
+PREWARM_DELAY = 5
+
+
+async def prewarm_ytdl(delay=PREWARM_DELAY):
+    await asyncio.sleep(delay)
+    try:
+        await ytdl_service.prewarm()
+    except Exception as e:
+        logger.warning(f"yt-dlp prewarm failed: {str(e)}")
+
+
+# Plugins are imported inside Client.start(), with the bot's loop running
+if YTDL_PREWARM:
+    try:
+        asyncio.get_running_loop().create_task(prewarm_ytdl())
+    except RuntimeError:
+        pass
@@ -1,8 +1,9 @@
-import re
 import os
 import logging
-import aiohttp
-import time
+
+from helpers import http_client
+from helpers.downloader import download_file
+from helpers.progress import hub
 
 PROGRESS_BAR_TEMPLATE = """
 Percentage: {percentage} | {current}
@@ -28,22 +29,7 @@ async def async_download_file(url, filename, progress=None, progress_args=()):
     
     file_path = os.path.join(download_directory, filename)
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status != 200:
-                raise Exception("Download failed")
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded_size = 0
-
-            with open(file_path, "wb") as file:
-                async for chunk in response.content.iter_chunked(1024):
-                    file.write(chunk)
-                    downloaded_size += len(chunk)
-                    if progress:
-                        await progress(downloaded_size, total_size, *progress_args)
-    
-    return file_path
+    return await download_file(url, file_path, progress, progress_args)
 
 def file_size_format(num, suffix='B'):
     for unit in ['', 'Ki', 'Mi', 'Gi', 'Ti', 'Pi', 'Ei', 'Zi']:
@@ -53,38 +39,19 @@ def file_size_format(num, suffix='B'):
     return f"{num:.1f}Yi{suffix}"
 
 async def get_file_size(url):
-    async with aiohttp.ClientSession() as session:
-        async with session.head(url, allow_redirects=True) as response:
-            size = response.headers.get('content-length')
-            if size:
-                return int(size)
-            else:
-                return 0
+    info = await http_client.probe(url)
+    return info['size']
 
 async def get_filename(url):
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.head(url, allow_redirects=True) as response:
-                content_disposition = response.headers.get('Content-Disposition')
-                if content_disposition:
-                    filename_match = re.findall('filename="(.+)"', content_disposition)
-                    if filename_match:
-                        return filename_match[0]
-
-                return url.split('/')[-1].split('?')[0]
+        info = await http_client.probe(url)
+        return info['filename']
     except Exception as e:
         logging.error(f"Error fetching filename from headers: {str(e)}")
-        return url.split('/')[-1].split('?')[0]
+        return http_client.filename_from_url(url)
 
-async def progress(current, total, message, start, action):
-    now = time.time()
-    diff = now - start
-    
-    if diff < 1:
-        return
-    
-    speed = current / diff
-    percentage = (current * 100) / total
+def render_progress(tracker, action):
+    percentage = tracker.percentage
     
     # Premium progress bar
     bar_length = 10
@@ -92,16 +59,16 @@ async def progress(current, total, message, start, action):
     bar = "▰" * current_bar + "▱" * (bar_length - current_bar)
     
     # Calculate time remaining
-    time_to_completion = round((total - current) / speed)
-    estimated_total_time = TimeFormatter(time_to_completion)
+    eta = tracker.eta
+    estimated_total_time = TimeFormatter(eta * 1000) if eta is not None else "-"
     
     # Format speed and sizes
-    speed_text = f"{humanbytes(speed)}/s"
-    current_text = humanbytes(current)
-    total_text = humanbytes(total)
+    speed_text = f"{humanbytes(tracker.speed)}/s"
+    current_text = humanbytes(tracker.current)
+    total_text = humanbytes(tracker.total)
     
     # Premium-style progress message
-    progress_text = f"""
+    return f"""
 **{action} in Progress** 🚀
 
 {bar} `{percentage:.1f}%`
@@ -110,14 +77,18 @@ async def progress(current, total, message, start, action):
 **📊 Progress:** `{current_text} / {total_text}`
 **⏱ Time Left:** `{estimated_total_time}`
 """
-    
-    try:
-        await message.edit_text(
-            text=progress_text,
-            parse_mode='markdown'
-        )
-    except Exception:
-        pass
+
+async def progress(current, total, message, start, action):
+    """
+    Progress callback for downloads and uploads
+
+    Only records the byte counts; the shared progress hub samples them and
+    edits the message on its own throttled, FloodWait-aware schedule.
+    """
+    tracker = hub.get(message)
+    if tracker is None or tracker.label != action:
+        tracker = hub.track(message, lambda t: render_progress(t, action), total, label=action)
+    tracker.update(current, total)
 
 def TimeFormatter(milliseconds: int) -> str:
     seconds, milliseconds = divmod(int(milliseconds), 1000)
@@ -0,0 +1,258 @@
+import os
+import asyncio
+from pyrogram import enums
+from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from pyrogram import Client, filters
+
+from config import DOWNLOAD_LOCATION, SPLIT_UPLOADS
+from helpers import ytdl_service
+from helpers.scheduler import scheduler
+from helpers.job_store import job_store
+from helpers.storage import remove_quietly
+from helpers.media_probe import media_info
+from helpers.upload_engine import upload_limit
+from helpers.split_upload import upload_split
+from helpers.upload_cache import upload_cache, send_cached, ytdl_key, media_file_id
+from helpers.user_settings import user_settings, thumbnail_file
+from plugins.help_ytdlfunctions import get_resolution
+
+YTDL_REGEX = r"^((?:https?:)?\/\/)"
+YTDL_OUTTMPL = os.path.join(DOWNLOAD_LOCATION, "%(title)s - %(extractor)s-%(id)s.%(ext)s")
+AUDIO_FORMAT = "bestaudio"
+# DASH video and audio merged by ytdl_service; falls back to a progressive mp4
+VIDEO_FORMAT = "bestvideo[ext=mp4][height<=1080]+bestaudio[ext=m4a]/best[ext=mp4]/best"
+
+async def enqueue_ytdl(message, user_id, kind, job_id=None, url=None, ytdl_format=None):
+    """
+    Queue a yt-dlp job for the user and show its position with a cancel button
+
+    The link defaults to the text message was sent in reply to, and the
+    format to the kind's default.
+    """
+    func, default_format = YTDL_JOBS[kind]
+    url = url or message.reply_to_message.text
+    ytdl_format = ytdl_format or default_format
+    # Reserve disk for the expected file size; the extraction is cached for the job.
+    # Jobs handed to a worker process are sized there, when the worker resumes them
+    size = 0 if scheduler.is_remote(kind) else await ytdl_service.estimate_size(url, ytdl_format)
+    job_id, position = await scheduler.enqueue(
+        user_id, func, message, url, ytdl_format, size=size, job_id=job_id, kind=kind,
+        payload={'chat_id': message.chat.id, 'message_id': message.id, 'url': url, 'format': ytdl_format}
+    )
+    await message.edit_text(
+        f"**Queued at position {position}...**",
+        reply_markup=InlineKeyboardMarkup(
+            [[InlineKeyboardButton("✖️ Cancel", callback_data=f"cancel_job|{job_id}")]]
+        )
+    )
+
+@job_store.resumable("ytdl_audio")
+@job_store.resumable("ytdl_video")
+async def resume_ytdl(client, record):
+    """Re-queue a yt-dlp job from the button message it was started from"""
+    payload = record['payload']
+    message = await client.get_messages(payload['chat_id'], payload['message_id'])
+    if message.empty or not (payload.get('url') or message.reply_to_message):
+        raise ValueError("the job's messages were deleted")
+    await enqueue_ytdl(
+        message, record['user_id'], record['kind'], job_id=record['id'],
+        url=payload.get('url'), ytdl_format=payload.get('format')
+    )
+
+@Client.on_callback_query(filters.regex("^ytdl_audio$"))
+async def callback_query_ytdl_audio(_, callback_query):
+    await enqueue_ytdl(callback_query.message, callback_query.from_user.id, "ytdl_audio")
+
+async def ytdl_audio_job(message, url, ytdl_format=AUDIO_FORMAT):
+    try:
+        ydl_opts = {
+            "format": ytdl_format,
+            "outtmpl": YTDL_OUTTMPL,
+            "writethumbnail": True,
+        }
+        await message.reply_chat_action(enums.ChatAction.TYPING)
+        cache_key = ytdl_key(ytdl_service.cache_key(url), ydl_opts["format"])
+        cached = await send_cached(
+            message._client, message.chat.id, cache_key, parse_mode=enums.ParseMode.HTML
+        )
+        if not cached:
+            # download
+            await message.edit_text("**Downloading audio...**")
+            info_dict, audio_file = await ytdl_service.download(url, ydl_opts)
+            # upload
+            await upload_with_action(message, send_audio(message, info_dict, audio_file, cache_key))
+    except Exception as e:
+        # Re-raised so the scheduler records the job as failed
+        await message.reply_text(e)
+        await remove_messages(message)
+        raise
+    await remove_messages(message)
+
+async def upload_with_action(message, upload):
+    """Await the upload, showing the upload chat action until it ends"""
+    async def show_action():
+        while True:
+            await asyncio.sleep(3)
+            await message.reply_chat_action(enums.ChatAction.UPLOAD_DOCUMENT)
+
+    action = asyncio.create_task(show_action())
+    try:
+        await upload
+    finally:
+        action.cancel()
+    await message.reply_chat_action(enums.ChatAction.CANCEL)
+
+async def remove_messages(message):
+    """Delete the button message and the link it answered once the job is over"""
+    if message.reply_to_message:
+        await message.reply_to_message.delete()
+    await message.delete()
+
+def remove_downloads(info_dict, media_file):
+    """Delete a finished yt-dlp download and the thumbnails written next to it"""
+    remove_quietly(media_file)
+    for thumbnail in info_dict.get("thumbnails") or []:
+        if thumbnail.get("filepath"):
+            remove_quietly(thumbnail["filepath"])
+
+async def send_audio(message: Message, info_dict, audio_file, cache_key=None):
+    try:
+        await _send_audio(message, info_dict, audio_file, cache_key)
+    finally:
+        remove_downloads(info_dict, audio_file)
+        remove_quietly(audio_file.rsplit(".", 1)[-2] + ".weba")
+
+async def _send_audio(message: Message, info_dict, audio_file, cache_key=None):
+    basename = audio_file.rsplit(".", 1)[-2]
+    if info_dict["ext"] == "webm":
+        audio_file_weba = f"{basename}.weba"
+        os.rename(audio_file, audio_file_weba)
+        audio_file = audio_file_weba
+    probe = asyncio.ensure_future(media_info(audio_file, cache_key or audio_file))
+    thumb = await thumbnail_file(message._client, message.chat.id)
+    webpage_url = info_dict["webpage_url"]
+    title = info_dict["title"] or ""
+    caption = f'<b><a href="{webpage_url}">{title}</a></b>'
+    media = await probe or {}
+    duration = media.get("duration") or int(float(info_dict.get("duration") or 0))
+    performer = info_dict["uploader"] or ""
+    sent = await message.reply_audio(
+        audio_file,
+        caption=caption,
+        duration=duration,
+        performer=performer,
+        title=title,
+        parse_mode=enums.ParseMode.HTML,
+        thumb=thumb,
+    )
+    if cache_key:
+        await upload_cache.put(cache_key, media_file_id(sent), "audio", meta={'caption': caption})
+
+async def send_video(message: Message, info_dict, video_file, cache_key=None, as_doc=False):
+    try:
+        await _send_video(message, info_dict, video_file, cache_key, as_doc)
+    finally:
+        remove_downloads(info_dict, video_file)
+
+async def _send_video(message: Message, info_dict, video_file, cache_key=None, as_doc=False):
+    # ffprobe the real file while the caption is prepared; yt-dlp's metadata may be missing or off
+    probe = asyncio.ensure_future(media_info(video_file, cache_key or video_file))
+    thumb = await thumbnail_file(message._client, message.chat.id)
+    webpage_url = info_dict["webpage_url"]
+    title = info_dict["title"] or ""
+    caption = f'<b><a href="{webpage_url}">{title}</a></b>'
+    media = await probe or {}
+    if SPLIT_UPLOADS and os.path.getsize(video_file) > await upload_limit(message._client):
+        # Too big for one message: sent in parts, which aren't cached
+        await upload_split(
+            message._client, message.chat.id, video_file, os.path.basename(video_file), caption, media=media or None
+        )
+        return
+    if as_doc:
+        sent = await message.reply_document(
+            video_file,
+            caption=caption,
+            parse_mode=enums.ParseMode.HTML,
+            thumb=thumb or media.get("thumbnail"),
+        )
+        if cache_key:
+            await upload_cache.put(cache_key, media_file_id(sent), "document", meta={'caption': caption})
+        return
+    duration = media.get("duration") or int(float(info_dict.get("duration") or 0))
+    width, height = get_resolution(info_dict)
+    if media.get("width"):
+        width, height = media["width"], media["height"]
+    sent = await message.reply_video(
+        video_file,
+        caption=caption,
+        duration=duration,
+        width=width,
+        height=height,
+        parse_mode=enums.ParseMode.HTML,
+        thumb=thumb or media.get("thumbnail"),
+        supports_streaming=True,
+    )
+    if cache_key:
+        await upload_cache.put(cache_key, media_file_id(sent), "video", meta={'caption': caption})
+
+@Client.on_callback_query(filters.regex("^ytdl_video$"))
+async def callback_query_ytdl_video(_, callback_query):
+    await enqueue_ytdl(callback_query.message, callback_query.from_user.id, "ytdl_video")
+
+async def quality_format(url, format_id):
+    """
+    Format selector for a quality button's format_id
+
+    Video-only DASH streams get the best audio merged in, from the same
+    container family where there is one so ffmpeg can remux without
+    falling back to mkv.
+    """
+    info = await ytdl_service.extract_info(url)
+    fmt = next((f for f in info.get("formats") or [] if f.get("format_id") == format_id), None)
+    if fmt is None or fmt.get("acodec") != "none":
+        return format_id
+    audio_ext = "m4a" if fmt.get("ext") == "mp4" else "webm"
+    return f"{format_id}+ba[ext={audio_ext}]/{format_id}+ba"
+
+@Client.on_callback_query(filters.regex(r"^ytdl_video_quality\|"))
+async def callback_query_ytdl_video_quality(_, callback_query):
+    url, format_id = callback_query.data.split("|", 1)[1].rsplit("|", 1)
+    ytdl_format = await quality_format(url, format_id)
+    await enqueue_ytdl(
+        callback_query.message, callback_query.from_user.id, "ytdl_video", url=url, ytdl_format=ytdl_format
+    )
+
+async def ytdl_video_job(message, url, ytdl_format=VIDEO_FORMAT):
+    try:
+        ydl_opts = {
+            "format": ytdl_format,
+            "outtmpl": YTDL_OUTTMPL,
+            "writethumbnail": True,
+        }
+        await message.reply_chat_action(enums.ChatAction.TYPING)
+        as_doc = await user_settings.upload_as_doc(message.chat.id)
+        cache_key = ytdl_key(ytdl_service.cache_key(url), ydl_opts["format"])
+        if as_doc:
+            # Cached separately: the same download is sent as a file rather than a video
+            cache_key += "|document"
+        cached = await send_cached(
+            message._client, message.chat.id, cache_key, parse_mode=enums.ParseMode.HTML
+        )
+        if not cached:
+            # download
+            await message.edit_text("**Downloading video...**")
+            info_dict, video_file = await ytdl_service.download(url, ydl_opts)
+            # upload
+            await upload_with_action(message, send_video(message, info_dict, video_file, cache_key, as_doc))
+    except Exception as e:
+        # Re-raised so the scheduler records the job as failed
+        await message.reply_text(e)
+        await remove_messages(message)
+        raise
+    await remove_messages(message)
+
+
+YTDL_JOBS = {
+    "ytdl_audio": (ytdl_audio_job, AUDIO_FORMAT),
+    "ytdl_video": (ytdl_video_job, VIDEO_FORMAT),
+}
@@ -2,7 +2,8 @@ import asyncio
 import logging
 from pyrogram import types, errors, enums
 from plugins.config import Config
-from plugins.database.database import db
+from helpers.user_settings import user_settings, thumbnail_path
+from helpers.storage import remove_quietly
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +15,7 @@ async def open_settings(m: "types.Message"):
         m (types.Message): The message to edit with settings
     """
     usr_id = m.chat.id
-    user_data = await db.get_user_data(usr_id)
+    user_data = await user_settings.get(usr_id)
     
     if not user_data:
         await m.edit("❌ Failed to fetch your data from database!")
@@ -68,3 +69,41 @@ async def open_settings(m: "types.Message"):
             logger.error(f"Failed to retry settings: {retry_err}")
     except Exception as err:
         logger.error(f"Error in open_settings: {err}")
+
+
+async def toggle_upload_mode(cb: "types.CallbackQuery"):
+    """
+    Switch the user between video and file uploads, then redraw the menu
+    
+    Args:
+        cb (types.CallbackQuery): The triggerUploadMode button press
+    """
+    usr_id = cb.message.chat.id
+    upload_as_doc = await user_settings.upload_as_doc(usr_id)
+    await user_settings.set(usr_id, upload_as_doc=not upload_as_doc)
+    await open_settings(cb.message)
+
+
+async def save_thumbnail(m: "types.Message"):
+    """
+    Make the photo in m the user's custom thumbnail
+    
+    Args:
+        m (types.Message): The user's photo message
+    """
+    await user_settings.set(m.chat.id, thumbnail=m.photo.file_id)
+    # The local copy is of the old thumbnail; the next upload fetches the new one
+    remove_quietly(thumbnail_path(m.chat.id))
+    await m.reply_text("✅ **Custom thumbnail saved.**", quote=True)
+
+
+async def delete_thumbnail(m: "types.Message"):
+    """
+    Drop the user's custom thumbnail
+    
+    Args:
+        m (types.Message): The message asking for it
+    """
+    await user_settings.set(m.chat.id, thumbnail=None)
+    remove_quietly(thumbnail_path(m.chat.id))
+    await m.reply_text("🗑️ **Custom thumbnail deleted.**", quote=True)
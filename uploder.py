@@ -1,40 +1,46 @@
 import logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),  # Outputs to console
-        logging.FileHandler('bot.log')  # Outputs to a log file
-    ]
-)
+from helpers.log import setup_logging
+setup_logging()
 
 import os
 import re
 import uuid
+import mimetypes
 import time
 import asyncio
 import math
 import datetime
 import traceback
 
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from pyrogram.errors import FloodWait
 from pyrogram.enums import ParseMode
 
-import yt_dlp
 import aiohttp
-import aiofiles
 
 # Import config variables directly
 from config import (
     API_ID, API_HASH, BOT_TOKEN, SESSION_STRING, 
-    OWNER_ID, MAX_FILE_SIZE, DOWNLOAD_LOCATION
+    OWNER_ID, MAX_FILE_SIZE, DOWNLOAD_LOCATION, STREAM_UPLOAD, SPLIT_UPLOADS
 )
 
 # Utility functions
 from plugins.utils import get_filename, get_file_size, file_size_format
-from helpers.utils import async_download_file
+from helpers.utils import download_path
+from helpers.downloader import download_file
+from helpers.storage import storage, current_job
+from helpers.stream_upload import stream_url_to_chat
+from helpers.upload_engine import upload_document, upload_limit
+from helpers.split_upload import upload_split
+from helpers import http_client, ytdl_service
+from helpers.upload_cache import upload_cache, send_cached, url_key, content_key, media_file_id
+from helpers.ytdl_service import YOUTUBE_REGEX
+from helpers.media_probe import media_info, is_video
+from helpers.job_store import job_store
+from helpers.upload_engine import close_sessions
+from plugins.jobs import recover_jobs
+from plugins.metrics import start_metrics
 
 # Define text constants
 START_TEXT = """
@@ -60,6 +66,9 @@ HELP_TEXT = """
 • `/start` - Start the bot
 • `/help` - Show this help message
 • `/about` - About the bot
+• `/queue` - Show your queued and running jobs
+• `/cancel <id>` - Cancel one of your jobs
+• `/extract <link>` - Send the files inside a zip or tar archive
 • `/broadcast` - Broadcast a message (Owner only)
 
 **Usage:**
@@ -82,7 +91,6 @@ A powerful Telegram bot designed to make file downloading and uploading seamless
 pending_downloads = {}
 pending_renames = {}
 URL_REGEX = r'https?://[^\s<>"]+|www\.[^\s<>"]+'
-YOUTUBE_REGEX = r'(?:https?://)?(?:www\.)?(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/shorts/)([a-zA-Z0-9_-]+)'
 
 async def extract_youtube_info(url):
     ydl_opts = {
@@ -93,68 +101,162 @@ async def extract_youtube_info(url):
     }
     
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            formats = info.get('formats', [])
-            
-            # Get best quality format
-            for f in formats:
-                return {
-                    'url': f['url'],
-                    'title': info.get('title', 'video'),
-                    'duration': info.get('duration'),
-                    'filesize': f.get('filesize', 0)
-                }
-            
-            return None
+        info = await ytdl_service.extract_info(url, **ydl_opts)
+        formats = info.get('formats', [])
+        
+        # Get best quality format
+        for f in formats:
+            return {
+                'url': f['url'],
+                'title': info.get('title', 'video'),
+                'duration': info.get('duration'),
+                'filesize': f.get('filesize', 0)
+            }
+        
+        return None
     except Exception as e:
         logging.error(f"YouTube extraction error: {str(e)}")
         return None
 
-async def send_file(client, chat_id, document, file_name, caption=None, progress=None, progress_args=None):
-    """Send file to chat"""
+def looks_like_video(file_name, content_type=None):
+    return any((t or "").startswith("video/") for t in (content_type, mimetypes.guess_type(file_name)[0]))
+
+def probe_in_background(source, key, file_name, content_type=None):
+    """Start probing a likely video for duration, dimensions and thumbnail while the upload runs"""
+    if not looks_like_video(file_name, content_type):
+        return None
+    return asyncio.ensure_future(media_info(source, key))
+
+async def send_file(client, chat_id, document, file_name, caption=None, progress=None, progress_args=None,
+                    cache_key=None, validator=None, media=None):
+    """
+    Send file to chat, reusing an earlier upload of the same content when cached
+
+    `media` is a media_info() result or a task producing one; videos are then
+    sent streamable with their duration, dimensions and thumbnail.
+    """
     try:
-        return await client.send_document(
-            chat_id=chat_id,
-            document=document,
-            caption=caption,
-            file_name=file_name,
-            progress=progress,
-            progress_args=progress_args
+        if cache_key:
+            cached = await send_cached(client, chat_id, cache_key, validator, caption=caption)
+            if cached:
+                return cached
+
+        if SPLIT_UPLOADS and os.path.getsize(document) > await upload_limit(client):
+            # Sent in parts; the manifest returned has no file_id to cache
+            return await upload_split(
+                client, chat_id, document, file_name, caption, progress, progress_args or (), media
+            )
+
+        # Big files go over parallel media sessions; small ones gain nothing from it
+        sent = await upload_document(
+            client, chat_id, document, file_name, caption, progress, progress_args or (), media
         )
+        if sent is None and asyncio.isfuture(media):
+            media = await media
+        if sent is None and is_video(media):
+            sent = await client.send_video(
+                chat_id=chat_id,
+                video=document,
+                caption=caption,
+                file_name=file_name,
+                duration=media['duration'],
+                width=media['width'],
+                height=media['height'],
+                thumb=media['thumbnail'],
+                supports_streaming=True,
+                progress=progress,
+                progress_args=progress_args
+            )
+        if sent is None:
+            sent = await client.send_document(
+                chat_id=chat_id,
+                document=document,
+                caption=caption,
+                file_name=file_name,
+                progress=progress,
+                progress_args=progress_args
+            )
+        if cache_key and sent:
+            await upload_cache.put(cache_key, media_file_id(sent), "document", validator)
+        return sent
     except Exception as e:
         logging.error(f"Error in send_file: {str(e)}")
         raise
 
+async def upload_url(client, chat_id, url, file_name, caption=None, progress=None, progress_args=()):
+    """Download url and send it to chat, streaming it straight through when possible"""
+    key = url_key(url)
+    info = await http_client.probe(url)
+    validator = info['etag'] or info['last_modified']
+
+    cached = await send_cached(client, chat_id, key, validator, caption=caption)
+    if cached:
+        return cached
+
+    sent = None
+    media = None
+    if STREAM_UPLOAD:
+        # ffprobe reads the headers straight from the URL while the body streams
+        media = probe_in_background(url, key, file_name, info['content_type'])
+        try:
+            sent = await stream_url_to_chat(
+                client, chat_id, url, file_name, caption, progress, progress_args, media
+            )
+        except Exception as e:
+            logging.error(f"Streaming upload failed, retrying via disk: {str(e)}")
+
+    if not sent:
+        # Inside a scheduler job the file is the job's, kept with its journal when the job
+        # is interrupted so the resumed job continues it. Anywhere else nothing would resume
+        # it: it gets its own reservation, which fails fast when the file can't fit, and
+        # release() deletes it however this ends
+        reservation = None if current_job.get() else f"url-{uuid.uuid4().hex[:8]}"
+        if reservation:
+            storage.reserve(reservation, info['size'] or 0)
+        file_path = download_path(file_name, reservation)
+        storage.track(file_path, reservation)
+        try:
+            file_path = await download_file(url, file_path, progress, progress_args)
+            # Same bytes behind a different URL still skip the upload
+            file_key = await content_key(file_path)
+            media = media or probe_in_background(file_path, file_key, file_name, info['content_type'])
+            sent = await send_file(
+                client, chat_id, file_path, file_name, caption, progress, progress_args,
+                cache_key=file_key, media=media
+            )
+        finally:
+            if reservation:
+                storage.release(reservation)
+            if media is not None and not media.done():
+                media.cancel()
+
+    if sent and media_file_id(sent):
+        await upload_cache.put(key, media_file_id(sent), "document", validator)
+    return sent
+
 async def process_youtube(client, message, url):
     try:
-        progress_msg = await message.reply_text("🎥 **Processing YouTube Link...**")
-        
-        # Extract info with yt-dlp to get detailed format information
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(url, download=False)
+        progress_msg = await message.reply_text("🎥 **Processing YouTube Link...**", quote=True)
         
-        # Get full video information
-        full_info = yt_dlp.YoutubeDL().extract_info(url, download=False)
+        # Extract full video information once; the download reuses the cached result
+        full_info = await ytdl_service.extract_info(url)
+        info_dict = full_info
         
         # Prepare video qualities keyboard
         video_buttons = []
         current_row = []
         
-        # Filter and sort video formats
+        # Filter and sort video formats, DASH video-only streams in any container included
         video_formats = [
             f for f in full_info.get('formats', []) 
-            if f.get('height') and f.get('ext') == 'mp4'
+            if f.get('height') and f.get('vcodec') != 'none'
         ]
         
-        # Sort formats by resolution
-        video_formats.sort(key=lambda x: x.get('height', 0), reverse=True)
+        # Sort formats by resolution; within one, mp4 (streamable in Telegram) first, then bitrate.
+        # Resolutions only offered as webm (e.g. 1440p and up on YouTube) still get a button
+        video_formats.sort(
+            key=lambda x: (x.get('height', 0), x.get('ext') == 'mp4', x.get('tbr') or 0), reverse=True
+        )
         
         # Create buttons for unique resolutions
         seen_resolutions = set()
@@ -177,3 +279,43 @@ async def process_youtube(client, message, url):
         # Add any remaining buttons
         if current_row:
             video_buttons.append(current_row)
+
+        # The audio button answers the link message, which progress_msg replies to
+        video_buttons.append([InlineKeyboardButton("🎵 Audio", callback_data="ytdl_audio")])
+        await progress_msg.edit_text(
+            f"🎥 **{info_dict.get('title', 'Video')}**\n\nChoose a quality:",
+            reply_markup=InlineKeyboardMarkup(video_buttons)
+        )
+    except Exception as e:
+        logging.error(f"YouTube processing error: {str(e)}")
+        await message.reply_text(f"❌ **Error:** {str(e)}")
+
+async def on_startup(client):
+    """Work that needs the started client; runs once, right after app.start()"""
+    asyncio.create_task(recover_jobs(client))
+    asyncio.create_task(start_metrics())
+
+async def on_shutdown():
+    """Write out job states the store is still batching, then close shared connections"""
+    await job_store.flush()
+    await close_sessions()
+    await http_client.close_session()
+
+async def main():
+    app = Client(
+        "uploader",
+        api_id=API_ID,
+        api_hash=API_HASH,
+        bot_token=BOT_TOKEN,
+        plugins=dict(root="plugins")
+    )
+    await app.start()
+    try:
+        await on_startup(app)
+        await idle()
+    finally:
+        await on_shutdown()
+        await app.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+import logging
+import multiprocessing
+from helpers.log import setup_logging, log_path
+# Spawned worker processes re-import this module; they set up their own log file in _process
+if multiprocessing.parent_process() is None:
+    setup_logging(path=log_path("worker"))
+
+import os
+import time
+import uuid
+import signal
+import socket
+import asyncio
+import argparse
+
+from pyrogram import Client
+
+from config import (
+    API_ID, API_HASH, BOT_TOKEN, BROKER_LEASE, MAX_CONCURRENT_JOBS, WORKER_PROCESSES, YTDL_PREWARM
+)
+from helpers import http_client
+from helpers.broker import broker
+from helpers.scheduler import scheduler
+from helpers.job_store import job_store, FINISHED_RETENTION
+from helpers.upload_engine import close_sessions
+
+# Registers the resume handlers of the job kinds the bot hands to workers
+import plugins.youtube_dl_handler  # noqa: F401,E402
+import plugins.archive  # noqa: F401,E402
+from plugins.prewarm import prewarm_ytdl  # noqa: E402
+
+logger = logging.getLogger("worker")
+
+POLL_INTERVAL = 1
+HEARTBEAT_INTERVAL = 5
+
+
+class Worker:
+    """
+    Runs jobs the bot queued at the broker on this process's scheduler
+
+    A claimed job is rebuilt by its kind's resume handler, the same way jobs
+    are rebuilt after a restart, and the job store writes its state,
+    progress and checkpoints back to the broker. Heartbeats keep the leases
+    of the claimed jobs alive and deliver /cancel requests. Jobs still
+    running at shutdown go back to the queue; those of a worker that dies
+    are claimed again once their lease lapses and resume from their last
+    checkpoint, so a job may run more than once but is never lost.
+    """
+
+    def __init__(self, client, broker, slots=MAX_CONCURRENT_JOBS, lease=BROKER_LEASE):
+        self.client = client
+        self.broker = broker
+        self.slots = slots
+        self.lease = lease
+        self.id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:4]}"
+
+    def _active(self):
+        return [job.id for job in scheduler.jobs()]
+
+    async def _start(self, record):
+        handler = job_store.handler(record['kind'])
+        try:
+            if handler is None:
+                raise ValueError(f"no resume handler for {record['kind']!r}")
+            await handler(self.client, record)
+        except Exception as e:
+            logger.warning(f"Dropping job {record['id']}: {str(e)}")
+            await self.broker.write({record['id']: {'state': 'lost', 'updated': time.time()}})
+
+    async def _claim_loop(self):
+        while True:
+            record = None
+            if len(self._active()) < self.slots:
+                try:
+                    record = await self.broker.claim(self.id, self.lease)
+                except Exception as e:
+                    logger.error(f"Claiming a job failed: {str(e)}")
+            if record is None:
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            logger.info(f"Claimed job {record['id']} ({record['kind']}) for user {record['user_id']}")
+            await self._start(record)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                for job_id in await self.broker.heartbeat(self.id, self._active(), self.lease):
+                    scheduler.cancel(job_id)
+            except Exception as e:
+                logger.error(f"Heartbeat failed: {str(e)}")
+
+    async def run(self):
+        # Claimed jobs run here; with the broker set they would only be queued again
+        scheduler.broker = None
+        job_store.backend = self.broker
+        await self.broker.purge(time.time() - FINISHED_RETENTION)
+
+        tasks = [asyncio.create_task(self._claim_loop()), asyncio.create_task(self._heartbeat_loop())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Write the last states first, so released jobs aren't marked running again
+            await job_store.flush()
+            await self.broker.release(self.id, self._active())
+
+
+async def run_worker(index):
+    client = Client(
+        f"worker-{index}",
+        api_id=API_ID,
+        api_hash=API_HASH,
+        bot_token=BOT_TOKEN,
+        no_updates=True,
+        # Several workers share the working directory; none needs a session file
+        in_memory=True
+    )
+    task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    async with client:
+        if YTDL_PREWARM:
+            asyncio.create_task(prewarm_ytdl())
+        worker = Worker(client, broker)
+        logger.info(f"Worker {worker.id} started with {worker.slots} job slots")
+        try:
+            await worker.run()
+        except asyncio.CancelledError:
+            logger.info(f"Worker {worker.id} stopping")
+        finally:
+            await close_sessions()
+            await http_client.close_session()
+
+
+def _process(index):
+    setup_logging(path=log_path(f"worker-{index}"))
+    asyncio.run(run_worker(index))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run download/upload workers for the jobs the bot queues")
+    parser.add_argument('--processes', type=int, default=WORKER_PROCESSES)
+    args = parser.parse_args()
+
+    if broker is None:
+        raise SystemExit("BROKER_URL is not set; jobs run inside the bot process")
+    if args.processes <= 1:
+        _process(0)
+        return
+
+    # Spawned, so every process sets up its own logging thread and connections
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_process, args=(index,)) for index in range(args.processes)]
+    for process in processes:
+        process.start()
+    signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()